@@ -0,0 +1,186 @@
+# coding: utf8
+# batch_plot.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Plot gerber/drill and design files of many boards in a worker pool '''
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import output_zip
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+BOARD_EXT = '.kicad_pcb'
+
+OUTPUTS = {
+    'gerber': 'plot_gerber_and_drill',
+    'design': 'plot_design',
+}
+
+# KiCad backup and output directories never hold boards to plot
+SKIP_DIRS = ('_generated_files', '.git')
+SKIP_DIR_SUFFIX = '-backups'
+SKIP_FILE_PREFIX = '_autosave-'
+
+
+def find_boards(paths):
+    boards = []
+    for path in paths:
+        if os.path.isfile(path):
+            boards.append(os.path.abspath(path))
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames
+                                 if d not in SKIP_DIRS and not d.endswith(SKIP_DIR_SUFFIX))
+            for filename in sorted(filenames):
+                if filename.endswith(BOARD_EXT) and not filename.startswith(SKIP_FILE_PREFIX):
+                    boards.append(os.path.abspath(dirpath + os.path.sep + filename))
+
+    return boards
+
+
+def get_output_summary(module, board_file, path=None):
+    if path is None:
+        path = os.path.dirname(board_file) + os.path.sep + module.OUTPUT_DIR
+    files = {}
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if os.path.isfile(path + os.path.sep + name):
+                files[name] = os.path.getsize(path + os.path.sep + name)
+
+    return {
+        'path': path,
+        'bytes': sum(files.values()),
+        'files': files,
+    }
+
+
+def _init_worker():
+    # pay for the pcbnew import once per worker, not once per board
+    import pcbnew
+    for module_name in OUTPUTS.values():
+        importlib.import_module(module_name)
+
+
+def process_board_file(board_file, outputs, force, layer_jobs, zip_options, load_board=None,
+                       empty_layers=False, unique_output=False):
+    import pcbnew
+    if load_board is None:
+        load_board = pcbnew.LoadBoard
+
+    result = {'board': board_file, 'outputs': {}}
+    start = time.perf_counter()
+    board = None
+    try:
+        for output in outputs:
+            module = importlib.import_module(OUTPUTS[output])
+            output_start = time.perf_counter()
+
+            path = None
+            fresh = not force and not unique_output
+            if fresh and module.is_up_to_date(board_file, empty_layers,
+                                              zip_options=zip_options):
+                status = 'up-to-date'
+            else:
+                if board is None:
+                    board = load_board(board_file)
+                path = module.process_board(board, layer_jobs, use_cache=not force,
+                                            zip_options=zip_options, empty_layers=empty_layers,
+                                            unique_output=unique_output)
+                status = 'ok'
+
+            summary = get_output_summary(module, board_file, path)
+            summary['status'] = status
+            summary['duration'] = round(time.perf_counter() - output_start, 3)
+            result['outputs'][output] = summary
+
+        result['status'] = 'ok'
+    except Exception:
+        result['status'] = 'error'
+        result['error'] = traceback.format_exc()
+
+    result['duration'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def process_boards(board_files, outputs, jobs=None, force=False, layer_jobs=1,
+                   zip_options=None, empty_layers=False, unique_output=False):
+    results = []
+    # spawn: forking a process with a loaded pcbnew is not safe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=_init_worker) as executor:
+        futures = [executor.submit(process_board_file, board_file, outputs, force,
+                                   layer_jobs, zip_options, empty_layers=empty_layers,
+                                   unique_output=unique_output)
+                   for board_file in board_files]
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    results.sort(key=lambda result: result['board'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plot files of many boards')
+    parser.add_argument('paths', nargs='+', help='.kicad_pcb files or directories to search')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes, CPU count by default')
+    parser.add_argument('-o', '--outputs', default=','.join(sorted(OUTPUTS)),
+                        help='comma separated outputs: ' + ', '.join(sorted(OUTPUTS)))
+    parser.add_argument('-l', '--layer-jobs', type=int, default=1,
+                        help='worker processes for plotting layers of one board, '
+                             '0 picks it from the board size')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='plot even if the board and options did not change')
+    parser.add_argument('-e', '--empty-layers', action='store_true',
+                        help='plot layers without items too, for fabs which want every file')
+    parser.add_argument('-u', '--unique-output', action='store_true',
+                        help='write to a new directory named after the run time and process')
+    output_zip.add_arguments(parser)
+    args = parser.parse_args()
+
+    outputs = [output for output in args.outputs.split(',') if output]
+    for output in outputs:
+        if output not in OUTPUTS:
+            parser.error('unknown output: ' + output)
+
+    start = time.perf_counter()
+    results = process_boards(find_boards(args.paths), outputs, args.jobs, args.force,
+                             args.layer_jobs, output_zip.get_options(args),
+                             args.empty_layers, args.unique_output)
+
+    json.dump({
+        'duration': round(time.perf_counter() - start, 3),
+        'boards': results,
+    }, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+    return 1 if any(result['status'] != 'ok' for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
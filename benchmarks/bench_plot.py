@@ -0,0 +1,331 @@
+# coding: utf8
+# bench_plot.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Benchmark of the plot plugins on synthetic boards
+
+  python benchmarks/bench_plot.py run -o results.json
+  python benchmarks/bench_plot.py compare baseline.json results.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pcbnew
+import plot_design
+import plot_gerber_and_drill
+import plot_timing
+
+from version import VERSION
+
+
+CASES = {
+    'small': {'footprints': 50, 'tracks': 300, 'layers': 2, 'zones': 0, 'size': 50},
+    'medium': {'footprints': 500, 'tracks': 3000, 'layers': 4, 'zones': 2, 'size': 100},
+    'large': {'footprints': 2000, 'tracks': 20000, 'layers': 8, 'zones': 6, 'size': 200},
+    'backplane': {'footprints': 1500, 'tracks': 30000, 'layers': 16, 'zones': 14, 'size': 300},
+}
+
+OUTPUTS = {
+    'gerber': plot_gerber_and_drill,
+    'design': plot_design,
+}
+
+THRESHOLD = 10.0
+
+
+def mm(value):
+    return pcbnew.FromMM(value)
+
+
+def point(x, y):
+    return pcbnew.VECTOR2I(mm(x), mm(y))
+
+
+def get_copper_layers(board):
+    count = board.GetDesignSettings().GetCopperLayerCount()
+    return [pcbnew.F_Cu] + [pcbnew.In1_Cu + i for i in range(count - 2)] + [pcbnew.B_Cu]
+
+
+def add_outline(board, size):
+    outline = pcbnew.PCB_SHAPE(board)
+    outline.SetShape(pcbnew.SHAPE_T_RECT)
+    outline.SetStart(point(0, 0))
+    outline.SetEnd(point(size, size))
+    outline.SetLayer(pcbnew.Edge_Cuts)
+    outline.SetWidth(mm(0.1))
+    board.Add(outline)
+
+
+def add_footprint(board, rnd, index, size):
+    footprint = pcbnew.FOOTPRINT(board)
+    footprint.SetReference('U{0}'.format(index + 1))
+    footprint.SetValue('BENCH')
+    board.Add(footprint)
+    footprint.SetPosition(point(rnd.uniform(5, size - 5), rnd.uniform(5, size - 5)))
+
+    pads = 2 + index % 14
+    for i in range(pads):
+        pad = pcbnew.PAD(footprint)
+        pad.SetNumber(str(i + 1))
+        pad.SetShape(pcbnew.PAD_SHAPE_RECT)
+        pad.SetAttribute(pcbnew.PAD_ATTRIB_SMD)
+        pad.SetLayerSet(pad.SMDMask())
+        pad.SetSize(point(0.6, 1.2))
+        pad.SetPos0(point(0.8 * (i - pads / 2), 0))
+        footprint.Add(pad)
+        pad.SetPosition(footprint.GetPosition() + pad.GetPos0())
+
+    silk = pcbnew.FP_SHAPE(footprint)
+    silk.SetShape(pcbnew.SHAPE_T_RECT)
+    silk.SetStart0(point(-0.4 * pads - 0.5, -1.2))
+    silk.SetEnd0(point(0.4 * pads + 0.5, 1.2))
+    silk.SetLayer(pcbnew.F_SilkS)
+    silk.SetWidth(mm(0.12))
+    footprint.Add(silk)
+    silk.SetDrawCoord()
+
+    # some parts on the bottom side, so both sides have something to plot
+    if rnd.random() < 0.3:
+        footprint.Flip(footprint.GetPosition(), False)
+
+
+def add_tracks(board, rnd, count, size):
+    layers = get_copper_layers(board)
+    for i in range(count):
+        x = rnd.uniform(1, size - 1)
+        y = rnd.uniform(1, size - 1)
+        length = rnd.uniform(1, 10)
+        track = pcbnew.PCB_TRACK(board)
+        track.SetStart(point(x, y))
+        if i % 2:
+            track.SetEnd(point(min(x + length, size - 1), y))
+        else:
+            track.SetEnd(point(x, min(y + length, size - 1)))
+        track.SetWidth(mm(0.2))
+        track.SetLayer(layers[i % len(layers)])
+        board.Add(track)
+
+        if i % 10 == 0:
+            via = pcbnew.PCB_VIA(board)
+            via.SetPosition(point(x, y))
+            via.SetWidth(mm(0.6))
+            via.SetDrill(mm(0.3))
+            board.Add(via)
+
+
+def add_zones(board, count, size):
+    layers = get_copper_layers(board)
+    for i in range(count):
+        zone = pcbnew.ZONE(board)
+        zone.SetLayer(layers[i % len(layers)])
+        zone.SetIslandRemovalMode(pcbnew.ISLAND_REMOVAL_MODE_NEVER)
+        outline = zone.Outline()
+        outline.NewOutline()
+        for x, y in ((0.5, 0.5), (size - 0.5, 0.5), (size - 0.5, size - 0.5), (0.5, size - 0.5)):
+            outline.Append(mm(x), mm(y))
+        board.Add(zone)
+
+    if count:
+        board.BuildConnectivity()
+        pcbnew.ZONE_FILLER(board).Fill(board.Zones())
+
+
+def generate_board(file_name, footprints, tracks, layers, zones, size, seed=0):
+    ''' Synthetic board, the same parameters and seed give the same board '''
+    rnd = random.Random(seed)
+    board = pcbnew.NewBoard(file_name)
+    board.SetCopperLayerCount(layers)
+    board.GetDesignSettings().SetAuxOrigin(point(0, size))
+
+    add_outline(board, size)
+    for i in range(footprints):
+        add_footprint(board, rnd, i, size)
+    add_tracks(board, rnd, tracks, size)
+    add_zones(board, zones, size)
+
+    pcbnew.SaveBoard(file_name, board)
+
+
+def read_stages(path):
+    try:
+        with open(path + os.path.sep + plot_timing.TIMINGS_NAME, 'r') as f:
+            stages = json.load(f)['stages']
+    except (OSError, ValueError):
+        return {}
+
+    totals = {}
+    for record in stages:
+        totals[record['stage']] = round(totals.get(record['stage'], 0) + record['wall'], 6)
+    return totals
+
+
+def run_case(work_dir, name, params, outputs, jobs_list, repeat):
+    board_file = work_dir + os.path.sep + name + '.kicad_pcb'
+    start = time.perf_counter()
+    generate_board(board_file, **params)
+    generate_time = time.perf_counter() - start
+
+    results = []
+    for output in outputs:
+        module = OUTPUTS[output]
+        for jobs in jobs_list:
+            times = []
+            stages = {}
+            for i in range(repeat):
+                board = pcbnew.LoadBoard(board_file)
+                start = time.perf_counter()
+                module.process_board(board, jobs)
+                times.append(time.perf_counter() - start)
+                stages = read_stages(module.get_output_abs_path(board))
+
+            results.append({
+                'case': name,
+                'params': params,
+                'output': output,
+                'jobs': jobs,
+                'generate': round(generate_time, 3),
+                'times': [round(t, 4) for t in times],
+                'min': round(min(times), 4),
+                'median': round(statistics.median(times), 4),
+                'stages': stages,
+            })
+            print('{0:>10} {1:>7} jobs={2:<3} median {3:.3f}s'.format(
+                name, output, jobs, results[-1]['median']), file=sys.stderr)
+
+    return results
+
+
+def run(args):
+    os.environ[plot_timing.ENV_VAR] = '1'
+
+    cases = dict((name, CASES[name]) for name in args.cases.split(','))
+    if args.footprints is not None:
+        cases = {'custom': {
+            'footprints': args.footprints,
+            'tracks': args.tracks,
+            'layers': args.layers,
+            'zones': args.zones,
+            'size': args.size,
+        }}
+
+    jobs_list = [int(jobs) for jobs in args.jobs.split(',')]
+    outputs = args.outputs.split(',')
+
+    work_dir = tempfile.mkdtemp(prefix='kicad_plugins_bench-')
+    try:
+        results = []
+        for name, params in cases.items():
+            results += run_case(work_dir, name, params, outputs, jobs_list, args.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'version': VERSION,
+        'kicad': pcbnew.GetBuildVersion(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 0
+
+
+def result_key(result):
+    return (result['case'], result['output'], result['jobs'])
+
+
+def compare(args):
+    with open(args.baseline, 'r') as f:
+        baseline = dict((result_key(r), r) for r in json.load(f)['results'])
+    with open(args.current, 'r') as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    for result in current:
+        key = result_key(result)
+        if key not in baseline:
+            print('{0} {1} jobs={2}: no baseline'.format(*key))
+            continue
+
+        before = baseline[key]['median']
+        after = result['median']
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('{0} {1} jobs={2}: {3:.3f}s -> {4:.3f}s ({5:+.1f}%){6}'.format(
+            key[0], key[1], key[2], before, after, change, flag))
+
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the plot plugins')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='generate boards and time the plugins')
+    run_parser.add_argument('-c', '--cases', default='small,medium,large',
+                            help='comma separated cases: ' + ', '.join(CASES))
+    run_parser.add_argument('-o', '--output', help='results file, stdout by default')
+    run_parser.add_argument('--outputs', default='gerber,design',
+                            help='comma separated plugins to run: gerber, design')
+    run_parser.add_argument('-j', '--jobs', default='1',
+                            help='comma separated layer worker counts to run')
+    run_parser.add_argument('-r', '--repeat', type=int, default=3,
+                            help='runs per case, the median is compared')
+    run_parser.add_argument('--footprints', type=int, help='custom case: footprint count')
+    run_parser.add_argument('--tracks', type=int, default=1000, help='custom case: track count')
+    run_parser.add_argument('--layers', type=int, default=4,
+                            help='custom case: copper layer count')
+    run_parser.add_argument('--zones', type=int, default=2,
+                            help='custom case: filled zone count')
+    run_parser.add_argument('--size', type=float, default=100,
+                            help='custom case: board side in mm')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions between results')
+    compare_parser.add_argument('baseline', help='baseline results file')
+    compare_parser.add_argument('current', help='current results file')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=THRESHOLD,
+                                help='regression threshold in percent of the median')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        return run(args)
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
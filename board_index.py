@@ -0,0 +1,102 @@
+# coding: utf8
+# board_index.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Board metadata collected in one pass over the board items '''
+
+import collections
+import pcbnew
+import plot_timing
+
+
+def iter_items(board):
+    ''' Yields (item, footprint) of the board items and the items of its footprints
+
+    footprint is None for board items.
+    '''
+    for items in (board.GetTracks(), board.Zones(), board.GetDrawings()):
+        for item in items:
+            yield item, None
+
+    for footprint in board.GetFootprints():
+        yield footprint.Reference(), footprint
+        yield footprint.Value(), footprint
+        for items in (footprint.GraphicalItems(), footprint.Pads(), footprint.Zones()):
+            for item in items:
+                yield item, footprint
+
+
+def get_zone_vertex_count(zone, layer):
+    if zone.IsFilled():
+        return zone.GetFilledPolysList(layer).TotalVertices()
+    return zone.Outline().TotalVertices()
+
+
+class BoardIndex(object):
+    ''' Texts, title block and per layer counts of a board
+
+    Built once per run and shared by the plugins, the empty layer check,
+    the layer scheduler and the manifest. The board must not change while
+    the index is in use.
+    '''
+
+    def __init__(self, board):
+        self.file_name = board.GetFileName()
+        self.copper_layer_count = board.GetDesignSettings().GetCopperLayerCount()
+
+        title_block = board.GetTitleBlock()
+        self.comments = [title_block.GetComment(i) for i in range(9)]
+
+        # texts of the board (not footprint) text items, in board order
+        self.texts = [item.GetText() for item in board.GetDrawings()
+                      if type(item) is pcbnew.PCB_TEXT]
+        # footprints count as one item
+        self.item_count = len(board.GetTracks()) + len(board.GetFootprints()) + \
+                          len(board.Zones()) + len(board.GetDrawings())
+        self.holes = 0
+        # {layer id: count}
+        self.items = collections.Counter()
+        self.pads = collections.Counter()
+        self.zones = collections.Counter()
+        self.zone_vertices = collections.Counter()
+
+        with plot_timing.span('board_index'):
+            self.scan(board)
+
+    def scan(self, board):
+        for item, footprint in iter_items(board):
+            item_type = type(item)
+            layers = item.GetLayerSet().Seq()
+            self.items.update(layers)
+
+            if item_type is pcbnew.PCB_VIA:
+                self.holes += 1
+            elif isinstance(item, pcbnew.PAD):
+                self.pads.update(layers)
+                if item.GetDrillSize().x > 0:
+                    self.holes += 1
+            elif isinstance(item, pcbnew.ZONE):
+                self.zones.update(layers)
+                for layer in layers:
+                    self.zone_vertices[layer] += get_zone_vertex_count(item, layer)
+
+    def is_used(self, layer):
+        return self.items[layer] > 0
+
+    def get_layer_items(self, layers):
+        ''' Returns {layer name: item count} of (layer id, name, options) layers '''
+        return dict((name, self.items[layer]) for layer, name, options in layers)
@@ -18,11 +18,16 @@
 ''' KiCad PCBNew Footprint Wizard script for creating CFP Russian housings '''
 
 from __future__ import division
+import os
 import pcbnew
+import plot_timing
+import tempfile
 
 import FootprintWizardBase
 import PadArray as PA
 
+TRACE_NAME = 'cfp_rus_wizard-trace.json'
+
 
 class CFPRUSWizard(FootprintWizardBase.FootprintWizard):
     ''' Plugin class '''
@@ -65,6 +70,13 @@ class CFPRUSWizard(FootprintWizardBase.FootprintWizard):
     def CheckParameters(self):
         pass
 
+    def BuildFootprint(self):
+        with plot_timing.span('BuildFootprint', wizard=self.GetName()):
+            FootprintWizardBase.FootprintWizard.BuildFootprint(self)
+
+        if plot_timing.is_tracing():
+            plot_timing.write_trace(tempfile.gettempdir() + os.path.sep + TRACE_NAME)
+
     def GetValue(self):
         return "CFP-%d" % ((self.parameters["Pads"][self.n_v_key] * 2 +
                             self.parameters["Pads"][self.n_h_key] * 2))
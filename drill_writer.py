@@ -0,0 +1,77 @@
+# coding: utf8
+# drill_writer.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Excellon drill files and drill maps of a board
+
+Both come from one EXCELLON_WRITER with the same settings. When both the
+gerber and the design outputs are made, one call writes the drill files
+and the maps to a shared directory and each output links its own part.
+'''
+
+import os
+import output_staging
+import pcbnew
+import plot_timing
+
+
+# KiCad names the maps <board>[-PTH|-NPTH]-drl_map.<ext>
+MAP_MARK = '-drl_map'
+
+MAP_FORMATS = {
+    'dxf': pcbnew.PLOT_FORMAT_DXF,
+    'gerber': pcbnew.PLOT_FORMAT_GERBER,
+    'pdf': pcbnew.PLOT_FORMAT_PDF,
+    'ps': pcbnew.PLOT_FORMAT_POST,
+    'svg': pcbnew.PLOT_FORMAT_SVG,
+}
+DEFAULT_MAP_FORMAT = 'dxf'
+
+
+def make_writer(board, map_format=DEFAULT_MAP_FORMAT):
+    ''' map_format: name of MAP_FORMATS '''
+    writer = pcbnew.EXCELLON_WRITER(board)
+    # metric units are used for the map too
+    writer.SetFormat(True, pcbnew.GENDRILL_WRITER_BASE.KEEP_ZEROS)
+    writer.SetOptions(False, False, board.GetDesignSettings().GetAuxOrigin(), False)
+    writer.SetRouteModeForOvalHoles(True)
+    writer.SetMergeOption(False)
+    writer.SetMapFileFormat(MAP_FORMATS[map_format])
+    return writer
+
+
+def create_files(board, path, drill=True, drill_map=True, output='',
+                 map_format=DEFAULT_MAP_FORMAT):
+    with plot_timing.stage('CreateDrillandMapFilesSet', output=output):
+        make_writer(board, map_format).CreateDrillandMapFilesSet(path, drill, drill_map)
+
+
+def is_map_file(name):
+    return MAP_MARK in name
+
+
+def add_arguments(parser):
+    parser.add_argument('--drill-map-format', choices=sorted(MAP_FORMATS),
+                        default=DEFAULT_MAP_FORMAT, help='file format of the drill map')
+
+
+def link_files(drill_dir, path, drill_maps=False):
+    ''' Link the drill files, or the maps, made by create_files() into path '''
+    for name in sorted(os.listdir(drill_dir)):
+        if is_map_file(name) == drill_maps:
+            output_staging.link_or_copy(drill_dir + os.path.sep + name,
+                                        path + os.path.sep + name)
@@ -0,0 +1,241 @@
+# coding: utf8
+# gerber_diff.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Layer by layer visual diff of two gerber outputs
+
+The outputs are directories or zips of plot_gerber_and_drill. Layers are
+matched by the layer part of the file name (<board>-<layer>.gbr), so the
+board name may change between revisions. Layers with the same content,
+plot dates aside, are skipped by their hashes; the others are rendered on
+one canvas (gerber_raster) and compared pixel by pixel.
+
+  python gerber_diff.py <old> <new> [-o <dir for diff images>]
+'''
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import plot_timing
+import sys
+import zipfile
+
+import gerber_raster
+
+from concurrent.futures import ThreadPoolExecutor
+from gerber_parser import is_gerber_file
+from output_zip import CHUNK_SIZE, DATE_COMMENT_RE
+
+
+# Changes closer than this, mm, are reported as one region
+REGION_CELL = 2.0
+
+DIFF_SUFFIX = '-diff.png'
+
+# Diff image palette: background, on both, added, removed
+DIFF_PALETTE = ((0, 0, 0), (90, 90, 90), (40, 200, 60), (220, 40, 40))
+
+
+def get_layer_key(name):
+    ''' F_Cu.gbr of <board>-F_Cu.gbr, layer names have no dashes '''
+    return os.path.basename(name).rsplit('-', 1)[-1]
+
+
+class GerberOutput(object):
+    ''' Gerber files of an output directory or zip
+
+    Only the top level files are layers of the board, the panel of a zip
+    is under gerber_panel.PANEL_DIR/ and would take the keys of the layers.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isfile(path):
+            self.zip_file = zipfile.ZipFile(path)
+            names = [name for name in self.zip_file.namelist() if '/' not in name]
+        else:
+            self.zip_file = None
+            names = os.listdir(path)
+        # {layer key: file name}
+        self.layers = dict((get_layer_key(name), name) for name in sorted(names)
+                           if is_gerber_file(name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.zip_file is not None:
+            self.zip_file.close()
+
+    def open(self, name):
+        if self.zip_file is not None:
+            return self.zip_file.open(name)
+        return open(self.path + os.path.sep + name, 'rb')
+
+    def get_hash(self, name):
+        ''' sha256 of the file without the plot date comments '''
+        sha = hashlib.sha256()
+        with self.open(name) as f:
+            chunk = f.read(CHUNK_SIZE)
+            # the dates are in the file header
+            sha.update(DATE_COMMENT_RE.sub(b'', chunk))
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def load(self, name):
+        layer = gerber_raster.LayerGraphics()
+        with self.open(name) as f:
+            layer.parse(io.TextIOWrapper(f, encoding='ascii', errors='replace'))
+        return layer
+
+
+def get_changed_regions(changed, canvas, cell=REGION_CELL):
+    ''' [x0, y0, x1, y1] in mm of groups of changed pixels
+
+    Changed pixels are binned into cell x cell tiles, neighbouring changed
+    tiles make one region.
+    '''
+    size = max(1, int(round(cell / canvas.pixel)))
+    height, width = changed.shape
+    rows = -(-height // size)
+    cols = -(-width // size)
+    padded = gerber_raster.numpy.zeros((rows * size, cols * size), dtype=bool)
+    padded[:height, :width] = changed
+    tiles = padded.reshape(rows, size, cols, size).any(axis=(1, 3))
+
+    left = set(zip(*(index.tolist() for index in tiles.nonzero())))
+    regions = []
+    while left:
+        stack = [left.pop()]
+        r0, c0 = r1, c1 = stack[0]
+        while stack:
+            r, c = stack.pop()
+            r0, r1, c0, c1 = min(r0, r), max(r1, r), min(c0, c), max(c1, c)
+            for neighbour in ((r + dr, c + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)):
+                if neighbour in left:
+                    left.remove(neighbour)
+                    stack.append(neighbour)
+
+        # exact extents of the changed pixels in the tiles
+        view = changed[r0 * size:(r1 + 1) * size, c0 * size:(c1 + 1) * size]
+        changed_rows = view.any(axis=1).nonzero()[0]
+        changed_cols = view.any(axis=0).nonzero()[0]
+        top = r0 * size + changed_rows[0]
+        bottom = r0 * size + changed_rows[-1]
+        first = c0 * size + changed_cols[0]
+        last = c0 * size + changed_cols[-1]
+        half = canvas.pixel / 2.0
+        regions.append([round(canvas.x0 + first * canvas.pixel - half, 4),
+                        round(canvas.y0 - bottom * canvas.pixel - half, 4),
+                        round(canvas.x0 + last * canvas.pixel + half, 4),
+                        round(canvas.y0 - top * canvas.pixel + half, 4)])
+
+    return sorted(regions)
+
+
+def write_diff_image(file_name, before, after):
+    pixels = gerber_raster.numpy.zeros(before.shape, dtype=gerber_raster.numpy.uint8)
+    pixels[before & after] = 1
+    pixels[after & ~before] = 2
+    pixels[before & ~after] = 3
+    gerber_raster.write_palette_png(file_name, pixels, pixels.shape[1], 8, DIFF_PALETTE)
+
+
+def diff_layer(old_layer, new_layer, dpi=gerber_raster.DEFAULT_DPI, image_file=None,
+               cell=REGION_CELL):
+    ''' Compares two LayerGraphics, returns the changed areas and regions '''
+    bbox = gerber_raster.get_canvas_bbox([old_layer.get_bbox(), new_layer.get_bbox()])
+    before = gerber_raster.render(old_layer, bbox, dpi).image
+    canvas = gerber_raster.render(new_layer, bbox, dpi)
+    after = canvas.image
+    changed = before ^ after
+
+    pixel_area = canvas.pixel * canvas.pixel
+    result = {
+        'added_area': round(float((after & changed).sum() * pixel_area), 3),
+        'removed_area': round(float((before & changed).sum() * pixel_area), 3),
+        'regions': get_changed_regions(changed, canvas, cell),
+    }
+    if image_file:
+        write_diff_image(image_file, before, after)
+        result['image'] = image_file
+    return result
+
+
+def diff_outputs(old_path, new_path, output_dir=None, dpi=gerber_raster.DEFAULT_DPI,
+                 jobs=gerber_raster.DEFAULT_JOBS, cell=REGION_CELL):
+    ''' Returns the report, diff images go to output_dir if given '''
+    gerber_raster.check_numpy()
+    with GerberOutput(old_path) as old, GerberOutput(new_path) as new, \
+            ThreadPoolExecutor(max_workers=max(1, jobs)) as executor, \
+            plot_timing.span('gerber_diff'):
+        common = sorted(set(old.layers) & set(new.layers))
+        old_hashes = executor.map(old.get_hash, [old.layers[key] for key in common])
+        new_hashes = executor.map(new.get_hash, [new.layers[key] for key in common])
+        changed = [key for key, old_hash, new_hash in zip(common, old_hashes, new_hashes)
+                   if old_hash != new_hash]
+
+        def diff(key):
+            image_file = None
+            if output_dir:
+                image_file = output_dir + os.path.sep + os.path.splitext(key)[0] + DIFF_SUFFIX
+            return diff_layer(old.load(old.layers[key]), new.load(new.layers[key]), dpi,
+                              image_file, cell)
+
+        report = {
+            'old': old_path,
+            'new': new_path,
+            'dpi': dpi,
+            'units': 'mm',
+            'added': sorted(set(new.layers) - set(old.layers)),
+            'removed': sorted(set(old.layers) - set(new.layers)),
+            'unchanged': [key for key in common if key not in changed],
+            'changed': dict(zip(changed, executor.map(diff, changed))),
+        }
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Visual diff of two gerber outputs')
+    parser.add_argument('old', help='older output directory or zip')
+    parser.add_argument('new', help='newer output directory or zip')
+    parser.add_argument('-o', '--output-dir', help='write the diff images here')
+    parser.add_argument('--dpi', type=int, default=gerber_raster.DEFAULT_DPI,
+                        help='resolution of the compared images')
+    parser.add_argument('--cell', type=float, default=REGION_CELL,
+                        help='changes closer than this, mm, make one region')
+    parser.add_argument('-j', '--jobs', type=int, default=gerber_raster.DEFAULT_JOBS,
+                        help='layers compared at once')
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    report = diff_outputs(args.old, args.new, args.output_dir, args.dpi, args.jobs, args.cell)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,541 @@
+# coding: utf8
+# gerber_panel.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Step and repeat panel of plotted gerber and drill files
+
+The files of one board are copied into a columns x rows panel without
+plotting again: the body of each file is split once into its text and
+its X/Y numbers, each copy adds an offset to the numbers (numpy) and joins
+them back. Apertures and drill tools are defined once. Rails around the
+panel, its outline and fiducials are added from a JSON spec:
+
+  {
+    "columns": 10, "rows": 10,
+    "spacing": 2.0,                    mm between boards, or [x, y]
+    "rails": {"sides": ["top", "bottom"], "width": 5.0},
+    "fiducials": {"diameter": 1.0, "mask_diameter": 2.0, "offset": 5.0,
+                  "sides": ["F"]},     on the rails, or "positions": [[x, y], ...]
+    "outline_width": 0.1
+  }
+
+  python gerber_panel.py <gerber output dir> <spec.json> -o <panel dir>
+'''
+
+import argparse
+import json
+import math
+import os
+import plot_timing
+import re
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from gerber_parser import (APERTURE_RE, EDGE_CUTS_MARK, FORMAT_RE, MM_PER_INCH, is_gerber_file,
+                           iter_statements, merge_bbox)
+from gerber_stats import GerberStats
+
+try:
+    import numpy
+except ImportError:
+    # not bundled with every KiCad
+    numpy = None
+
+
+PANEL_DIR = 'panel'
+DRILL_EXT = '.drl'
+DEFAULT_JOBS = 4
+
+DEFAULT_SPACING = 2.0
+DEFAULT_RAIL_WIDTH = 5.0
+DEFAULT_FIDUCIAL = {'diameter': 1.0, 'mask_diameter': 2.0, 'offset': 5.0, 'sides': ['F']}
+DEFAULT_OUTLINE_WIDTH = 0.1
+RAIL_SIDES = ('top', 'bottom', 'left', 'right')
+
+COORD_RE = re.compile(r'([XY])([+-]?[\d.]+)')
+
+# Longer text between two numbers is not copied by a numpy table
+MAX_PIECE_WIDTH = 64
+
+# Gerber statements defined once, repeated with the body or dropped
+SETUP_STATEMENTS = ('FS', 'MO', 'AD', 'TF', 'IN', 'IP', 'OF', 'SF', 'AS', 'IR', 'MI')
+BODY_STATEMENTS = ('LP', 'LM', 'LR', 'LS')
+# object and aperture attributes would be wrong for the copies
+DROPPED_STATEMENTS = ('TA', 'TO', 'TD')
+
+# Each copy starts from the state of a new file
+COPY_PRELUDE = 'G01*\n%LPD*%\nX0Y0D02*\n'
+
+EXCELLON_TOOL_RE = re.compile(r'^T\d+$')
+EXCELLON_FORMAT_RE = re.compile(r'FORMAT=\{([\d-]+):([\d-]+)/.*?(metric|inch)\s*/\s*([a-z ]+)\}')
+
+
+class PanelError(Exception):
+    pass
+
+
+def check_numpy():
+    if numpy is None:
+        raise PanelError('numpy is needed to panelize gerber files')
+
+
+class Template(object):
+    ''' Text with its X and Y numbers taken out, written again at offsets '''
+
+    def __init__(self, text, parse_values):
+        parts = COORD_RE.split(text)
+        letters = parts[1::3]
+        # literal text up to and including the X or Y of each number
+        self.pieces = [parts[i] + parts[i + 1] for i in range(0, len(parts) - 1, 3)]
+        self.pieces.append(parts[-1])
+        self.values = parse_values(parts[2::3])
+        self.is_x = numpy.array([letter == 'X' for letter in letters], dtype=bool)
+
+    def get_values(self, dx, dy):
+        return self.values + numpy.where(self.is_x, dx, dy)
+
+    def render(self, dx, dy, format_values):
+        if not len(self.values):
+            return self.pieces[0]
+        texts = format_values(self.get_values(dx, dy))
+        out = [None] * (2 * len(texts) + 1)
+        out[0::2] = self.pieces
+        out[1::2] = texts
+        return ''.join(out)
+
+
+class IntegerTemplate(Template):
+    ''' Template of integers, each copy is put together as bytes by numpy
+
+    Row k of a table holds piece k right aligned in front of the digits of
+    number k, a copy is the table without its unused cells.
+    '''
+
+    def __init__(self, text):
+        super(IntegerTemplate, self).__init__(text, parse_integers)
+        self.encoded = [piece.encode('ascii') for piece in self.pieces]
+        self.piece_width = max(len(piece) for piece in self.encoded)
+        self.width = 0
+        self.cells = None
+
+    def make_table(self, width):
+        ''' width: characters of the longest number, sign included '''
+        lengths = numpy.array([len(piece) for piece in self.encoded[:-1]], dtype=numpy.int64)
+        self.width = width
+        self.cells = numpy.zeros((len(lengths), self.piece_width + width), dtype=numpy.uint8)
+        self.used = numpy.zeros(self.cells.shape, dtype=bool)
+
+        rows = numpy.repeat(numpy.arange(len(lengths)), lengths)
+        cols = self.piece_width - numpy.repeat(lengths, lengths) + \
+            numpy.arange(len(rows)) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        self.cells[rows, cols] = numpy.frombuffer(b''.join(self.encoded[:-1]),
+                                                  dtype=numpy.uint8)
+        self.used[rows, cols] = True
+
+    def render_bytes(self, dx, dy):
+        if not len(self.values):
+            return self.encoded[0]
+        if self.piece_width > MAX_PIECE_WIDTH:
+            # a table would take too much memory
+            return self.render(dx, dy, format_integers).encode('ascii')
+
+        values = self.get_values(dx, dy)
+        magnitude = numpy.abs(values)
+        top = int(magnitude.max())
+        width = len(str(top)) + 1
+        if width > self.width:
+            self.make_table(width)
+
+        digits = self.cells[:, self.piece_width:]
+        rest = magnitude.astype(numpy.int32 if top < 2 ** 31 else numpy.int64)
+        for column in range(self.width - 1, 0, -1):
+            digits[:, column] = rest % 10 + ord('0')
+            rest //= 10
+
+        lengths = numpy.ones(len(values), dtype=numpy.int64)
+        power = 10
+        while power <= top:
+            lengths += magnitude >= power
+            power *= 10
+        negative = values < 0
+        # the sign goes just before the first digit
+        digits[negative.nonzero()[0], self.width - 1 - lengths[negative]] = ord('-')
+        lengths += negative
+
+        self.used[:, self.piece_width:] = \
+            numpy.arange(self.width)[None, :] >= (self.width - lengths)[:, None]
+        return self.cells[self.used].tobytes() + self.encoded[-1]
+
+
+def format_integers(values):
+    return list(map(str, values.tolist()))
+
+
+def parse_integers(texts):
+    return numpy.array(texts, dtype=numpy.int64) if texts else numpy.zeros(0, numpy.int64)
+
+
+class GerberFile(object):
+    ''' Setup statements and body template of a gerber file '''
+
+    def __init__(self, file_name):
+        self.setup = []
+        self.codes = [9]
+        self.unit_scale = 1.0
+        self.decimals = 6
+        body = [COPY_PRELUDE]
+
+        with open(file_name, 'r', encoding='ascii', errors='replace') as f:
+            for extended, text in iter_statements(f):
+                if extended:
+                    self.add_extended(text, body)
+                elif text.startswith('G04'):
+                    # header comments, the comments of the body are not repeated
+                    if len(body) == 1:
+                        self.setup.append(text + '*\n')
+                elif not text.startswith('M02'):
+                    body.append(text + '*\n')
+
+        self.body = IntegerTemplate(''.join(body))
+
+    def add_extended(self, text, body):
+        statements = [s.strip() for s in text.split('*') if s.strip()]
+        if statements and statements[0].startswith('AM'):
+            self.setup.append('%' + text.strip() + '%\n')
+            return
+
+        for statement in statements:
+            kind = statement[:2]
+            if kind == 'SR':
+                raise PanelError('the file is step and repeated already')
+            if kind in SETUP_STATEMENTS:
+                self.setup.append('%' + statement + '*%\n')
+            elif kind in BODY_STATEMENTS:
+                body.append('%' + statement + '*%\n')
+            elif kind not in DROPPED_STATEMENTS:
+                self.setup.append('%' + statement + '*%\n')
+
+            if kind == 'FS':
+                match = FORMAT_RE.match(statement)
+                if match is None or match.group(1) != 'L' or match.group(2) != 'A':
+                    raise PanelError('only absolute coordinates without leading zeros '
+                                     'are supported')
+                self.decimals = int(match.group(4))
+            elif kind == 'MO':
+                self.unit_scale = MM_PER_INCH if statement[2:4] == 'IN' else 1.0
+            elif kind == 'AD':
+                self.codes.append(int(APERTURE_RE.match(statement).group(1)))
+
+    def to_units(self, mm):
+        return int(round(mm / self.unit_scale * 10 ** self.decimals))
+
+    def format_point(self, x, y):
+        return 'X{0}Y{1}'.format(self.to_units(x), self.to_units(y))
+
+    def write(self, file_name, offsets, additions=()):
+        ''' additions: [(diameter, [[(x, y), ...] polyline or [(x, y)] flash])] in mm '''
+        code = max(self.codes)
+        head = list(self.setup)
+        tail = ['G01*\n%LPD*%\n']
+        for i, (diameter, shapes) in enumerate(additions):
+            head.append('%ADD{0}C,{1:.6f}*%\n'.format(code + 1 + i, diameter / self.unit_scale))
+            tail.append('D{0}*\n'.format(code + 1 + i))
+            for points in shapes:
+                if len(points) == 1:
+                    tail.append(self.format_point(*points[0]) + 'D03*\n')
+                    continue
+                tail.append(self.format_point(*points[0]) + 'D02*\n')
+                for point in points[1:]:
+                    tail.append(self.format_point(*point) + 'D01*\n')
+        tail.append('M02*\n')
+
+        with open(file_name, 'wb') as f:
+            f.write(''.join(head).encode('ascii'))
+            for dx, dy in offsets:
+                f.write(self.body.render_bytes(self.to_units(dx), self.to_units(dy)))
+            f.write(''.join(tail).encode('ascii'))
+
+
+class ExcellonFormat(object):
+    ''' Number format of an Excellon file '''
+
+    def __init__(self, metric=True, integer_digits=None, decimals=None, zeros='decimal'):
+        self.metric = metric
+        self.integer_digits = integer_digits or (3 if metric else 2)
+        self.decimals = decimals or (3 if metric else 4)
+        self.zeros = zeros
+
+    def parse(self, text):
+        if '.' in text or self.zeros == 'decimal':
+            return float(text)
+        sign = -1 if text.startswith('-') else 1
+        digits = text.lstrip('+-')
+        if self.zeros == 'suppress trailing zeros':
+            digits = digits.ljust(self.integer_digits + self.decimals, '0')
+        return sign * int(digits) / 10.0 ** self.decimals
+
+    def format(self, value):
+        if self.zeros == 'decimal':
+            text = '{0:.{1}f}'.format(value, self.decimals).rstrip('0').rstrip('.')
+            return '0' if text in ('', '-0') else text
+        number = int(round(value * 10 ** self.decimals))
+        sign = '-' if number < 0 else ''
+        digits = str(abs(number))
+        if self.zeros == 'keep zeros':
+            digits = digits.zfill(self.integer_digits + self.decimals)
+        elif self.zeros == 'suppress trailing zeros':
+            digits = digits.zfill(self.integer_digits + self.decimals).rstrip('0') or '0'
+        return sign + digits
+
+    def format_values(self, values):
+        return [self.format(value) for value in values.tolist()]
+
+    def parse_values(self, texts):
+        return numpy.array([self.parse(text) for text in texts], dtype=float)
+
+
+class ExcellonFile(object):
+    ''' Header, prelude and per tool body templates of an Excellon file '''
+
+    def __init__(self, file_name):
+        self.header = []
+        self.prelude = []
+        # [(tool line, template)]
+        self.tools = []
+        self.format = ExcellonFormat()
+
+        with open(file_name, 'r', encoding='ascii', errors='replace') as f:
+            lines = f.read().splitlines()
+
+        index = 0
+        if lines and lines[0].strip() == 'M48':
+            while index < len(lines):
+                line = lines[index]
+                index += 1
+                self.header.append(line + '\n')
+                self.read_format(line)
+                if line.strip() in ('%', 'M95'):
+                    break
+
+        tool = None
+        body = []
+        for line in lines[index:]:
+            line = line.strip()
+            if EXCELLON_TOOL_RE.match(line):
+                self.add_tool(tool, body)
+                tool = line
+                body = []
+            elif line == 'M30':
+                break
+            elif tool is None:
+                self.prelude.append(line + '\n')
+            else:
+                body.append(line + '\n')
+        self.add_tool(tool, body)
+
+    def read_format(self, line):
+        match = EXCELLON_FORMAT_RE.search(line)
+        if match is not None:
+            integer_digits, decimals, units, zeros = match.groups()
+            self.format = ExcellonFormat(units == 'metric',
+                                         int(integer_digits) if integer_digits != '-' else None,
+                                         int(decimals) if decimals != '-' else None,
+                                         zeros.strip())
+        elif line.startswith('INCH') or line.startswith('METRIC'):
+            metric = line.startswith('METRIC')
+            if metric != self.format.metric:
+                self.format = ExcellonFormat(metric, zeros=self.format.zeros)
+
+    def add_tool(self, tool, body):
+        if tool is not None:
+            self.tools.append((tool, Template(''.join(body), self.format.parse_values)))
+
+    def write(self, file_name, offsets):
+        scale = 1.0 if self.format.metric else 1.0 / MM_PER_INCH
+        with open(file_name, 'w') as f:
+            f.writelines(self.header)
+            f.writelines(self.prelude)
+            for tool, body in self.tools:
+                f.write(tool + '\n')
+                for dx, dy in offsets:
+                    f.write(body.render(dx * scale, dy * scale, self.format.format_values))
+            f.write('M30\n')
+
+
+def get_layer_name(file_name):
+    ''' F_Cu of <board>-F_Cu.gbr '''
+    return os.path.splitext(os.path.basename(file_name))[0].rsplit('-', 1)[-1]
+
+
+def get_board_bbox(file_names):
+    ''' Extents of the board outline, of all layers without one '''
+    outline = [name for name in file_names if EDGE_CUTS_MARK in name]
+    boxes = [GerberStats().parse_file(name).get_summary()['bbox']
+             for name in outline or file_names]
+    bbox = merge_bbox(boxes)
+    if bbox is None:
+        raise PanelError('nothing to panelize')
+    return bbox
+
+
+class Panel(object):
+    ''' Copies, rails and fiducials of a spec, in the board coordinates '''
+
+    def __init__(self, spec, bbox):
+        self.columns = int(spec.get('columns', 1))
+        self.rows = int(spec.get('rows', 1))
+        spacing = spec.get('spacing', DEFAULT_SPACING)
+        self.spacing = spacing if isinstance(spacing, list) else [spacing, spacing]
+        self.outline_width = spec.get('outline_width', DEFAULT_OUTLINE_WIDTH)
+
+        width = bbox[2] - bbox[0]
+        height = bbox[3] - bbox[1]
+        pitch_x = width + self.spacing[0]
+        pitch_y = height + self.spacing[1]
+        self.offsets = [(column * pitch_x, row * pitch_y)
+                        for row in range(self.rows) for column in range(self.columns)]
+        boards = [bbox[0], bbox[1], bbox[0] + self.columns * pitch_x - self.spacing[0],
+                  bbox[1] + self.rows * pitch_y - self.spacing[1]]
+
+        rails = spec.get('rails') or {}
+        self.rail_sides = [side for side in RAIL_SIDES if side in rails.get('sides', ())]
+        rail = rails.get('width', DEFAULT_RAIL_WIDTH)
+        margin = dict((side, 0.0) for side in RAIL_SIDES)
+        for side in self.rail_sides:
+            spacing = self.spacing[1] if side in ('top', 'bottom') else self.spacing[0]
+            margin[side] = spacing + rail
+        self.bbox = [boards[0] - margin['left'], boards[1] - margin['bottom'],
+                     boards[2] + margin['right'], boards[3] + margin['top']]
+
+        # rail centre lines, (start, end)
+        x0, y0, x1, y1 = self.bbox
+        centre_lines = {
+            'top': ((x0, y1 - rail / 2.0), (x1, y1 - rail / 2.0)),
+            'bottom': ((x0, y0 + rail / 2.0), (x1, y0 + rail / 2.0)),
+            'left': ((x0 + rail / 2.0, y0), (x0 + rail / 2.0, y1)),
+            'right': ((x1 - rail / 2.0, y0), (x1 - rail / 2.0, y1)),
+        }
+
+        # {} gives the default fiducials, no key none
+        fiducials = spec.get('fiducials')
+        self.fiducials = []
+        self.fiducial = dict(DEFAULT_FIDUCIAL, **(fiducials or {}))
+        if fiducials is not None and 'positions' in fiducials:
+            self.fiducials = [tuple(position) for position in fiducials['positions']]
+        elif fiducials is not None:
+            if not self.rail_sides:
+                raise PanelError('fiducials are placed on the rails, add rails or fiducial '
+                                 'positions')
+            offset = self.fiducial['offset']
+            for side in self.rail_sides:
+                (sx, sy), (ex, ey) = centre_lines[side]
+                length = math.hypot(ex - sx, ey - sy)
+                ux, uy = (ex - sx) / length, (ey - sy) / length
+                self.fiducials.append((sx + ux * offset, sy + uy * offset))
+                self.fiducials.append((ex - ux * offset, ey - uy * offset))
+            # three are enough and tell the panel orientation
+            self.fiducials = self.fiducials[:3]
+
+    def get_additions(self, layer):
+        ''' [(diameter, shapes)] added to a gerber layer '''
+        if layer == EDGE_CUTS_MARK and self.rail_sides:
+            x0, y0, x1, y1 = self.bbox
+            return [(self.outline_width, [[(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]])]
+
+        if self.fiducials:
+            for side in self.fiducial['sides']:
+                if layer == side + '_Cu':
+                    return [(self.fiducial['diameter'], [[point] for point in self.fiducials])]
+                if layer == side + '_Mask':
+                    return [(self.fiducial['mask_diameter'],
+                             [[point] for point in self.fiducials])]
+        return []
+
+    def get_summary(self):
+        return {
+            'columns': self.columns,
+            'rows': self.rows,
+            'bbox': [round(value, 4) for value in self.bbox],
+            'width': round(self.bbox[2] - self.bbox[0], 4),
+            'height': round(self.bbox[3] - self.bbox[1], 4),
+            'fiducials': [[round(x, 4), round(y, 4)] for x, y in self.fiducials],
+        }
+
+
+def panelize(path, spec, output_dir=None, jobs=DEFAULT_JOBS):
+    ''' Panel of the gerber and drill files of path, written to output_dir
+
+    output_dir is path/PANEL_DIR by default. Returns the panel summary.
+    '''
+    check_numpy()
+    output_dir = output_dir or path + os.path.sep + PANEL_DIR
+    os.makedirs(output_dir, exist_ok=True)
+
+    names = sorted(os.listdir(path))
+    gerbers = [path + os.path.sep + name for name in names if is_gerber_file(name)]
+    drills = [path + os.path.sep + name for name in names
+              if name.lower().endswith(DRILL_EXT)]
+
+    with plot_timing.span('panelize'):
+        panel = Panel(spec, get_board_bbox(gerbers))
+
+        def write_gerber(file_name):
+            GerberFile(file_name).write(output_dir + os.path.sep + os.path.basename(file_name),
+                                        panel.offsets, panel.get_additions(
+                                            get_layer_name(file_name)))
+
+        def write_drill(file_name):
+            ExcellonFile(file_name).write(output_dir + os.path.sep + os.path.basename(file_name),
+                                          panel.offsets)
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = [executor.submit(write_gerber, name) for name in gerbers] + \
+                      [executor.submit(write_drill, name) for name in drills]
+            for future in futures:
+                future.result()
+
+    return panel.get_summary()
+
+
+def load_spec(file_name):
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+
+def add_arguments(parser):
+    parser.add_argument('--panel', metavar='SPEC',
+                        help='add a step and repeat panel of the gerber and drill files made '
+                             'from this JSON spec (see gerber_panel.py), needs numpy')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Step and repeat panel of gerber and drill files')
+    parser.add_argument('path', help='directory with the gerber and drill files of one board')
+    parser.add_argument('spec', help='panel spec, JSON')
+    parser.add_argument('-o', '--output-dir', help='write the panel here, <path>/panel by default')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help='files written at once')
+    args = parser.parse_args()
+
+    summary = panelize(args.path, load_spec(args.spec), args.output_dir, args.jobs)
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,532 @@
+# coding: utf8
+# gerber_parser.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Streaming RS-274X (Gerber X1/X2) reader
+
+The file is read in chunks and the graphics objects are handed to the
+on_*() methods of a subclass as they come, nothing is kept but the
+aperture table and the contour of the current region. Covers what KiCad
+plots: absolute coordinates with leading zeros omitted, standard and
+macro apertures, linear and multi quadrant circular interpolation,
+regions and polarity. Does not need pcbnew.
+'''
+
+import math
+import os
+import re
+
+
+CHUNK_SIZE = 1024 * 1024
+
+MM_PER_INCH = 25.4
+
+# Arcs are split into segments of at most this angle
+ARC_STEP = math.radians(5)
+
+GERBER_EXT_RE = re.compile(r'\.(gbr|g[tb][lopsa]|gm\d+|g\d+)$', re.IGNORECASE)
+
+EDGE_CUTS_MARK = 'Edge_Cuts'
+# layer name suffix, Edge_Cuts has it inside
+COPPER_MARK = '_Cu'
+
+# The usual statement: [G01|G02|G03][X][Y][I][J]D01|D02|D03
+COORD_RE = re.compile(r'(?:G0?([123]))?(?:X([+-]?\d+))?(?:Y([+-]?\d+))?'
+                      r'(?:I([+-]?\d+))?(?:J([+-]?\d+))?D0?([123])$')
+WORD_RE = re.compile(r'([GXYIJDM])([+-]?\d+)')
+FORMAT_RE = re.compile(r'FS([LT])([AI])X(\d)(\d)Y(\d)(\d)')
+APERTURE_RE = re.compile(r'ADD(\d+)([^,]+),?(.*)')
+MACRO_VARIABLE_RE = re.compile(r'\$(\d+)')
+EXPRESSION_RE = re.compile(r'^[\d.+\-*/() ]*$')
+
+
+class GerberError(Exception):
+    pass
+
+
+def is_gerber_file(name):
+    return GERBER_EXT_RE.search(name) is not None
+
+
+def is_copper(file_name):
+    return os.path.splitext(os.path.basename(file_name))[0].endswith(COPPER_MARK)
+
+
+def get_gerber_files(path):
+    return [path + os.path.sep + name for name in sorted(os.listdir(path))
+            if is_gerber_file(name)]
+
+
+def merge_bbox(boxes):
+    ''' Box around the boxes, None ones are skipped, None if there are none '''
+    boxes = [box for box in boxes if box]
+    if not boxes:
+        return None
+    return [min(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), max(box[3] for box in boxes)]
+
+
+def iter_statements(f):
+    ''' Yields (extended, text) of a text file
+
+    Extended blocks (between %) are yielded whole, data blocks one by one.
+    '''
+    pending = ''
+    extended = False
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+        parts = (pending + chunk).split('%')
+        for part in parts[:-1]:
+            if extended:
+                yield True, part
+            else:
+                for text in part.split('*'):
+                    text = text.strip()
+                    if text:
+                        yield False, text
+            extended = not extended
+
+        pending = parts[-1]
+        if not extended:
+            # complete data blocks go now, so pending stays small
+            head, star, pending = pending.rpartition('*')
+            for text in head.split('*'):
+                text = text.strip()
+                if text:
+                    yield False, text
+
+    if pending.strip() and not extended:
+        yield False, pending.strip()
+
+
+def rotate(x, y, angle):
+    if not angle:
+        return x, y
+    a = math.radians(angle)
+    return x * math.cos(a) - y * math.sin(a), x * math.sin(a) + y * math.cos(a)
+
+
+def rotate_points(points, angle):
+    return [rotate(x, y, angle) for x, y in points]
+
+
+def rect_points(width, height, cx=0.0, cy=0.0):
+    w = width / 2.0
+    h = height / 2.0
+    return [(cx - w, cy - h), (cx + w, cy - h), (cx + w, cy + h), (cx - w, cy + h)]
+
+
+def regular_polygon_points(diameter, vertices, rotation=0.0, cx=0.0, cy=0.0):
+    r = diameter / 2.0
+    return [(cx + r * math.cos(math.radians(rotation + 360.0 * i / vertices)),
+             cy + r * math.sin(math.radians(rotation + 360.0 * i / vertices)))
+            for i in range(int(vertices))]
+
+
+def polygon_area(points):
+    ''' Shoelace, absolute value '''
+    area = 0.0
+    n = len(points)
+    for i in range(n):
+        x0, y0 = points[i - 1]
+        x1, y1 = points[i]
+        area += x0 * y1 - x1 * y0
+    return abs(area) / 2.0
+
+
+def point_in_polygon(x, y, points):
+    inside = False
+    x0, y0 = points[-1]
+    for x1, y1 in points:
+        if (y1 > y) != (y0 > y) and x < (x0 - x1) * (y - y1) / (y0 - y1) + x1:
+            inside = not inside
+        x0, y0 = x1, y1
+    return inside
+
+
+def arc_points(x0, y0, x1, y1, cx, cy, clockwise):
+    ''' Points of an arc after its start, the last one is (x1, y1) '''
+    r = math.hypot(x0 - cx, y0 - cy)
+    start = math.atan2(y0 - cy, x0 - cx)
+    end = math.atan2(y1 - cy, x1 - cx)
+    sweep = end - start
+    if clockwise:
+        if sweep >= 0:
+            sweep -= 2 * math.pi
+    elif sweep <= 0:
+        sweep += 2 * math.pi
+
+    steps = max(1, int(math.ceil(abs(sweep) / ARC_STEP)))
+    points = [(cx + r * math.cos(start + sweep * i / steps),
+               cy + r * math.sin(start + sweep * i / steps)) for i in range(1, steps)]
+    points.append((x1, y1))
+    return points
+
+
+def arc_length(x0, y0, x1, y1, cx, cy, clockwise):
+    r = math.hypot(x0 - cx, y0 - cy)
+    sweep = math.atan2(y1 - cy, x1 - cx) - math.atan2(y0 - cy, x0 - cx)
+    if clockwise:
+        if sweep >= 0:
+            sweep -= 2 * math.pi
+    elif sweep <= 0:
+        sweep += 2 * math.pi
+    return r * abs(sweep)
+
+
+class Aperture(object):
+    ''' Aperture as dark and clear shapes around its origin, in mm
+
+    shapes: [(dark, 'circle', (x, y, diameter)) or (dark, 'polygon', points)]
+    '''
+
+    def __init__(self, code, template, params, shapes, area=None):
+        self.code = code
+        self.template = template
+        self.params = params
+        self.shapes = shapes
+        self.extent = self.get_extent()
+        self.area = self.estimate_area() if area is None else area
+        # width of the stroke when drawing with the aperture
+        if template == 'C':
+            self.width = params[0]
+        elif template in ('R', 'O') and len(params) >= 2:
+            self.width = min(params[0], params[1])
+        else:
+            self.width = 2 * self.extent
+
+    def get_extent(self):
+        ''' Distance from the origin to the farthest point '''
+        extent = 0.0
+        for dark, kind, data in self.shapes:
+            if kind == 'circle':
+                x, y, d = data
+                extent = max(extent, math.hypot(x, y) + d / 2.0)
+            else:
+                extent = max([extent] + [math.hypot(x, y) for x, y in data])
+        return extent
+
+    def contains(self, x, y):
+        inside = False
+        for dark, kind, data in self.shapes:
+            if kind == 'circle':
+                cx, cy, d = data
+                hit = (x - cx) ** 2 + (y - cy) ** 2 <= (d / 2.0) ** 2
+            else:
+                hit = point_in_polygon(x, y, data)
+            if hit:
+                inside = dark
+        return inside
+
+    def estimate_area(self, samples=48):
+        ''' Overlapping macro primitives are counted once '''
+        if self.extent == 0:
+            return 0.0
+        step = 2 * self.extent / samples
+        hits = 0
+        for i in range(samples):
+            x = -self.extent + (i + 0.5) * step
+            for j in range(samples):
+                if self.contains(x, -self.extent + (j + 0.5) * step):
+                    hits += 1
+        return hits * step * step
+
+
+def make_standard_aperture(code, template, params):
+    if template == 'C':
+        d = params[0]
+        shapes = [(True, 'circle', (0.0, 0.0, d))]
+        area = math.pi * d * d / 4
+    elif template == 'R':
+        w, h = params[0], params[1]
+        shapes = [(True, 'polygon', rect_points(w, h))]
+        area = w * h
+    elif template == 'O':
+        w, h = params[0], params[1]
+        if w >= h:
+            shapes = [(True, 'polygon', rect_points(w - h, h)),
+                      (True, 'circle', (-(w - h) / 2.0, 0.0, h)),
+                      (True, 'circle', ((w - h) / 2.0, 0.0, h))]
+        else:
+            shapes = [(True, 'polygon', rect_points(w, h - w)),
+                      (True, 'circle', (0.0, -(h - w) / 2.0, w)),
+                      (True, 'circle', (0.0, (h - w) / 2.0, w))]
+        s = min(w, h)
+        area = abs(w - h) * s + math.pi * s * s / 4
+    elif template == 'P':
+        d, n = params[0], int(params[1])
+        rotation = params[2] if len(params) > 2 else 0.0
+        shapes = [(True, 'polygon', regular_polygon_points(d, n, rotation))]
+        area = polygon_area(shapes[0][2])
+    else:
+        raise GerberError('unknown aperture template ' + template)
+
+    return Aperture(code, template, params, shapes, area)
+
+
+def evaluate(expression, variables):
+    text = MACRO_VARIABLE_RE.sub(lambda m: repr(variables.get(int(m.group(1)), 0.0)),
+                                 expression.replace('x', '*').replace('X', '*'))
+    if not EXPRESSION_RE.match(text):
+        raise GerberError('bad macro expression ' + expression)
+    return float(eval(text, {'__builtins__': {}}))
+
+
+def make_macro_aperture(code, name, body, params, scale):
+    ''' scale: mm per file unit, macro values are in file units '''
+    variables = dict((i + 1, value) for i, value in enumerate(params))
+    shapes = []
+    for statement in body:
+        if statement.startswith('0'):
+            continue
+        if statement.startswith('$'):
+            variable, expression = statement.split('=', 1)
+            variables[int(variable[1:])] = evaluate(expression, variables)
+            continue
+
+        values = [evaluate(value, variables) for value in statement.split(',')]
+        primitive = int(values[0])
+        dark = values[1] != 0
+        if primitive == 1:
+            d, cx, cy = values[2:5]
+            rotation = values[5] if len(values) > 5 else 0.0
+            cx, cy = rotate(cx, cy, rotation)
+            shapes.append((dark, 'circle', (cx * scale, cy * scale, d * scale)))
+            continue
+
+        if primitive == 20:
+            width, x0, y0, x1, y1, rotation = values[2:8]
+            length = math.hypot(x1 - x0, y1 - y0)
+            angle = math.degrees(math.atan2(y1 - y0, x1 - x0))
+            points = [rotate(x, y, angle) for x, y in rect_points(length, width, length / 2.0)]
+            points = [(x + x0, y + y0) for x, y in points]
+        elif primitive == 21:
+            width, height, cx, cy, rotation = values[2:7]
+            points = rect_points(width, height, cx, cy)
+        elif primitive == 4:
+            count = int(values[2])
+            coords = values[3:5 + 2 * count]
+            rotation = values[5 + 2 * count]
+            points = list(zip(coords[0::2], coords[1::2]))
+        elif primitive == 5:
+            vertices, cx, cy, d, rotation = values[2:7]
+            points = regular_polygon_points(d, vertices, 0.0, cx, cy)
+        elif primitive == 7:
+            # thermal: ring without the gaps
+            cx, cy, outer, inner = values[1:5]
+            shapes.append((True, 'circle', (cx * scale, cy * scale, outer * scale)))
+            shapes.append((False, 'circle', (cx * scale, cy * scale, inner * scale)))
+            continue
+        else:
+            raise GerberError('unknown macro primitive {0}'.format(primitive))
+
+        points = [(x * scale, y * scale) for x, y in rotate_points(points, rotation)]
+        shapes.append((dark, 'polygon', points))
+
+    return Aperture(code, name, params, shapes)
+
+
+class GerberParser(object):
+    ''' Subclasses override the on_*() methods, coordinates are in mm
+
+    self.dark is the polarity of the objects being handed over.
+    '''
+
+    def __init__(self):
+        self.apertures = {}
+        self.macros = {}
+        self.aperture = None
+        self.dark = True
+        self.unit_scale = 1.0
+        self.decimals = 6
+        self.scale = 1e-6
+        self.x = 0.0
+        self.y = 0.0
+        self.interpolation = 1
+        self.in_region = False
+        self.contour = []
+
+    # handlers
+
+    def on_aperture(self, aperture):
+        pass
+
+    def on_flash(self, x, y, aperture):
+        pass
+
+    def on_draw(self, x0, y0, x1, y1, aperture):
+        pass
+
+    def on_arc(self, x0, y0, x1, y1, cx, cy, clockwise, aperture):
+        for x, y in arc_points(x0, y0, x1, y1, cx, cy, clockwise):
+            self.on_draw(x0, y0, x, y, aperture)
+            x0, y0 = x, y
+
+    def on_contour(self, points):
+        ''' One closed contour of a region '''
+        pass
+
+    # reading
+
+    def parse_file(self, file_name):
+        with open(file_name, 'r', encoding='ascii', errors='replace') as f:
+            self.parse(f)
+        return self
+
+    def parse(self, f):
+        for extended, text in iter_statements(f):
+            if extended:
+                self.parse_extended(text)
+            else:
+                self.parse_data(text)
+        self.end_contour()
+
+    def parse_extended(self, text):
+        statements = [s.strip() for s in text.split('*')]
+        statements = [s for s in statements if s]
+        if not statements:
+            return
+
+        if statements[0].startswith('AM'):
+            self.macros[statements[0][2:]] = statements[1:]
+            return
+
+        for statement in statements:
+            if statement.startswith('FS'):
+                match = FORMAT_RE.match(statement)
+                if match is None:
+                    raise GerberError('bad format ' + statement)
+                if match.group(2) != 'A':
+                    raise GerberError('incremental coordinates are not supported')
+                self.decimals = int(match.group(4))
+                self.update_scale()
+            elif statement.startswith('MO'):
+                self.unit_scale = MM_PER_INCH if statement[2:4] == 'IN' else 1.0
+                self.update_scale()
+            elif statement.startswith('AD'):
+                self.define_aperture(statement)
+            elif statement.startswith('LP'):
+                self.dark = statement[2:3] == 'D'
+
+    def update_scale(self):
+        self.scale = self.unit_scale / 10 ** self.decimals
+
+    def define_aperture(self, statement):
+        match = APERTURE_RE.match(statement)
+        if match is None:
+            raise GerberError('bad aperture ' + statement)
+        code = int(match.group(1))
+        template = match.group(2)
+        params = [float(value) for value in match.group(3).split('X') if value]
+
+        if template in self.macros:
+            aperture = make_macro_aperture(code, template, self.macros[template], params,
+                                           self.unit_scale)
+        else:
+            params = [value * self.unit_scale for value in params]
+            if template == 'P' and len(params) > 1:
+                # vertex count and rotation are not lengths
+                params[1:] = [value / self.unit_scale for value in params[1:]]
+            aperture = make_standard_aperture(code, template, params)
+
+        self.apertures[code] = aperture
+        self.on_aperture(aperture)
+
+    def parse_data(self, text):
+        match = COORD_RE.match(text)
+        if match is None:
+            self.parse_words(text)
+            return
+
+        g, x, y, i, j, d = match.groups()
+        if g is not None:
+            self.interpolation = int(g)
+        self.operate(int(d), x, y, i, j)
+
+    def parse_words(self, text):
+        if text.startswith('G04') or text.startswith('G4 '):
+            return
+
+        coords = {}
+        d = None
+        for letter, value in WORD_RE.findall(text):
+            if letter == 'G':
+                g = int(value)
+                if g in (1, 2, 3):
+                    self.interpolation = g
+                elif g == 36:
+                    self.in_region = True
+                elif g == 37:
+                    self.end_contour()
+                    self.in_region = False
+                elif g == 91:
+                    raise GerberError('incremental coordinates are not supported')
+            elif letter == 'D':
+                d = int(value)
+            elif letter == 'M':
+                self.end_contour()
+            else:
+                coords[letter] = value
+
+        if d is None:
+            return
+        if d >= 10:
+            if d not in self.apertures:
+                raise GerberError('undefined aperture D{0}'.format(d))
+            self.aperture = self.apertures[d]
+            return
+        self.operate(d, coords.get('X'), coords.get('Y'), coords.get('I'), coords.get('J'))
+
+    def operate(self, d, x, y, i, j):
+        x0, y0 = self.x, self.y
+        x1 = x0 if x is None else int(x) * self.scale
+        y1 = y0 if y is None else int(y) * self.scale
+        self.x, self.y = x1, y1
+
+        if d == 2:
+            self.end_contour()
+            return
+
+        if d == 3:
+            self.on_flash(x1, y1, self.aperture)
+            return
+
+        if self.interpolation == 1:
+            if self.in_region:
+                self.add_contour_point(x0, y0)
+                self.contour.append((x1, y1))
+            else:
+                self.on_draw(x0, y0, x1, y1, self.aperture)
+            return
+
+        cx = x0 + (int(i) * self.scale if i else 0.0)
+        cy = y0 + (int(j) * self.scale if j else 0.0)
+        clockwise = self.interpolation == 2
+        if self.in_region:
+            self.add_contour_point(x0, y0)
+            self.contour.extend(arc_points(x0, y0, x1, y1, cx, cy, clockwise))
+        else:
+            self.on_arc(x0, y0, x1, y1, cx, cy, clockwise, self.aperture)
+
+    def add_contour_point(self, x, y):
+        if not self.contour:
+            self.contour.append((x, y))
+
+    def end_contour(self):
+        if self.contour:
+            if len(self.contour) > 2:
+                self.on_contour(self.contour)
+            self.contour = []
@@ -0,0 +1,451 @@
+# coding: utf8
+# gerber_raster.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Bitmaps of Gerber layers: PNG previews and copper density grids
+
+A layer is read once (gerber_parser) into arrays of flash positions and
+draw segments per aperture. Each aperture is rasterized once and stamped
+at all its positions by numpy indexing, draws are stamped along their
+length, region contours are filled by scanlines. All layers of an output
+share one canvas, so the previews line up.
+
+  python gerber_raster.py <output dir> [--dpi 300] [-o <dir>]
+
+Needs numpy, the plugins work without it unless the previews are asked for.
+'''
+
+import argparse
+import json
+import math
+import os
+import plot_timing
+import struct
+import sys
+import zlib
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from gerber_parser import MM_PER_INCH, GerberParser, get_gerber_files, is_copper, merge_bbox
+
+try:
+    import numpy
+except ImportError:
+    # not bundled with every KiCad
+    numpy = None
+
+
+DEFAULT_DPI = 300
+DEFAULT_JOBS = 4
+
+# Copper density cell size, mm
+DENSITY_CELL = 10.0
+DENSITY_NAME = 'copper_density.json'
+
+# Around the layer extents, mm
+MARGIN = 1.0
+
+# Distance between stamps of a draw, pixels
+DRAW_STEP = 1.0
+
+# Pixel indices computed at once when stamping
+STAMP_BATCH = 4 * 1024 * 1024
+
+PREVIEW_EXT = '.png'
+
+BACKGROUND = (0, 0, 0)
+# (layer name suffix, color), the first match is used
+LAYER_COLORS = (
+    ('_Cu', (200, 140, 50)),
+    ('_Mask', (20, 140, 60)),
+    ('_SilkS', (240, 240, 240)),
+    ('_Paste', (160, 160, 170)),
+    ('Edge_Cuts', (230, 220, 60)),
+)
+DEFAULT_COLOR = (200, 200, 200)
+
+
+class RasterError(Exception):
+    pass
+
+
+def check_numpy():
+    if numpy is None:
+        raise RasterError('numpy is needed to rasterize gerber files')
+
+
+class Run(object):
+    ''' Objects of one polarity, in file order between polarity changes '''
+
+    def __init__(self, dark):
+        self.dark = dark
+        # {D code: array of x, y}
+        self.flashes = {}
+        # {D code: array of x0, y0, x1, y1}
+        self.draws = {}
+        # [numpy array of points]
+        self.contours = []
+
+
+class LayerGraphics(GerberParser):
+    ''' A gerber file as runs of flashes, draws and contours, in mm '''
+
+    def __init__(self):
+        super(LayerGraphics, self).__init__()
+        self.runs = []
+
+    def get_run(self):
+        if not self.runs or self.runs[-1].dark != self.dark:
+            self.runs.append(Run(self.dark))
+        return self.runs[-1]
+
+    def on_flash(self, x, y, aperture):
+        self.get_run().flashes.setdefault(aperture.code, array('d')).extend((x, y))
+
+    def on_draw(self, x0, y0, x1, y1, aperture):
+        self.get_run().draws.setdefault(aperture.code, array('d')).extend((x0, y0, x1, y1))
+
+    def on_contour(self, points):
+        self.get_run().contours.append(numpy.array(points))
+
+    def get_bbox(self):
+        ''' Extents of the dark objects, None if there are none '''
+        boxes = []
+        for run in self.runs:
+            if not run.dark:
+                continue
+            for code, values in run.flashes.items():
+                xy = numpy.frombuffer(values).reshape(-1, 2)
+                extent = self.apertures[code].extent
+                boxes.append(numpy.concatenate((xy.min(0) - extent, xy.max(0) + extent)))
+            for code, values in run.draws.items():
+                xy = numpy.frombuffer(values).reshape(-1, 2)
+                extent = self.apertures[code].extent
+                boxes.append(numpy.concatenate((xy.min(0) - extent, xy.max(0) + extent)))
+            for points in run.contours:
+                boxes.append(numpy.concatenate((points.min(0), points.max(0))))
+        if not boxes:
+            return None
+
+        boxes = numpy.array(boxes)
+        return [float(boxes[:, 0].min()), float(boxes[:, 1].min()),
+                float(boxes[:, 2].max()), float(boxes[:, 3].max())]
+
+
+def load_layer(file_name):
+    check_numpy()
+    return LayerGraphics().parse_file(file_name)
+
+
+def get_canvas_bbox(boxes, margin=MARGIN):
+    ''' Box around the boxes with a margin, one around the origin if there are none '''
+    bbox = merge_bbox(boxes) or [0.0, 0.0, 0.0, 0.0]
+    return [bbox[0] - margin, bbox[1] - margin, bbox[2] + margin, bbox[3] + margin]
+
+
+class Canvas(object):
+    ''' Boolean bitmap, row 0 is the top (largest y) '''
+
+    def __init__(self, bbox, dpi):
+        check_numpy()
+        self.bbox = bbox
+        self.dpi = dpi
+        self.pixel = MM_PER_INCH / dpi
+        self.x0 = bbox[0]
+        self.y0 = bbox[3]
+        width = int(math.ceil((bbox[2] - bbox[0]) / self.pixel)) + 1
+        height = int(math.ceil((bbox[3] - bbox[1]) / self.pixel)) + 1
+        self.image = numpy.zeros((height, width), dtype=bool)
+
+    def to_cols(self, x):
+        return numpy.rint((x - self.x0) / self.pixel).astype(numpy.int64)
+
+    def to_rows(self, y):
+        return numpy.rint((self.y0 - y) / self.pixel).astype(numpy.int64)
+
+    def stamp(self, rows, cols, offsets, dark):
+        ''' Sets the offsets (row, col arrays) around each (row, col) center '''
+        height, width = self.image.shape
+        offset_rows, offset_cols = offsets
+        # neighbouring draw points often fall on the same pixel
+        keep = numpy.ones(len(rows), dtype=bool)
+        keep[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows = rows[keep]
+        cols = cols[keep]
+        if not len(rows):
+            return
+
+        inside = rows.min() + offset_rows.min() >= 0 and \
+                 rows.max() + offset_rows.max() < height and \
+                 cols.min() + offset_cols.min() >= 0 and \
+                 cols.max() + offset_cols.max() < width
+        pixels = self.image.reshape(-1)
+        centers = rows * width + cols
+        offsets = offset_rows * width + offset_cols
+        batch = max(1, STAMP_BATCH // len(offsets))
+        for start in range(0, len(rows), batch):
+            if inside:
+                pixels[(centers[start:start + batch, None] + offsets[None, :]).ravel()] = dark
+                continue
+
+            r = (rows[start:start + batch, None] + offset_rows[None, :]).ravel()
+            c = (cols[start:start + batch, None] + offset_cols[None, :]).ravel()
+            keep = (r >= 0) & (r < height) & (c >= 0) & (c < width)
+            pixels[r[keep] * width + c[keep]] = dark
+
+    def fill_circle(self, x, y, diameter, dark):
+        radius = diameter / 2.0 / self.pixel
+        row = (self.y0 - y) / self.pixel
+        col = (x - self.x0) / self.pixel
+        r0 = max(0, int(math.floor(row - radius)))
+        r1 = min(self.image.shape[0], int(math.ceil(row + radius)) + 1)
+        c0 = max(0, int(math.floor(col - radius)))
+        c1 = min(self.image.shape[1], int(math.ceil(col + radius)) + 1)
+        if r0 >= r1 or c0 >= c1:
+            return
+        rr, cc = numpy.ogrid[r0:r1, c0:c1]
+        mask = (rr - row) ** 2 + (cc - col) ** 2 <= radius * radius
+        view = self.image[r0:r1, c0:c1]
+        if dark:
+            view |= mask
+        else:
+            view &= ~mask
+
+    def fill_polygon(self, points, dark):
+        ''' Even-odd fill of pixels whose centers are inside, points in mm '''
+        height, width = self.image.shape
+        cols = (points[:, 0] - self.x0) / self.pixel
+        rows = (self.y0 - points[:, 1]) / self.pixel
+        c0, r0 = cols, rows
+        c1, r1 = numpy.roll(cols, -1), numpy.roll(rows, -1)
+
+        # edge crosses the rows r with min <= r < max
+        low = numpy.maximum(numpy.ceil(numpy.minimum(r0, r1)), 0).astype(numpy.int64)
+        high = numpy.minimum(numpy.ceil(numpy.maximum(r0, r1)) - 1,
+                             height - 1).astype(numpy.int64)
+        counts = numpy.maximum(high - low + 1, 0)
+        counts[r0 == r1] = 0
+        total = int(counts.sum())
+        if total == 0:
+            return
+
+        edges = numpy.repeat(numpy.arange(len(counts)), counts)
+        starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        row = low[edges] + (numpy.arange(total) - starts)
+        x = c0[edges] + (row - r0[edges]) * (c1[edges] - c0[edges]) / (r1[edges] - r0[edges])
+
+        order = numpy.lexsort((x, row))
+        row = row[order][0::2]
+        x = x[order]
+        span_start = numpy.clip(numpy.ceil(x[0::2]), 0, width).astype(numpy.int64)
+        span_end = numpy.clip(numpy.ceil(x[1::2]), 0, width).astype(numpy.int64)
+
+        top = int(row.min())
+        left = int(span_start.min())
+        right = int(span_end.max())
+        if left >= right:
+            return
+        # +1 at the first pixel of a span, -1 after its last one
+        diff = numpy.zeros((int(row.max()) - top + 1, right - left + 1), dtype=numpy.int8)
+        numpy.add.at(diff, (row - top, span_start - left), 1)
+        numpy.add.at(diff, (row - top, span_end - left), -1)
+        mask = numpy.cumsum(diff, axis=1, dtype=numpy.int8)[:, :-1] > 0
+
+        view = self.image[top:top + mask.shape[0], left:right]
+        if dark:
+            view |= mask
+        else:
+            view &= ~mask
+
+
+def get_aperture_offsets(aperture, dpi):
+    ''' (row, col) offsets of the aperture pixels from its center pixel '''
+    pixel = MM_PER_INCH / dpi
+    k = int(math.ceil(aperture.extent / pixel)) + 1
+    canvas = Canvas([-k * pixel, -k * pixel, k * pixel, k * pixel], dpi)
+    for dark, kind, data in aperture.shapes:
+        if kind == 'circle':
+            canvas.fill_circle(data[0], data[1], data[2], dark)
+        else:
+            canvas.fill_polygon(numpy.array(data), dark)
+    if not canvas.image.any():
+        # smaller than a pixel
+        canvas.image[k, k] = True
+    rows, cols = numpy.nonzero(canvas.image)
+    return rows - k, cols - k
+
+
+def get_draw_points(segments, step):
+    ''' Points at most step apart along each (x0, y0, x1, y1) segment '''
+    x0, y0, x1, y1 = segments.T
+    lengths = numpy.hypot(x1 - x0, y1 - y0)
+    counts = numpy.ceil(lengths / step).astype(numpy.int64) + 1
+    index = numpy.repeat(numpy.arange(len(counts)), counts)
+    starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    t = (numpy.arange(int(counts.sum())) - starts) / numpy.maximum(counts - 1, 1)[index]
+    return x0[index] + (x1 - x0)[index] * t, y0[index] + (y1 - y0)[index] * t
+
+
+def render(layer, bbox, dpi=DEFAULT_DPI):
+    ''' Returns the Canvas of a LayerGraphics '''
+    canvas = Canvas(bbox, dpi)
+    offsets = {}
+
+    def get_offsets(code):
+        if code not in offsets:
+            offsets[code] = get_aperture_offsets(layer.apertures[code], dpi)
+        return offsets[code]
+
+    for run in layer.runs:
+        for code, values in run.flashes.items():
+            xy = numpy.frombuffer(values).reshape(-1, 2)
+            canvas.stamp(canvas.to_rows(xy[:, 1]), canvas.to_cols(xy[:, 0]), get_offsets(code),
+                         run.dark)
+
+        for code, values in run.draws.items():
+            x, y = get_draw_points(numpy.frombuffer(values).reshape(-1, 4),
+                                   canvas.pixel * DRAW_STEP)
+            canvas.stamp(canvas.to_rows(y), canvas.to_cols(x), get_offsets(code), run.dark)
+
+        for points in run.contours:
+            canvas.fill_polygon(points, run.dark)
+
+    return canvas
+
+
+def get_density_grid(image, pixel, cell=DENSITY_CELL):
+    ''' Dark fraction of each cell x cell mm square, from the top left '''
+    size = max(1, int(round(cell / pixel)))
+    height, width = image.shape
+    rows = -(-height // size)
+    cols = -(-width // size)
+    padded = numpy.zeros((rows * size, cols * size), dtype=bool)
+    padded[:height, :width] = image
+    grid = padded.reshape(rows, size, cols, size).sum(axis=(1, 3))
+    # cells on the right and bottom edges may be cut
+    row_sizes = numpy.minimum(size, height - numpy.arange(rows) * size)
+    col_sizes = numpy.minimum(size, width - numpy.arange(cols) * size)
+    return grid / numpy.outer(row_sizes, col_sizes)
+
+
+def get_layer_color(name):
+    for mark, color in LAYER_COLORS:
+        if name.endswith(mark):
+            return color
+    return DEFAULT_COLOR
+
+
+def png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + \
+           struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def write_palette_png(file_name, rows, width, bit_depth, palette, level=6):
+    ''' rows: uint8 array of packed pixel rows, palette: [(r, g, b)] '''
+    raw = numpy.zeros((rows.shape[0], rows.shape[1] + 1), dtype=numpy.uint8)
+    # filter type 0 in the first byte of each row
+    raw[:, 1:] = rows
+
+    with open(file_name, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, rows.shape[0], bit_depth, 3,
+                                               0, 0, 0)))
+        f.write(png_chunk(b'PLTE', b''.join(bytes(color) for color in palette)))
+        f.write(png_chunk(b'IDAT', zlib.compress(raw.tobytes(), level)))
+        f.write(png_chunk(b'IEND', b''))
+
+
+def write_png(file_name, image, color, background=BACKGROUND, level=6):
+    ''' 1 bit palette PNG of a boolean image '''
+    write_palette_png(file_name, numpy.packbits(image, axis=1), image.shape[1], 1,
+                      (background, color), level)
+
+
+def load_layers(file_names, jobs=DEFAULT_JOBS):
+    ''' Returns {file name: LayerGraphics} '''
+    check_numpy()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return dict(zip(file_names, executor.map(load_layer, file_names)))
+
+
+def write_previews(path, output_dir=None, dpi=DEFAULT_DPI, jobs=DEFAULT_JOBS,
+                   cell=DENSITY_CELL):
+    ''' PNG of each gerber file of path and the copper density grids
+
+    Written to output_dir, path by default. Returns the density summary.
+    '''
+    output_dir = output_dir or path
+    with plot_timing.span('gerber_raster', dpi=dpi):
+        layers = load_layers(get_gerber_files(path), jobs)
+        bbox = get_canvas_bbox(layer.get_bbox() for layer in layers.values())
+
+        def write_preview(item):
+            file_name, layer = item
+            name = os.path.splitext(os.path.basename(file_name))[0]
+            canvas = render(layer, bbox, dpi)
+            write_png(output_dir + os.path.sep + name + PREVIEW_EXT, canvas.image,
+                      get_layer_color(name))
+            if not is_copper(name):
+                return None
+            grid = get_density_grid(canvas.image, canvas.pixel, cell)
+            return name, {
+                'fill': round(float(canvas.image.mean()), 4),
+                'grid': numpy.round(grid, 3).tolist(),
+            }
+
+        # numpy releases the GIL in the large operations
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            copper = dict(result for result in executor.map(write_preview, layers.items())
+                          if result)
+
+    density = {
+        'units': 'mm',
+        'bbox': [round(value, 4) for value in bbox],
+        'cell': cell,
+        'dpi': dpi,
+        'layers': copper,
+    }
+    with open(output_dir + os.path.sep + DENSITY_NAME, 'w') as f:
+        json.dump(density, f, indent=2, sort_keys=True)
+    return density
+
+
+def add_arguments(parser):
+    parser.add_argument('-p', '--previews', type=int, nargs='?', const=DEFAULT_DPI, default=0,
+                        metavar='DPI', help='add PNG previews and copper density grids of the '
+                                            'gerber files, needs numpy')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PNG previews and copper density of Gerber files')
+    parser.add_argument('path', help='directory with gerber files')
+    parser.add_argument('-o', '--output-dir', help='write the images here, path by default')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI, help='resolution of the images')
+    parser.add_argument('--cell', type=float, default=DENSITY_CELL,
+                        help='copper density cell size, mm')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help='files rendered at once')
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    write_previews(args.path, args.output_dir, args.dpi, args.jobs, args.cell)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
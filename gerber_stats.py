@@ -0,0 +1,189 @@
+# coding: utf8
+# gerber_stats.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Per layer statistics of Gerber files for fab quoting
+
+Extents, aperture usage, flash and draw counts and the dark area of each
+layer, read in one streaming pass per file. The area is the sum of the
+object areas: overlaps are counted more than once and clear objects are
+subtracted, so it is an estimate.
+
+  python gerber_stats.py <output dir or gerber files> [-o stats.json]
+'''
+
+import argparse
+import json
+import math
+import os
+import plot_timing
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from gerber_parser import (EDGE_CUTS_MARK, GerberParser, arc_length, arc_points,
+                           get_gerber_files, is_copper, merge_bbox)
+from version import VERSION
+
+
+STATS_NAME = 'gerber_stats.json'
+
+# Files read at once, more only add memory: reading holds the GIL
+DEFAULT_JOBS = 4
+
+
+class GerberStats(GerberParser):
+
+    def __init__(self):
+        super(GerberStats, self).__init__()
+        self.bbox = [math.inf, math.inf, -math.inf, -math.inf]
+        self.flashes = 0
+        self.draws = 0
+        self.arcs = 0
+        self.regions = 0
+        self.area = 0.0
+        # {D code: [flashes, draws]}
+        self.usage = {}
+
+    def extend(self, x, y, margin=0.0):
+        bbox = self.bbox
+        bbox[0] = min(bbox[0], x - margin)
+        bbox[1] = min(bbox[1], y - margin)
+        bbox[2] = max(bbox[2], x + margin)
+        bbox[3] = max(bbox[3], y + margin)
+
+    def add_area(self, area):
+        self.area += area if self.dark else -area
+
+    def on_aperture(self, aperture):
+        self.usage[aperture.code] = [0, 0]
+
+    def on_flash(self, x, y, aperture):
+        self.flashes += 1
+        self.usage[aperture.code][0] += 1
+        self.add_area(aperture.area)
+        if self.dark:
+            self.extend(x, y, aperture.extent)
+
+    def on_draw(self, x0, y0, x1, y1, aperture):
+        self.draws += 1
+        self.usage[aperture.code][1] += 1
+        self.add_area(math.hypot(x1 - x0, y1 - y0) * aperture.width)
+        if self.dark:
+            self.extend(x0, y0, aperture.width / 2.0)
+            self.extend(x1, y1, aperture.width / 2.0)
+
+    def on_arc(self, x0, y0, x1, y1, cx, cy, clockwise, aperture):
+        self.draws += 1
+        self.arcs += 1
+        self.usage[aperture.code][1] += 1
+        self.add_area(arc_length(x0, y0, x1, y1, cx, cy, clockwise) * aperture.width)
+        if self.dark:
+            self.extend(x0, y0, aperture.width / 2.0)
+            for x, y in arc_points(x0, y0, x1, y1, cx, cy, clockwise):
+                self.extend(x, y, aperture.width / 2.0)
+
+    def on_contour(self, points):
+        self.regions += 1
+        area = 0.0
+        x0, y0 = points[-1]
+        for x1, y1 in points:
+            area += x0 * y1 - x1 * y0
+            x0, y0 = x1, y1
+        self.add_area(abs(area) / 2.0)
+        if self.dark:
+            for x, y in points:
+                self.extend(x, y)
+
+    def get_summary(self):
+        return {
+            'bbox': [round(value, 4) for value in self.bbox] if self.bbox[0] <= self.bbox[2]
+                    else None,
+            'flashes': self.flashes,
+            'draws': self.draws,
+            'arcs': self.arcs,
+            'regions': self.regions,
+            'dark_area': round(self.area, 3),
+            'apertures': dict(('D{0}'.format(code), {
+                'template': self.apertures[code].template,
+                'params': [round(value, 6) for value in self.apertures[code].params],
+                'flashes': flashes,
+                'draws': draws,
+            }) for code, (flashes, draws) in sorted(self.usage.items())),
+        }
+
+
+def get_file_stats(file_name):
+    return GerberStats().parse_file(file_name).get_summary()
+
+
+def get_stats(file_names, jobs=DEFAULT_JOBS):
+    ''' Returns the summary of the files, read by a pool of threads '''
+    with plot_timing.span('gerber_stats'):
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            layers = dict(zip((os.path.basename(name) for name in file_names),
+                              executor.map(get_file_stats, file_names)))
+
+    outline = [stats['bbox'] for name, stats in layers.items() if EDGE_CUTS_MARK in name]
+    bbox = merge_bbox(outline) or merge_bbox(stats['bbox'] for stats in layers.values())
+    board = {
+        'bbox': bbox,
+        'width': round(bbox[2] - bbox[0], 4) if bbox else None,
+        'height': round(bbox[3] - bbox[1], 4) if bbox else None,
+        'copper_area': round(sum(stats['dark_area'] for name, stats in layers.items()
+                                 if is_copper(name)), 3),
+    }
+
+    return {
+        'version': VERSION,
+        'units': 'mm',
+        'board': board,
+        'layers': layers,
+    }
+
+
+def write_stats(path, jobs=DEFAULT_JOBS):
+    ''' Writes the summary of the gerber files of an output directory into it '''
+    stats = get_stats(get_gerber_files(path), jobs)
+    with open(path + os.path.sep + STATS_NAME, 'w') as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Statistics of Gerber files')
+    parser.add_argument('paths', nargs='+', help='gerber files or output directories')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help='files read at once')
+    parser.add_argument('-o', '--output', help='write the summary to this file')
+    args = parser.parse_args()
+
+    file_names = []
+    for path in args.paths:
+        file_names.extend(get_gerber_files(path) if os.path.isdir(path) else [path])
+
+    stats = get_stats(file_names, args.jobs)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+    else:
+        json.dump(stats, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# coding: utf8
+# layer_plotter.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Serial and multi-process plotting of board layers '''
+
+import multiprocessing
+import os
+import pcbnew
+import plot_progress
+import plot_timing
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# Every worker loads its own copy of the board, so a worker only pays off
+# when there is enough to plot on top of that load.
+ITEMS_PER_WORKER = 5000
+
+# Rough relative plot costs, only the order of the layers depends on them
+LAYER_COST = 10
+ITEM_COST = 1
+PAD_COST = 4
+ZONE_VERTEX_COST = 0.5
+HOLE_COST = 2
+
+# Board and controller of a worker process, see _init_worker()
+_worker = {}
+
+
+def apply_plot_options(plot_opts, options):
+    for setter, value in options:
+        getattr(plot_opts, setter)(value)
+
+
+def plot_layer(plot_ctrl, layer, name, plot_format):
+    with plot_timing.stage('PlotLayer', layer=name):
+        plot_ctrl.SetLayer(layer)
+        plot_ctrl.OpenPlotfile(name, plot_format, name)
+        plot_ctrl.PlotLayer()
+        file_name = os.path.basename(plot_ctrl.GetPlotFileName())
+        # close now, so the file is complete before the next layer starts
+        plot_ctrl.ClosePlot()
+    return file_name
+
+
+def plot_layer_list(plot_ctrl, plot_format, layers, on_plotted=None, output_dir=None,
+                    progress=plot_progress.NO_PROGRESS):
+    ''' Returns {layer name: plotted file name}
+
+    on_plotted(file name) is called as soon as each file is written.
+    output_dir overrides the output directory of the layer options.
+    '''
+    files = {}
+    plot_opts = plot_ctrl.GetPlotOptions()
+    for layer, name, options in layers:
+        progress.update(name)
+        apply_plot_options(plot_opts, options)
+        if output_dir is not None:
+            plot_opts.SetOutputDirectory(output_dir)
+        files[name] = plot_layer(plot_ctrl, layer, name, plot_format)
+        if on_plotted:
+            on_plotted(files[name])
+    return files
+
+
+def skip_empty_layers(index, layers):
+    ''' Drop layers without any item on them, e.g. B_Paste of a single-sided board '''
+    return [layer for layer in layers if index.is_used(layer[0])]
+
+
+def choose_jobs(index, task_count, max_jobs=None):
+    if max_jobs is None:
+        max_jobs = os.cpu_count() or 1
+
+    jobs = min(index.copper_layer_count // 2, 1 + index.item_count // ITEMS_PER_WORKER)
+
+    return max(1, min(jobs, max_jobs, task_count))
+
+
+def resolve_jobs(index, jobs, task_count):
+    ''' jobs == 0 means "pick from the board size" '''
+    if jobs == 0:
+        return choose_jobs(index, task_count)
+    return max(1, min(jobs, task_count))
+
+
+def estimate_costs(index, layers):
+    ''' Returns ({layer id: plot cost}, drill files cost) from the items on the layers '''
+    costs = {}
+    for layer, name, options in layers:
+        other = index.items[layer] - index.pads[layer] - index.zones[layer]
+        costs[layer] = LAYER_COST + ITEM_COST * other + PAD_COST * index.pads[layer] + \
+                       ZONE_VERTEX_COST * index.zone_vertices[layer]
+
+    return costs, LAYER_COST + HOLE_COST * index.holes
+
+
+def order_tasks(index, layers, calls=()):
+    ''' Most expensive first, so the heavy copper planes do not finish last '''
+    costs, call_cost = estimate_costs(index, layers)
+
+    tasks = [(call_cost, call) for call in calls]
+    tasks += [(costs[layer[0]], layer) for layer in layers]
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    return [task for cost, task in tasks]
+
+
+def plot_layers_parallel(index, plot_format, layers, jobs, calls=(), on_plotted=None,
+                         output_dir=None):
+    ''' Plot layers and run calls(board) in worker processes
+
+    Each worker loads the board once and takes the next task as soon as it
+    is free, tasks are handed out longest first.
+    '''
+    files = {}
+    tasks = order_tasks(index, layers, calls)
+    # spawn: forking a process with a loaded pcbnew is not safe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_init_worker,
+                             initargs=(index.file_name, plot_format, output_dir)) as executor:
+        futures = [executor.submit(_plot_task, task) for task in tasks]
+        for future in as_completed(futures):
+            task_files, records = future.result()
+            plot_timing.extend(records)
+            files.update(task_files)
+            if on_plotted:
+                for file_name in task_files.values():
+                    on_plotted(file_name)
+    return files
+
+
+def _init_worker(board_file, plot_format, output_dir):
+    _worker['board'] = pcbnew.LoadBoard(board_file)
+    _worker['plot_ctrl'] = pcbnew.PLOT_CONTROLLER(_worker['board'])
+    _worker['plot_format'] = plot_format
+    _worker['output_dir'] = output_dir
+
+
+def _plot_task(task):
+    files = {}
+    if callable(task):
+        task(_worker['board'])
+    else:
+        files = plot_layer_list(_worker['plot_ctrl'], _worker['plot_format'], [task],
+                                output_dir=_worker['output_dir'])
+
+    return files, plot_timing.take_records()
@@ -0,0 +1,206 @@
+# coding: utf8
+# output_staging.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Output directory written aside and swapped in when complete
+
+Files are generated in <path>.staging, the previous <path> is renamed to
+<path>.old-<n> and removed in a background thread. A failed run leaves
+the previous outputs as they were.
+
+Runs on the same output directory are serialized with an advisory lock
+of <path>.lock.
+'''
+
+import itertools
+import os
+import plot_timing
+import shutil
+import stat
+import sys
+import threading
+import time
+
+from contextlib import contextmanager, nullcontext
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+STAGING_SUFFIX = '.staging'
+OLD_SUFFIX = '.old-'
+LOCK_SUFFIX = '.lock'
+
+# Seconds between attempts to take a lock held by another run
+LOCK_POLL_INTERVAL = 0.2
+
+LOCKED_MESSAGE = 'Output directory is locked by another run, waiting'
+
+# Runs of one process within a second, e.g. of the plot daemon
+_unique_counter = itertools.count()
+
+
+class OutputLocked(Exception):
+    ''' Another run kept the output directory locked for too long '''
+
+
+def remove_read_only(function, path, error):
+    ''' Files linked to a release store are read-only, Windows does not remove them '''
+    try:
+        os.chmod(path, stat.S_IWRITE)
+        function(path)
+    except OSError:
+        pass
+
+
+def remove_tree(path):
+    # onerror is deprecated since 3.12, onexc gets the same arguments
+    handler = 'onexc' if sys.version_info >= (3, 12) else 'onerror'
+    shutil.rmtree(path, **{handler: remove_read_only})
+
+
+def remove_in_background(path):
+    ''' Not a daemon thread: a command line run waits for it on exit '''
+    thread = threading.Thread(target=remove_tree, args=(path,))
+    thread.start()
+    return thread
+
+
+def get_old_dirs(path):
+    parent, name = os.path.split(path)
+    if not os.path.isdir(parent):
+        return []
+    return [parent + os.path.sep + d for d in os.listdir(parent)
+            if d.startswith(name + OLD_SUFFIX)]
+
+
+def make_staging(path):
+    staging = path + STAGING_SUFFIX
+    # leftovers of a crashed run
+    for old in get_old_dirs(path):
+        remove_in_background(old)
+    if os.path.exists(staging):
+        discard(staging, path)
+
+    os.makedirs(staging)
+    return staging
+
+
+def get_old_name(path):
+    return path + OLD_SUFFIX + str(time.time_ns())
+
+
+def discard(directory, path):
+    ''' Renamed first, so a new staging directory can be made right away '''
+    old = get_old_name(path)
+    os.rename(directory, old)
+    remove_in_background(old)
+
+
+def publish(staging, path):
+    ''' Readers never see a partial directory, between the renames they see none '''
+    if os.path.exists(path):
+        discard(path, path)
+    os.rename(staging, path)
+
+
+def try_lock(f):
+    try:
+        if os.name == 'nt':
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def unlock(f):
+    if os.name == 'nt':
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def lock(path, timeout=None, wait=None):
+    ''' Advisory lock of an output directory, waits forever without a timeout
+
+    wait(message) is called between attempts while another run holds the
+    lock, it may raise to give up. The lock file is left in place: removing
+    it would race with a run which has just opened it.
+    '''
+    parent = os.path.dirname(path)
+    if not os.path.exists(parent):
+        os.makedirs(parent, exist_ok=True)
+
+    with open(path + LOCK_SUFFIX, 'a+') as f:
+        # msvcrt locks bytes from the current position
+        f.seek(0)
+        with plot_timing.stage('lock_output'):
+            start = time.monotonic()
+            while not try_lock(f):
+                if timeout is not None and time.monotonic() - start > timeout:
+                    raise OutputLocked(path)
+                if wait is not None:
+                    wait(LOCKED_MESSAGE)
+                time.sleep(LOCK_POLL_INTERVAL)
+
+        try:
+            yield
+        finally:
+            unlock(f)
+
+
+@contextmanager
+def swap(path, locked=True, timeout=None, wait=None):
+    ''' Yields the staging directory, swapped in as path on success
+
+    The output directory is locked for the whole run, unless no other run
+    can use it. timeout and wait are those of lock().
+    '''
+    with lock(path, timeout, wait) if locked else nullcontext():
+        with plot_timing.stage('make_staging'):
+            staging = make_staging(path)
+        try:
+            yield staging
+        except BaseException:
+            discard(staging, path)
+            raise
+
+        publish(staging, path)
+
+
+def get_unique_path(path):
+    ''' Output directory of this run only, e.g. gerber-20230501-120000-4242-0 '''
+    while True:
+        unique = '{0}-{1}-{2}-{3}'.format(path, time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                                          next(_unique_counter))
+        # a restarted daemon keeps its pid and starts counting again
+        if not os.path.exists(unique) and not os.path.exists(unique + STAGING_SUFFIX):
+            return unique
+
+
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        # file systems without hard links
+        shutil.copy2(source, destination)
@@ -0,0 +1,293 @@
+# coding: utf8
+# output_zip.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Single pass zip archive of generated files '''
+
+import bz2
+import collections
+import os
+import plot_timing
+import re
+import sys
+import time
+import zipfile
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+# Methods with a compression level, lzma uses its default preset
+LEVELS = {
+    'deflate': range(0, 10),
+    'bzip2': range(1, 10),
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+# write_compressed() registers members in ZipFile internals, which are the
+# same from 3.6 to these versions. Later ones compress with writestr().
+MAX_PRECOMPRESSED_VERSION = (3, 13)
+ZIP_FILE_INTERNALS = ('fp', 'filelist', 'NameToInfo', 'start_dir', '_didModify')
+
+STAMP_SUFFIX = '.stamp.txt'
+
+# Earliest date a zip can store
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+# Gerber (G04) and Excellon (;) comments with the plot date, e.g.
+# "G04 #@! TF.CreationDate,2023-05-01T12:00:00+03:00*"
+# "; DRILL file {KiCad 7.0.5} date 2023-05-01T12:00:00+0300"
+DATE_COMMENT_RE = re.compile(rb'^(?:G04|;)[^\n]*(?:CreationDate| date )[^\n]*\n', re.MULTILINE)
+
+
+class ZipOutput(object):
+    ''' Zip archive written in place inside the output directory
+
+    Files are added as soon as they are generated, whatever is left in the
+    directory and its subdirectories (the panel) is added on close, as
+    <dir>/<file> members. Members are compressed in a thread pool (zlib, bz2
+    and lzma release the GIL) and written in the order added.
+
+    A deterministic archive gives the same bytes for the same files: members
+    are sorted, timestamps and attributes are fixed, plot date comments are
+    dropped from the members and the stamp comment goes to a
+    <name>.zip.stamp.txt file next to the archive.
+
+    Used as a context manager, an archive left unclosed by an exception is
+    aborted.
+    '''
+
+    def __init__(self, path, name, method='deflate', level=None, threads=None,
+                 deterministic=False):
+        check_level(method, level)
+        self.path = path
+        self.name = name + '.zip'
+        self.method = METHODS[method]
+        self.level = level
+        self.deterministic = deterministic
+        self.added = set()
+        self.pending = collections.deque()
+        self.max_pending = 2 * (threads or os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(threads)
+        self.zip_file = zipfile.ZipFile(path + os.path.sep + self.name, 'w', self.method)
+        self.precompressed = can_write_compressed(self.zip_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+
+    def add(self, name):
+        if name in self.added:
+            return
+        self.added.add(name)
+        if not self.deterministic:
+            self.compress(name)
+
+    def compress(self, name):
+        file_name = self.path + os.path.sep + name
+        # without write_compressed() the pool only reads the files
+        method = self.method if self.precompressed else zipfile.ZIP_STORED
+        future = self.executor.submit(compress_file, file_name, method, self.level,
+                                      self.deterministic)
+        self.pending.append((name, future))
+
+        while self.pending and (self.pending[0][1].done() or
+                                len(self.pending) > self.max_pending):
+            self.write_next()
+
+    def write_next(self):
+        name, future = self.pending.popleft()
+        data, crc, size = future.result()
+
+        zinfo = zipfile.ZipInfo.from_file(self.path + os.path.sep + name, name)
+        if self.deterministic:
+            zinfo.date_time = get_fixed_date_time()
+            zinfo.create_system = 3
+            zinfo.external_attr = 0o100644 << 16
+        with plot_timing.span('write', file=name, bytes=len(data)):
+            if self.precompressed:
+                write_compressed(self.zip_file, zinfo, self.method, data, crc, size)
+            else:
+                self.zip_file.writestr(zinfo, data, self.method, self.level)
+
+    def close(self, comment):
+        for name in get_member_names(self.path):
+            if not name.startswith(self.name):
+                self.add(name)
+
+        if self.deterministic:
+            for name in sorted(self.added):
+                self.compress(name)
+
+        while self.pending:
+            self.write_next()
+        self.executor.shutdown()
+
+        if self.deterministic:
+            with open(self.path + os.path.sep + self.name + STAMP_SUFFIX, 'w') as f:
+                f.write(comment)
+        else:
+            self.zip_file.comment = bytes(comment, 'utf-8')
+        self.zip_file.close()
+
+    def abort(self):
+        ''' Stop compressing and close the file, it holds the members written so far '''
+        for name, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+        self.zip_file.close()
+
+
+def get_member_names(path):
+    ''' Files of path and its subdirectories, relative to path with / separators '''
+    names = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        prefix = os.path.relpath(dirpath, path).replace(os.path.sep, '/') + '/'
+        if prefix == './':
+            prefix = ''
+        names += [prefix + name for name in sorted(filenames)]
+    return names
+
+
+def check_level(method, level):
+    if level is None:
+        return
+    if method not in LEVELS:
+        raise ValueError('{0} zip method has no compression level'.format(method))
+    if level not in LEVELS[method]:
+        raise ValueError('{0} zip level must be {1}-{2}'.format(method, LEVELS[method][0],
+                                                                LEVELS[method][-1]))
+
+
+def get_fixed_date_time():
+    ''' SOURCE_DATE_EPOCH if set, the zip epoch otherwise '''
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch is None:
+        return ZIP_EPOCH
+    return max(ZIP_EPOCH, time.gmtime(int(epoch))[:6])
+
+
+def get_compressor(method, level):
+    if method == zipfile.ZIP_DEFLATED:
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        return zlib.compressobj(level, zlib.DEFLATED, -15)
+    if method == zipfile.ZIP_BZIP2:
+        return bz2.BZ2Compressor(9 if level is None else level)
+    if method == zipfile.ZIP_LZMA:
+        # also writes the properties header zip readers expect
+        return zipfile.LZMACompressor()
+    return None
+
+
+def compress_file(file_name, method, level, strip_dates=False):
+    ''' Returns (compressed data, crc, uncompressed size) '''
+    with plot_timing.span('compress', file=os.path.basename(file_name)):
+        return _compress_file(file_name, method, level, strip_dates)
+
+
+def _compress_file(file_name, method, level, strip_dates):
+    compressor = get_compressor(method, level)
+    chunks = []
+    crc = 0
+    size = 0
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            if strip_dates and size == 0:
+                # the dates are in the file header
+                chunk = DATE_COMMENT_RE.sub(b'', chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            chunks.append(compressor.compress(chunk) if compressor else chunk)
+    if compressor:
+        chunks.append(compressor.flush())
+
+    return b''.join(chunks), crc, size
+
+
+def can_write_compressed(zip_file):
+    return sys.version_info[:2] <= MAX_PRECOMPRESSED_VERSION and \
+           all(hasattr(zip_file, name) for name in ZIP_FILE_INTERNALS)
+
+
+def write_compressed(zip_file, zinfo, method, data, crc, size):
+    ''' Append an already compressed member
+
+    ZipFile compresses only under its own lock, so the member is written
+    here and registered the way ZipFile.write() does it. The central
+    directory, including zip64 records, is still written by ZipFile.close().
+    '''
+    zinfo.compress_type = method
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    zinfo.compress_size = len(data)
+    if method == zipfile.ZIP_LZMA:
+        zinfo.flag_bits |= 0x02
+
+    zip64 = size > zipfile.ZIP64_LIMIT or len(data) > zipfile.ZIP64_LIMIT
+    zinfo.header_offset = zip_file.fp.tell()
+    zip_file.fp.write(zinfo.FileHeader(zip64))
+    zip_file.fp.write(data)
+
+    zip_file.filelist.append(zinfo)
+    zip_file.NameToInfo[zinfo.filename] = zinfo
+    zip_file.start_dir = zip_file.fp.tell()
+    zip_file._didModify = True
+
+
+def add_arguments(parser):
+    parser.add_argument('--zip-method', choices=sorted(METHODS), default='deflate',
+                        help='compression method of the output zip')
+    parser.add_argument('--zip-level', type=int, default=None,
+                        help='compression level of the output zip: 0-9 for deflate, '
+                             '1-9 for bzip2, lzma and stored have none')
+    parser.add_argument('--zip-threads', type=int, default=None,
+                        help='number of threads compressing zip members')
+    parser.add_argument('--deterministic', action='store_true',
+                        help='byte-identical zip for identical files, '
+                             'the stamp goes to a separate file')
+
+
+def get_key_options(options):
+    ''' Options which change the archive bytes, threads only change the speed '''
+    options = options or {}
+    return (options.get('method', 'deflate'), options.get('level'),
+            options.get('deterministic', False))
+
+
+def get_options(args):
+    ''' Raises ValueError for a level the method does not have '''
+    check_level(args.zip_method, args.zip_level)
+    return {
+        'method': args.zip_method,
+        'level': args.zip_level,
+        'threads': args.zip_threads,
+        'deterministic': args.deterministic,
+    }
@@ -0,0 +1,218 @@
+# coding: utf8
+# plot_cache.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Manifest of generated files for skipping re-plot of unchanged boards '''
+
+import hashlib
+import json
+import os
+import output_staging
+import plot_timing
+
+from version import VERSION
+
+
+MANIFEST_NAME = 'manifest.json'
+
+CHUNK_SIZE = 1024 * 1024
+
+# With "subtract mask from silk" the silkscreen is clipped by the mask layer,
+# pcbnew layer names
+LAYER_DEPENDENCIES = {
+    'F_SilkS': ('F_Mask',),
+    'B_SilkS': ('B_Mask',),
+}
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def make_key(board_file, options):
+    ''' What the outputs depend on: board file, plot options and plugin version '''
+    return {
+        'version': VERSION,
+        'board_sha256': file_sha256(board_file),
+        'options_sha256': hashlib.sha256(repr(options).encode('utf-8')).hexdigest(),
+    }
+
+
+def load_manifest(path):
+    try:
+        with open(path + os.path.sep + MANIFEST_NAME, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_up_to_date(path, key):
+    manifest = load_manifest(path)
+    if manifest is None or manifest.get('key') != key:
+        return False
+
+    for name, entry in manifest['files'].items():
+        file_name = path + os.path.sep + name
+        if not os.path.isfile(file_name) or os.path.getsize(file_name) != entry['size']:
+            return False
+
+    return True
+
+
+def get_footprint_context(footprint):
+    ''' Placement and footprint wide overrides, a formatted item has neither '''
+    pos = footprint.GetPosition()
+    return repr((
+        footprint.GetReference(),
+        pos.x,
+        pos.y,
+        footprint.GetOrientationDegrees(),
+        footprint.GetLayer(),
+        footprint.GetLocalClearance(),
+        footprint.GetLocalSolderMaskMargin(),
+        footprint.GetLocalSolderPasteMargin(),
+        footprint.GetLocalSolderPasteMarginRatio(),
+    )) + '\n'
+
+
+def get_board_settings(board):
+    ''' Board wide settings which can change any plotted layer '''
+    settings = board.GetDesignSettings()
+    aux_origin = settings.GetAuxOrigin()
+    title_block = board.GetTitleBlock()
+
+    values = [
+        VERSION,
+        settings.GetCopperLayerCount(),
+        settings.m_SolderMaskMargin,
+        settings.m_SolderMaskMinWidth,
+        settings.m_SolderPasteMargin,
+        settings.m_SolderPasteMarginRatio,
+        aux_origin.x,
+        aux_origin.y,
+        title_block.GetTitle(),
+        title_block.GetDate(),
+        title_block.GetRevision(),
+        title_block.GetCompany(),
+    ]
+    values += [title_block.GetComment(i) for i in range(9)]
+    values += sorted(dict(board.GetProperties()).items())
+
+    return repr(values)
+
+
+def layer_fingerprints(board, layers):
+    ''' Returns {layer name: hash of everything plotted on the layer} '''
+    with plot_timing.span('layer_fingerprints'):
+        return _layer_fingerprints(board, layers)
+
+
+def _layer_fingerprints(board, layers):
+    # only the fingerprints need KiCad, the manifest is read without it (release_store)
+    import board_index
+    import pcbnew
+
+    settings = get_board_settings(board).encode('utf-8')
+    hashes = {}
+    for layer, name, options in layers:
+        hashes[layer] = hashlib.sha256(settings)
+
+    io = pcbnew.PCB_PLUGIN()
+    # items of a footprint come one after another
+    last_footprint = None
+    context = ''
+    for item, footprint in board_index.iter_items(board):
+        if footprint is not last_footprint:
+            last_footprint = footprint
+            context = get_footprint_context(footprint) if footprint is not None else ''
+
+        item_layers = [layer for layer in item.GetLayerSet().Seq() if layer in hashes]
+        if not item_layers:
+            continue
+
+        io.Format(item)
+        data = (context + io.GetStringOutput(True)).encode('utf-8')
+        for layer in item_layers:
+            hashes[layer].update(data)
+
+    fingerprints = {}
+    for layer, name, options in layers:
+        sha = hashes[layer].copy()
+        for dependency in get_layer_dependencies(layer):
+            if dependency in hashes:
+                sha.update(hashes[dependency].digest())
+        sha.update(repr(options).encode('utf-8'))
+        fingerprints[name] = sha.hexdigest()
+
+    return fingerprints
+
+
+def get_layer_dependencies(layer):
+    ''' Layers which change how layer is plotted, by LAYER_DEPENDENCIES '''
+    import pcbnew
+    for name, dependencies in LAYER_DEPENDENCIES.items():
+        if getattr(pcbnew, name) == layer:
+            return [getattr(pcbnew, dependency) for dependency in dependencies]
+    return []
+
+
+def prepare_output(path, staging, fingerprints):
+    ''' Carry files of layers which did not change since the last run into staging
+
+    Returns {layer name: file name} of the kept layers.
+    '''
+    manifest = load_manifest(path) or {}
+    kept = {}
+    for name, entry in manifest.get('layers', {}).items():
+        file_name = path + os.path.sep + entry['file']
+        if fingerprints.get(name) == entry['fingerprint'] and os.path.isfile(file_name):
+            output_staging.link_or_copy(file_name, staging + os.path.sep + entry['file'])
+            kept[name] = entry['file']
+
+    return kept
+
+
+def write_manifest(path, key, fingerprints=None, layer_files=None, layer_items=None):
+    ''' layer_items: {layer name: item count} from the board index '''
+    with plot_timing.span('write_manifest'):
+        _write_manifest(path, key, fingerprints, layer_files, layer_items or {})
+
+
+def _write_manifest(path, key, fingerprints, layer_files, layer_items):
+    layers = {}
+    for name, file_name in (layer_files or {}).items():
+        layers[name] = {'fingerprint': fingerprints[name], 'file': file_name}
+        if name in layer_items:
+            layers[name]['items'] = layer_items[name]
+
+    files = {}
+    for name in sorted(os.listdir(path)):
+        file_name = path + os.path.sep + name
+        if name == MANIFEST_NAME or not os.path.isfile(file_name):
+            continue
+        files[name] = {
+            'size': os.path.getsize(file_name),
+            'sha256': file_sha256(file_name),
+        }
+
+    with open(path + os.path.sep + MANIFEST_NAME, 'w') as f:
+        json.dump({'key': key, 'layers': layers, 'files': files}, f,
+                  indent=2, sort_keys=True)
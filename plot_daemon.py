@@ -0,0 +1,211 @@
+# coding: utf8
+# plot_daemon.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Long-lived plot worker keeping pcbnew and loaded boards in memory
+
+Start with "python plot_daemon.py serve", submit jobs with
+"python plot_daemon.py plot gerber,design board.kicad_pcb".
+Requests and replies are one JSON object per line on a Unix socket.
+'''
+
+import argparse
+import collections
+import json
+import os
+import socket
+import sys
+import tempfile
+
+import batch_plot
+
+
+MAX_JOBS = 100
+MAX_BOARDS = 8
+
+
+def get_default_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir())
+    return runtime_dir + os.path.sep + 'kicad_plugins-{0}.sock'.format(os.getuid())
+
+
+class BoardCache(object):
+    ''' Loaded boards keyed by path and mtime, least recently used dropped first '''
+
+    def __init__(self, max_boards=MAX_BOARDS):
+        self.max_boards = max_boards
+        self.boards = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, board_file):
+        import pcbnew
+
+        key = (board_file, os.path.getmtime(board_file))
+        if key in self.boards:
+            self.hits += 1
+            self.boards.move_to_end(key)
+            return self.boards[key]
+
+        self.misses += 1
+        for cached in list(self.boards):
+            if cached[0] == board_file:
+                del self.boards[cached]
+
+        board = pcbnew.LoadBoard(board_file)
+        self.boards[key] = board
+        while len(self.boards) > self.max_boards:
+            self.boards.popitem(last=False)
+        return board
+
+
+class PlotDaemon(object):
+    def __init__(self, socket_path, max_jobs=MAX_JOBS, max_boards=MAX_BOARDS):
+        self.socket_path = socket_path
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.cache = BoardCache(max_boards)
+        self.running = True
+
+    def serve(self):
+        # imported once here, every job reuses it
+        batch_plot._init_worker()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+
+        try:
+            while self.running and self.jobs < self.max_jobs:
+                connection, address = server.accept()
+                with connection:
+                    self.handle(connection)
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+
+        # a fresh process gives back memory the loaded boards fragmented
+        if self.running:
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def handle(self, connection):
+        stream = connection.makefile('rwb')
+        try:
+            request = json.loads(stream.readline().decode('utf-8'))
+            reply = self.execute(request)
+        except Exception as e:
+            # a bad request must not take the worker down
+            reply = {'status': 'error', 'error': '{0}: {1}'.format(type(e).__name__, e)}
+
+        try:
+            stream.write(json.dumps(reply).encode('utf-8') + b'\n')
+            stream.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client hung up before the reply
+            pass
+
+    def execute(self, request):
+        if not isinstance(request, dict):
+            raise ValueError('request is not a JSON object')
+        command = request.get('command')
+        if command == 'plot':
+            self.jobs += 1
+            return batch_plot.process_board_file(os.path.abspath(request['board']),
+                                                 request.get('outputs', sorted(batch_plot.OUTPUTS)),
+                                                 request.get('force', False),
+                                                 request.get('layer_jobs', 1),
+                                                 request.get('zip_options'),
+                                                 self.cache.load,
+                                                 request.get('empty_layers', False),
+                                                 request.get('unique_output', False))
+        if command == 'stats':
+            return {
+                'status': 'ok',
+                'pid': os.getpid(),
+                'jobs': self.jobs,
+                'max_jobs': self.max_jobs,
+                'boards': [key[0] for key in self.cache.boards],
+                'cache_hits': self.cache.hits,
+                'cache_misses': self.cache.misses,
+            }
+        if command == 'shutdown':
+            self.running = False
+            return {'status': 'ok'}
+
+        return {'status': 'error', 'error': 'unknown command: {0}'.format(command)}
+
+
+def submit(request, socket_path=None):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path or get_default_socket_path())
+    with client:
+        stream = client.makefile('rwb')
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        return json.loads(stream.readline().decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm pcbnew plot worker')
+    parser.add_argument('-s', '--socket', default=get_default_socket_path(),
+                        help='Unix socket path')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='run the worker')
+    serve_parser.add_argument('--max-jobs', type=int, default=MAX_JOBS,
+                              help='restart the worker after this many jobs')
+    serve_parser.add_argument('--max-boards', type=int, default=MAX_BOARDS,
+                              help='number of loaded boards kept in memory')
+
+    plot_parser = commands.add_parser('plot', help='submit a board')
+    plot_parser.add_argument('outputs', help='comma separated outputs: ' +
+                             ', '.join(sorted(batch_plot.OUTPUTS)))
+    plot_parser.add_argument('board', help='.kicad_pcb file')
+    plot_parser.add_argument('-f', '--force', action='store_true',
+                             help='plot even if the board and options did not change')
+    plot_parser.add_argument('-e', '--empty-layers', action='store_true',
+                             help='plot layers without items too, for fabs which want every file')
+    plot_parser.add_argument('-u', '--unique-output', action='store_true',
+                             help='write to a new directory named after the run time and process')
+
+    commands.add_parser('stats', help='show worker state')
+    commands.add_parser('shutdown', help='stop the worker')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        PlotDaemon(args.socket, args.max_jobs, args.max_boards).serve()
+        return 0
+
+    request = {'command': args.command}
+    if args.command == 'plot':
+        request['outputs'] = [output for output in args.outputs.split(',') if output]
+        request['board'] = os.path.abspath(args.board)
+        request['force'] = args.force
+        request['empty_layers'] = args.empty_layers
+        request['unique_output'] = args.unique_output
+
+    reply = submit(request, args.socket)
+    json.dump(reply, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0 if reply.get('status') == 'ok' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,15 +18,21 @@
 
 ''' KiCad PCBNew Action Plugin for plot design files '''
 
+import argparse
+import board_index
+import drill_writer
 import getpass
+import layer_plotter
 import os
+import output_staging
+import output_zip
 import pcbnew
-import shutil
-import sys
-import tempfile
-import zipfile
+import plot_cache
+import plot_progress
+import plot_timing
 
 from datetime import datetime
+from functools import partial
 from platform import platform
 from version import VERSION
 
@@ -35,6 +41,34 @@ OUTPUT_DIR = '_generated_files' + os.path.sep + OUTPUT_NAME
 
 EOL = u'\r\n'
 
+PLOT_OPTIONS = (
+    ('SetOutputDirectory', OUTPUT_DIR),
+    ('SetDXFPlotUnits', pcbnew.DXF_UNITS_MILLIMETERS),
+    ('SetDrillMarksType', pcbnew.DRILL_MARKS_NO_DRILL_SHAPE),
+    ('SetMirror', False),
+    ('SetNegative', False),
+    ('SetPlotFrameRef', False),
+    ('SetPlotInvisibleText', False),
+    #('SetPlotPadsOnSilkLayer', False),
+    ('SetPlotReference', True),
+    ('SetPlotValue', False),
+    ('SetPlotViaOnMaskLayer', False),
+    ('SetSubtractMaskFromSilk', True),
+    ('SetUseAuxOrigin', True),
+)
+
+FAB_OPTIONS = PLOT_OPTIONS + (
+    #('SetExcludeEdgeLayer', False),
+    ('SetDXFPlotPolygonMode', False),
+    ('SetTextMode', pcbnew.PLOT_TEXT_MODE_NATIVE),
+)
+
+LAYER_OPTIONS = PLOT_OPTIONS + (
+    #('SetExcludeEdgeLayer', True),
+    ('SetDXFPlotPolygonMode', True),
+    ('SetTextMode', pcbnew.PLOT_TEXT_MODE_STROKE),
+)
+
 
 class plot_design(pcbnew.ActionPlugin):
     def defaults(self):
@@ -44,7 +78,7 @@ class plot_design(pcbnew.ActionPlugin):
         self.icon_file_name = self.get_icon_file_name()
 
     def Run(self):
-        process_board(pcbnew.GetBoard())
+        plot_progress.run_with_dialog(self.name, process_board, pcbnew.GetBoard())
 
     def get_icon_file_name(self):
         dirname = os.path.dirname(os.path.abspath(__file__))
@@ -53,17 +87,63 @@ class plot_design(pcbnew.ActionPlugin):
         return dirname + os.path.sep + 'bitmaps' + os.path.sep + filename + '.png'
 
 
-def process_board(board):
-    clean_output(get_output_abs_path(board))
-    plot_layers(board)
-    plot_drill_map(board)
-    zip_output(get_output_abs_path(board), get_board_name(board) + '-' + OUTPUT_NAME)
-
-
-def clean_output(path):
-    if os.path.exists(path):
-        shutil.rmtree(path, ignore_errors=False, onerror=None)
-    os.makedirs(path)
+def process_board(board, jobs=1, use_cache=False, zip_options=None, plot_ctrl=None,
+                  empty_layers=False, progress=plot_progress.NO_PROGRESS, unique_output=False,
+                  index=None, drill_dir=None, map_format=drill_writer.DEFAULT_MAP_FORMAT):
+    ''' Returns the output directory
+
+    map_format: drill_writer.MAP_FORMATS name of the drill map, drill_dir
+    must hold a map of this format
+    '''
+    path = get_output_abs_path(board)
+    if unique_output:
+        path = output_staging.get_unique_path(path)
+        use_cache = False
+    if use_cache and is_up_to_date(board.GetFileName(), empty_layers, map_format, zip_options):
+        return path
+
+    if index is None:
+        index = board_index.BoardIndex(board)
+    layers = get_plot_layers(board)
+    if not empty_layers:
+        layers = layer_plotter.skip_empty_layers(index, layers)
+    layer_items = index.get_layer_items(layers)
+    kept = {}
+    with output_staging.swap(path, locked=not unique_output, wait=progress.wait) as staging:
+        if use_cache:
+            with plot_timing.stage('prepare_output'):
+                fingerprints = plot_cache.layer_fingerprints(board, layers)
+                kept = plot_cache.prepare_output(path, staging, fingerprints)
+                layers = [layer for layer in layers if layer[1] not in kept]
+
+        # layers, drill map, zip and manifest
+        progress.set_steps(len(layers) + 3)
+        with output_zip.ZipOutput(staging, get_board_name(index) + '-' + OUTPUT_NAME,
+                                  **(zip_options or {})) as archive:
+            jobs = layer_plotter.resolve_jobs(index, jobs, len(layers) + 1)
+            if jobs > 1:
+                calls = (partial(plot_drill_map, path=staging, drill_dir=drill_dir,
+                                 map_format=map_format),)
+                files = layer_plotter.plot_layers_parallel(index, pcbnew.PLOT_FORMAT_DXF, layers,
+                                                           jobs, calls, archive.add, staging)
+            else:
+                files = plot_layers(board, layers, archive.add, plot_ctrl, staging, progress)
+                progress.run('Drill map', plot_drill_map, board, staging, drill_dir,
+                             map_format)
+
+            with plot_timing.stage('zip_output'):
+                progress.run_in_thread('Zip archive', archive.close, get_shtamp_comment())
+
+        if use_cache:
+            files.update(kept)
+            progress.run_in_thread('Manifest', plot_cache.write_manifest, staging,
+                                   get_cache_key(board.GetFileName(), empty_layers, map_format,
+                                                 zip_options),
+                                   fingerprints, files, layer_items)
+
+        plot_timing.write(staging)
+
+    return path
 
 
 def get_output_abs_path(board):
@@ -71,104 +151,75 @@ def get_output_abs_path(board):
     return path + os.path.sep + OUTPUT_DIR
 
 
-def get_board_name(board):
-    name = board.GetTitleBlock().GetComment(0)
-    if name == '':
-        name = os.path.splitext(os.path.basename(board.GetFileName()))[0]
-    return name
-
-
-def plot_layers(board):
-    plot_ctrl = pcbnew.PLOT_CONTROLLER(board)
-
-    plot_opts = plot_ctrl.GetPlotOptions()
-    plot_opts.SetOutputDirectory(OUTPUT_DIR)
-
-    plot_opts.SetDXFPlotUnits(pcbnew.DXF_UNITS_MILLIMETERS)
-    plot_opts.SetDrillMarksType(pcbnew.DRILL_MARKS_NO_DRILL_SHAPE)
-    plot_opts.SetMirror(False)
-    plot_opts.SetNegative(False)
-    plot_opts.SetPlotFrameRef(False)
-    plot_opts.SetPlotInvisibleText(False)
-    #plot_opts.SetPlotPadsOnSilkLayer(False)
-    plot_opts.SetPlotReference(True)
-    plot_opts.SetPlotValue(False)
-    plot_opts.SetPlotViaOnMaskLayer(False)
-    plot_opts.SetSubtractMaskFromSilk(True)
-    plot_opts.SetUseAuxOrigin(True)
+def get_cache_key(board_file, empty_layers=False, map_format=drill_writer.DEFAULT_MAP_FORMAT,
+                  zip_options=None):
+    return plot_cache.make_key(board_file, (FAB_OPTIONS, LAYER_OPTIONS, empty_layers, map_format,
+                                            output_zip.get_key_options(zip_options)))
 
-    #plot_opts.SetExcludeEdgeLayer(False)
-    plot_opts.SetDXFPlotPolygonMode(False)
-    plot_opts.SetTextMode(pcbnew.PLOT_TEXT_MODE_NATIVE)
 
-    plot_ctrl.SetLayer(pcbnew.F_Fab)
-    plot_ctrl.OpenPlotfile('F_Fab', pcbnew.PLOT_FORMAT_DXF, 'F_Fab')
-    plot_ctrl.PlotLayer()
+def is_up_to_date(board_file, empty_layers=False, map_format=drill_writer.DEFAULT_MAP_FORMAT,
+                  zip_options=None):
+    path = os.path.dirname(os.path.abspath(board_file)) + os.path.sep + OUTPUT_DIR
+    return plot_cache.is_up_to_date(path, get_cache_key(board_file, empty_layers, map_format,
+                                                        zip_options))
 
-    plot_ctrl.SetLayer(pcbnew.B_Fab)
-    plot_ctrl.OpenPlotfile('B_Fab', pcbnew.PLOT_FORMAT_DXF, 'B_Fab')
-    plot_ctrl.PlotLayer()
 
-    plot_ctrl.SetLayer(pcbnew.Edge_Cuts)
-    plot_ctrl.OpenPlotfile('Edge_Cuts', pcbnew.PLOT_FORMAT_DXF, 'Edge_Cuts')
-    plot_ctrl.PlotLayer()
-
-    #plot_opts.SetExcludeEdgeLayer(True)
-    plot_opts.SetDXFPlotPolygonMode(True)
-    plot_opts.SetTextMode(pcbnew.PLOT_TEXT_MODE_STROKE)
-
-    plot_ctrl.SetLayer(pcbnew.F_SilkS)
-    plot_ctrl.OpenPlotfile('F_SilkS', pcbnew.PLOT_FORMAT_DXF, 'F_SilkS')
-    plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.B_SilkS)
-    plot_ctrl.OpenPlotfile('B_SilkS', pcbnew.PLOT_FORMAT_DXF, 'B_SilkS')
-    plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.F_Mask)
-    plot_ctrl.OpenPlotfile('F_Mask', pcbnew.PLOT_FORMAT_DXF, 'F_Mask')
-    plot_ctrl.PlotLayer()
+def get_board_name(index):
+    name = index.comments[0]
+    if name == '':
+        name = os.path.splitext(os.path.basename(index.file_name))[0]
+    return name
 
-    plot_ctrl.SetLayer(pcbnew.B_Mask)
-    plot_ctrl.OpenPlotfile('B_Mask', pcbnew.PLOT_FORMAT_DXF, 'B_Mask')
-    plot_ctrl.PlotLayer()
 
-    plot_ctrl.SetLayer(pcbnew.F_Cu)
-    plot_ctrl.OpenPlotfile('F_Cu', pcbnew.PLOT_FORMAT_DXF, 'F_Cu')
-    plot_ctrl.PlotLayer()
+def plot_layers(board, layers=None, on_plotted=None, plot_ctrl=None, output_dir=None,
+                progress=plot_progress.NO_PROGRESS):
+    if layers is None:
+        layers = get_plot_layers(board)
+
+    own_plot_ctrl = plot_ctrl is None
+    if own_plot_ctrl:
+        plot_ctrl = pcbnew.PLOT_CONTROLLER(board)
+    try:
+        return layer_plotter.plot_layer_list(plot_ctrl, pcbnew.PLOT_FORMAT_DXF, layers,
+                                             on_plotted, output_dir, progress)
+    finally:
+        if own_plot_ctrl:
+            plot_ctrl.ClosePlot()
+
+
+def get_plot_layers(board):
+    fab_layers = [
+        (pcbnew.F_Fab, 'F_Fab'),
+        (pcbnew.B_Fab, 'B_Fab'),
+        (pcbnew.Edge_Cuts, 'Edge_Cuts'),
+    ]
+
+    layers = [
+        (pcbnew.F_SilkS, 'F_SilkS'),
+        (pcbnew.B_SilkS, 'B_SilkS'),
+        (pcbnew.F_Mask, 'F_Mask'),
+        (pcbnew.B_Mask, 'B_Mask'),
+        (pcbnew.F_Cu, 'F_Cu'),
+    ]
 
     cu_layer_count = board.GetDesignSettings().GetCopperLayerCount()
     for i in range(cu_layer_count - 2):
-        plot_ctrl.SetLayer(pcbnew.In1_Cu + i)
-        plot_ctrl.OpenPlotfile('In{0}_Cu'.format(i + 1), pcbnew.PLOT_FORMAT_DXF, 'In{0}_Cu'.format(i + 1))
-        plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.B_Cu)
-    plot_ctrl.OpenPlotfile('B_Cu', pcbnew.PLOT_FORMAT_DXF, 'B_Cu')
-    plot_ctrl.PlotLayer()
-
-    plot_ctrl.ClosePlot()
-
+        layers.append((pcbnew.In1_Cu + i, 'In{0}_Cu'.format(i + 1)))
 
-def plot_drill_map(board):
-    #FIXME use mm units (Kicad BUG)
-    gen_drill_map = pcbnew.EXCELLON_WRITER(board)
-    gen_drill_map.SetMergeOption(False)
-    gen_drill_map.SetMapFileFormat(pcbnew.PLOT_FORMAT_DXF)
-    gen_drill_map.CreateDrillandMapFilesSet(get_output_abs_path(board), False, True)
+    layers.append((pcbnew.B_Cu, 'B_Cu'))
 
+    return [(layer, name, FAB_OPTIONS) for layer, name in fab_layers] + \
+           [(layer, name, LAYER_OPTIONS) for layer, name in layers]
 
-def zip_output(path, name):
-    temp_dir = tempfile.mkdtemp()
-    zip_name = temp_dir + os.path.sep + name
-    shutil.make_archive(zip_name, 'zip', path)
 
-    zf = zipfile.ZipFile(zip_name + '.zip', 'a')
-    zf.comment = bytes(get_shtamp_comment(), 'utf-8')
-    zf.close()
+def plot_drill_map(board, path=None, drill_dir=None, map_format=drill_writer.DEFAULT_MAP_FORMAT):
+    ''' drill_dir: files of drill_writer.create_files() to link instead of writing them '''
+    path = path or get_output_abs_path(board)
+    if drill_dir is not None:
+        drill_writer.link_files(drill_dir, path, drill_maps=True)
+    else:
+        drill_writer.create_files(board, path, False, True, OUTPUT_NAME, map_format)
 
-    shutil.move(zip_name + '.zip', path)
-    os.rmdir(temp_dir)
 
 def get_shtamp_comment():
     return EOL + 'Author: ' + getpass.getuser() + EOL + \
@@ -178,7 +229,28 @@ def get_shtamp_comment():
 
 
 if __name__ == '__main__':
-    board = pcbnew.LoadBoard(sys.argv[1])
-    process_board(board)
+    parser = argparse.ArgumentParser(description='Plot design files')
+    parser.add_argument('board', help='.kicad_pcb file')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes for plotting layers, '
+                             '0 picks it from the board size')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='plot even if the board and options did not change')
+    parser.add_argument('-e', '--empty-layers', action='store_true',
+                        help='plot layers without items too, for fabs which want every file')
+    parser.add_argument('-u', '--unique-output', action='store_true',
+                        help='write to a new directory named after the run time and process')
+    drill_writer.add_arguments(parser)
+    output_zip.add_arguments(parser)
+    args = parser.parse_args()
+    zip_options = output_zip.get_options(args)
+
+    if args.force or args.unique_output or \
+            not is_up_to_date(args.board, args.empty_layers, args.drill_map_format, zip_options):
+        board = pcbnew.LoadBoard(args.board)
+        print(process_board(board, args.jobs, use_cache=not args.force,
+                            zip_options=zip_options,
+                            empty_layers=args.empty_layers, unique_output=args.unique_output,
+                            map_format=args.drill_map_format))
 else:
     plot_design().register()
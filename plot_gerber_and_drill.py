@@ -18,14 +18,22 @@
 
 ''' KiCad PCBNew Action Plugin for plot gerber and drill files '''
 
+import argparse
+import board_index
+import drill_writer
+import gerber_panel
+import gerber_stats
+import gerber_raster
 import getpass
+import layer_plotter
 import os
+import output_staging
+import output_zip
 import pcbnew
+import plot_cache
+import plot_progress
+import plot_timing
 import re
-import shutil
-import sys
-import tempfile
-import zipfile
 
 from datetime import datetime
 from platform import platform
@@ -37,6 +45,30 @@ OUTPUT_DIR = '_generated_files' + os.path.sep + OUTPUT_NAME
 
 EOL = u'\r\n'
 
+REV_RE = re.compile(r'rev\.\d', re.IGNORECASE)
+NUMBER_RE = re.compile(r'\S*\.\d*\.\d*')
+
+PLOT_OPTIONS = (
+    ('SetOutputDirectory', OUTPUT_DIR),
+    #('SetExcludeEdgeLayer', True),
+    ('SetPlotFrameRef', False),
+    ('SetPlotInvisibleText', False),
+    ('SetPlotMode', pcbnew.FILLED),
+    #('SetPlotPadsOnSilkLayer', False),
+    ('SetPlotReference', True),
+    ('SetPlotValue', False),
+    ('SetPlotViaOnMaskLayer', False),
+    ('SetSkipPlotNPTH_Pads', False),
+    ('SetSubtractMaskFromSilk', True),
+    ('SetUseAuxOrigin', True),
+    ('SetCreateGerberJobFile', True),
+    ('SetGerberPrecision', 6),
+    ('SetIncludeGerberNetlistInfo', False),
+    ('SetUseGerberAttributes', False),
+    ('SetUseGerberProtelExtensions', False),
+    ('SetUseGerberX2format', False),
+)
+
 
 class plot_gerber_and_drill(pcbnew.ActionPlugin):
     def defaults(self):
@@ -46,7 +78,7 @@ class plot_gerber_and_drill(pcbnew.ActionPlugin):
         self.icon_file_name = self.get_icon_file_name()
 
     def Run(self):
-        process_board(pcbnew.GetBoard())
+        plot_progress.run_with_dialog(self.name, process_board, pcbnew.GetBoard())
 
     def get_icon_file_name(self):
         dirname = os.path.dirname(os.path.abspath(__file__))
@@ -55,17 +87,64 @@ class plot_gerber_and_drill(pcbnew.ActionPlugin):
         return dirname + os.path.sep + 'bitmaps' + os.path.sep + filename + '.png'
 
 
-def process_board(board):
-    clean_output(get_output_abs_path(board))
-    plot_layers_and_apply(board)
-    plot_drill(board)
-    zip_output(get_output_abs_path(board), get_board_name(board))
-
-
-def clean_output(path):
-    if os.path.exists(path):
-        shutil.rmtree(path, ignore_errors=False, onerror=None)
-    os.makedirs(path)
+def process_board(board, jobs=1, use_cache=False, zip_options=None, plot_ctrl=None,
+                  empty_layers=False, progress=plot_progress.NO_PROGRESS, unique_output=False,
+                  index=None, drill_dir=None, stats=False, previews=0, panel=None):
+    ''' Returns the output directory
+
+    stats: add gerber_stats.STATS_NAME to the outputs
+    previews: DPI of PNG previews and copper density grids (gerber_raster), 0 for none
+    panel: gerber_panel spec, the panel goes to gerber_panel.PANEL_DIR of the output
+    '''
+    path = get_output_abs_path(board)
+    if unique_output:
+        path = output_staging.get_unique_path(path)
+        use_cache = False
+    if use_cache and is_up_to_date(board.GetFileName(), empty_layers, stats, previews, panel,
+                                   zip_options):
+        return path
+
+    if index is None:
+        index = board_index.BoardIndex(board)
+    layers = get_plot_layers(board)
+    if not empty_layers:
+        layers = layer_plotter.skip_empty_layers(index, layers)
+    layer_items = index.get_layer_items(layers)
+    kept = {}
+    with output_staging.swap(path, locked=not unique_output, wait=progress.wait) as staging:
+        if use_cache:
+            with plot_timing.stage('prepare_output'):
+                fingerprints = plot_cache.layer_fingerprints(board, layers)
+                kept = plot_cache.prepare_output(path, staging, fingerprints)
+                layers = [layer for layer in layers if layer[1] not in kept]
+
+        # layers, drill, stats, previews, panel, zip and manifest
+        progress.set_steps(len(layers) + 3 + stats + bool(previews) + bool(panel))
+        with output_zip.ZipOutput(staging, get_board_name(index),
+                                  **(zip_options or {})) as archive:
+            files = plot_layers_and_apply(board, jobs, layers, archive.add, plot_ctrl, staging,
+                                          progress, index)
+            progress.run('Drill files', plot_drill, board, staging, drill_dir)
+            if stats:
+                progress.run_in_thread('Gerber statistics', gerber_stats.write_stats, staging)
+            if previews:
+                progress.run_in_thread('Previews', gerber_raster.write_previews, staging, None,
+                                       previews)
+            if panel:
+                progress.run_in_thread('Panel', gerber_panel.panelize, staging, panel)
+            with plot_timing.stage('zip_output'):
+                progress.run_in_thread('Zip archive', archive.close, get_shtamp_comment())
+
+        if use_cache:
+            files.update(kept)
+            key = get_cache_key(board.GetFileName(), empty_layers, stats, previews, panel,
+                                zip_options)
+            progress.run_in_thread('Manifest', plot_cache.write_manifest, staging, key,
+                                   fingerprints, files, layer_items)
+
+        plot_timing.write(staging)
+
+    return path
 
 
 def get_output_abs_path(board):
@@ -73,10 +152,23 @@ def get_output_abs_path(board):
     return path + os.path.sep + OUTPUT_DIR
 
 
-def get_board_name(board):
-    name = os.path.splitext(os.path.basename(board.GetFileName()))[0]
+def get_cache_key(board_file, empty_layers=False, stats=False, previews=0, panel=None,
+                  zip_options=None):
+    return plot_cache.make_key(board_file, (PLOT_OPTIONS, empty_layers, stats, previews, panel,
+                                            output_zip.get_key_options(zip_options)))
+
+
+def is_up_to_date(board_file, empty_layers=False, stats=False, previews=0, panel=None,
+                  zip_options=None):
+    path = os.path.dirname(os.path.abspath(board_file)) + os.path.sep + OUTPUT_DIR
+    return plot_cache.is_up_to_date(path, get_cache_key(board_file, empty_layers, stats,
+                                                        previews, panel, zip_options))
 
-    number = try_to_find_pcb_number(board)
+
+def get_board_name(index):
+    name = os.path.splitext(os.path.basename(index.file_name))[0]
+
+    number = try_to_find_pcb_number(index)
     if number != '':
         if number[0] == '_':
             name += number
@@ -86,31 +178,26 @@ def get_board_name(board):
     return name
 
 
-def try_to_find_pcb_number(board):
+def try_to_find_pcb_number(index):
     number = ''
     rev = ''
 
-    for item in board.GetDrawings():
-        if type(item) is pcbnew.PCB_TEXT:
-            text = item.GetText()
-
-            result = re.search('^rev\.\d', text, re.IGNORECASE)
-            if result:
-                rev = text
-                if number != '':
-                    break
-                continue
+    for text in index.texts:
+        if REV_RE.match(text):
+            rev = text
+            if number != '':
+                break
+            continue
 
-            result = re.search('^\S*\.\d*\.\d*', text)
-            if result:
-                number = text
-                if rev != '':
-                    break
+        if NUMBER_RE.match(text):
+            number = text
+            if rev != '':
+                break
 
     number.strip()
     rev.strip()
 
-    result = re.search('rev\.\d', number, re.IGNORECASE)
+    result = REV_RE.search(number)
     if result:
         s = number.split()
         number = s[0] + '_' + s[1]
@@ -120,97 +207,68 @@ def try_to_find_pcb_number(board):
     return number
 
 
-def plot_layers_and_apply(board):
-    plot_ctrl = pcbnew.PLOT_CONTROLLER(board)
+def plot_layers_and_apply(board, jobs=1, layers=None, on_plotted=None, plot_ctrl=None,
+                          output_dir=None, progress=plot_progress.NO_PROGRESS, index=None):
+    ''' output_dir overrides OUTPUT_DIR without saving it in the board plot options '''
+    own_plot_ctrl = plot_ctrl is None
+    if own_plot_ctrl:
+        plot_ctrl = pcbnew.PLOT_CONTROLLER(board)
 
     plot_opts = plot_ctrl.GetPlotOptions()
-    plot_opts.SetOutputDirectory(OUTPUT_DIR)
-    #plot_opts.SetExcludeEdgeLayer(True)
-    plot_opts.SetPlotFrameRef(False)
-    plot_opts.SetPlotInvisibleText(False)
-    plot_opts.SetPlotMode(pcbnew.FILLED)
-    #plot_opts.SetPlotPadsOnSilkLayer(False)
-    plot_opts.SetPlotReference(True)
-    plot_opts.SetPlotValue(False)
-    plot_opts.SetPlotViaOnMaskLayer(False)
-    plot_opts.SetSkipPlotNPTH_Pads(False)
-    plot_opts.SetSubtractMaskFromSilk(True)
-    plot_opts.SetUseAuxOrigin(True)
-    plot_opts.SetCreateGerberJobFile(True)
-    plot_opts.SetGerberPrecision(6)
-    plot_opts.SetIncludeGerberNetlistInfo(False)
-    plot_opts.SetUseGerberAttributes(False)
-    plot_opts.SetUseGerberProtelExtensions(False)
-    plot_opts.SetUseGerberX2format(False)
-
+    layer_plotter.apply_plot_options(plot_opts, PLOT_OPTIONS)
     board.SetPlotOptions(plot_opts)
 
-    plot_ctrl.SetLayer(pcbnew.Edge_Cuts)
-    plot_ctrl.OpenPlotfile('Edge_Cuts', pcbnew.PLOT_FORMAT_GERBER, 'Edge_Cuts')
-    plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.F_SilkS)
-    plot_ctrl.OpenPlotfile('F_SilkS', pcbnew.PLOT_FORMAT_GERBER, 'F_SilkS')
-    plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.B_SilkS)
-    plot_ctrl.OpenPlotfile('B_SilkS', pcbnew.PLOT_FORMAT_GERBER, 'B_SilkS')
-    plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.F_Mask)
-    plot_ctrl.OpenPlotfile('F_Mask', pcbnew.PLOT_FORMAT_GERBER, 'F_Mask')
-    plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.B_Mask)
-    plot_ctrl.OpenPlotfile('B_Mask', pcbnew.PLOT_FORMAT_GERBER, 'B_Mask')
-    plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.F_Cu)
-    plot_ctrl.OpenPlotfile('F_Cu', pcbnew.PLOT_FORMAT_GERBER, 'F_Cu')
-    plot_ctrl.PlotLayer()
+    if layers is None:
+        layers = get_plot_layers(board)
+    if index is None:
+        index = board_index.BoardIndex(board)
+    jobs = layer_plotter.resolve_jobs(index, jobs, len(layers))
+    if jobs > 1:
+        plot_ctrl.ClosePlot()
+        return layer_plotter.plot_layers_parallel(index, pcbnew.PLOT_FORMAT_GERBER, layers, jobs,
+                                                  on_plotted=on_plotted, output_dir=output_dir)
+
+    try:
+        return layer_plotter.plot_layer_list(plot_ctrl, pcbnew.PLOT_FORMAT_GERBER, layers,
+                                             on_plotted, output_dir, progress)
+    finally:
+        if own_plot_ctrl:
+            plot_ctrl.ClosePlot()
+
+
+def get_plot_layers(board):
+    layers = [
+        (pcbnew.Edge_Cuts, 'Edge_Cuts'),
+        (pcbnew.F_SilkS, 'F_SilkS'),
+        (pcbnew.B_SilkS, 'B_SilkS'),
+        (pcbnew.F_Mask, 'F_Mask'),
+        (pcbnew.B_Mask, 'B_Mask'),
+        (pcbnew.F_Cu, 'F_Cu'),
+    ]
 
     cu_layer_count = board.GetDesignSettings().GetCopperLayerCount()
     for i in range(cu_layer_count - 2):
-        plot_ctrl.SetLayer(pcbnew.In1_Cu + i)
-        plot_ctrl.OpenPlotfile('In{0}_Cu'.format(i + 1), pcbnew.PLOT_FORMAT_GERBER, 'In{0}_Cu'.format(i + 1))
-        plot_ctrl.PlotLayer()
-
-    plot_ctrl.SetLayer(pcbnew.B_Cu)
-    plot_ctrl.OpenPlotfile('B_Cu', pcbnew.PLOT_FORMAT_GERBER, 'B_Cu')
-    plot_ctrl.PlotLayer()
+        layers.append((pcbnew.In1_Cu + i, 'In{0}_Cu'.format(i + 1)))
 
-    plot_ctrl.SetLayer(pcbnew.F_Paste)
-    plot_ctrl.OpenPlotfile('F_Paste', pcbnew.PLOT_FORMAT_GERBER, 'F_Paste')
-    plot_ctrl.PlotLayer()
+    layers += [
+        (pcbnew.B_Cu, 'B_Cu'),
+        (pcbnew.F_Paste, 'F_Paste'),
+        (pcbnew.B_Paste, 'B_Paste'),
+    ]
 
-    plot_ctrl.SetLayer(pcbnew.B_Paste)
-    plot_ctrl.OpenPlotfile('B_Paste', pcbnew.PLOT_FORMAT_GERBER, 'B_Paste')
-    plot_ctrl.PlotLayer()
+    return [(layer, name, PLOT_OPTIONS) for layer, name in layers]
 
-    plot_ctrl.ClosePlot()
 
-
-def plot_drill(board):
-    gen_drill = pcbnew.EXCELLON_WRITER(board)
-    gen_drill.SetFormat(True, pcbnew.GENDRILL_WRITER_BASE.KEEP_ZEROS)
-    gen_drill.SetOptions(False, False, board.GetDesignSettings().GetAuxOrigin(), False)
-    gen_drill.SetRouteModeForOvalHoles(True)
-    gen_drill.CreateDrillandMapFilesSet(get_output_abs_path(board), True, False)
+def plot_drill(board, path=None, drill_dir=None):
+    ''' drill_dir: files of drill_writer.create_files() to link instead of writing them '''
+    path = path or get_output_abs_path(board)
+    if drill_dir is not None:
+        drill_writer.link_files(drill_dir, path)
+    else:
+        drill_writer.create_files(board, path, True, False, OUTPUT_NAME)
     #TODO apply drill options to project
 
 
-def zip_output(path, name):
-    temp_dir = tempfile.mkdtemp()
-    zip_name = temp_dir + os.path.sep + name
-    shutil.make_archive(zip_name, 'zip', path)
-
-    zf = zipfile.ZipFile(zip_name + '.zip', 'a')
-    zf.comment = bytes(get_shtamp_comment(), 'utf-8')
-    zf.close()
-
-    shutil.move(zip_name + '.zip', path)
-    os.rmdir(temp_dir)
-
 def get_shtamp_comment():
     return EOL + 'Author: ' + getpass.getuser() + EOL + \
            'Timeshtamp: ' + datetime.now().isoformat(timespec='seconds') + EOL + \
@@ -219,7 +277,33 @@ def get_shtamp_comment():
 
 
 if __name__ == '__main__':
-    board = pcbnew.LoadBoard(sys.argv[1])
-    process_board(board)
+    parser = argparse.ArgumentParser(description='Plot gerber and drill files')
+    parser.add_argument('board', help='.kicad_pcb file')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes for plotting layers, '
+                             '0 picks it from the board size')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='plot even if the board and options did not change')
+    parser.add_argument('-e', '--empty-layers', action='store_true',
+                        help='plot layers without items too, for fabs which want every file')
+    parser.add_argument('-u', '--unique-output', action='store_true',
+                        help='write to a new directory named after the run time and process')
+    parser.add_argument('-s', '--stats', action='store_true',
+                        help='add per layer statistics of the gerber files for fab quoting')
+    gerber_raster.add_arguments(parser)
+    gerber_panel.add_arguments(parser)
+    output_zip.add_arguments(parser)
+    args = parser.parse_args()
+    panel = gerber_panel.load_spec(args.panel) if args.panel else None
+    zip_options = output_zip.get_options(args)
+
+    if args.force or args.unique_output or \
+            not is_up_to_date(args.board, args.empty_layers, args.stats, args.previews, panel,
+                              zip_options):
+        board = pcbnew.LoadBoard(args.board)
+        print(process_board(board, args.jobs, use_cache=not args.force,
+                            zip_options=zip_options,
+                            empty_layers=args.empty_layers, unique_output=args.unique_output,
+                            stats=args.stats, previews=args.previews, panel=panel))
 else:
     plot_gerber_and_drill().register()
@@ -0,0 +1,131 @@
+# coding: utf8
+# plot_progress.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Progress reporting and cancellation of plugin runs
+
+pcbnew is not thread safe, so layers and drill files are plotted on the
+GUI thread with the progress dialog updated between them. The steps which
+do not call pcbnew (statistics, previews, panel, zip, hashes) run in a
+thread while the dialog keeps the GUI alive.
+'''
+
+import threading
+
+
+# Seconds between progress dialog refreshes while a step runs in a thread
+PULSE_INTERVAL = 0.1
+
+
+class Cancelled(Exception):
+    ''' The user cancelled the run, the previous outputs are kept '''
+
+
+class Progress(object):
+    ''' Command line runs: nothing reported, never cancelled '''
+
+    def set_steps(self, steps):
+        pass
+
+    def update(self, message):
+        ''' Next step, raises Cancelled if the user asked to stop '''
+        pass
+
+    def run(self, message, function, *args):
+        ''' Next step calling pcbnew, runs on this thread '''
+        self.update(message)
+        return function(*args)
+
+    def run_in_thread(self, message, function, *args):
+        ''' Next step which does not call pcbnew '''
+        return self.run(message, function, *args)
+
+    def wait(self, message):
+        ''' Called while waiting for another run, raises Cancelled to give up '''
+        pass
+
+    def close(self):
+        pass
+
+
+NO_PROGRESS = Progress()
+
+
+class DialogProgress(Progress):
+    ''' wx progress dialog with a cancel button '''
+
+    def __init__(self, title):
+        import wx
+
+        self.step = 0
+        self.dialog = wx.ProgressDialog(title, ' ' * 60, parent=None,
+                                        style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT |
+                                        wx.PD_ELAPSED_TIME)
+
+    def set_steps(self, steps):
+        self.dialog.SetRange(max(1, steps))
+
+    def update(self, message):
+        self.step = min(self.step + 1, self.dialog.GetRange() - 1)
+        keep_going, skip = self.dialog.Update(self.step, message)
+        if not keep_going:
+            raise Cancelled()
+
+    def run_in_thread(self, message, function, *args):
+        self.update(message)
+
+        result = {}
+
+        def target():
+            try:
+                result['value'] = function(*args)
+            except BaseException as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        cancelled = False
+        while thread.is_alive():
+            keep_going, skip = self.dialog.Pulse(message)
+            # the step can not be interrupted, it is dropped when it ends
+            cancelled = cancelled or not keep_going
+            thread.join(PULSE_INTERVAL)
+
+        if 'error' in result:
+            raise result['error']
+        if cancelled:
+            raise Cancelled()
+        return result.get('value')
+
+    def wait(self, message):
+        keep_going, skip = self.dialog.Pulse(message)
+        if not keep_going:
+            raise Cancelled()
+
+    def close(self):
+        self.dialog.Destroy()
+
+
+def run_with_dialog(title, process_board, board):
+    ''' Run() of the action plugins '''
+    progress = DialogProgress(title)
+    try:
+        process_board(board, progress=progress)
+    except Cancelled:
+        pass
+    finally:
+        progress.close()
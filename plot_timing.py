@@ -0,0 +1,148 @@
+# coding: utf8
+# plot_timing.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Opt-in instrumentation of plugin runs
+
+KICAD_PLUGINS_TIMINGS=1 writes per stage timings to timings.json,
+KICAD_PLUGINS_TRACE=1 writes a Chrome/Perfetto trace-event file trace.json.
+'''
+
+import json
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+ENV_VAR = 'KICAD_PLUGINS_TIMINGS'
+TRACE_ENV_VAR = 'KICAD_PLUGINS_TRACE'
+TIMINGS_NAME = 'timings.json'
+TRACE_NAME = 'trace.json'
+
+records = []
+events = []
+
+
+def is_enabled():
+    return os.environ.get(ENV_VAR, '') not in ('', '0')
+
+
+def is_tracing():
+    return os.environ.get(TRACE_ENV_VAR, '') not in ('', '0')
+
+
+def get_peak_rss():
+    ''' Peak resident set size of the process in bytes, None if unknown '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextmanager
+def stage(name, **tags):
+    ''' Timed stage, also a trace span '''
+    timing = is_enabled()
+    tracing = is_tracing()
+    if not timing and not tracing:
+        yield
+        return
+
+    # wall clock for traces: workers are separate processes
+    start = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        if timing:
+            record = {
+                'stage': name,
+                'wall': round(time.perf_counter() - wall, 6),
+                'cpu': round(time.process_time() - cpu, 6),
+                'peak_rss': get_peak_rss(),
+                'pid': os.getpid(),
+            }
+            record.update(tags)
+            records.append(record)
+        if tracing:
+            add_event(name, start, time.time(), tags)
+
+
+@contextmanager
+def span(name, **tags):
+    ''' Trace span only, for steps too fine grained for timings.json '''
+    if not is_tracing():
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_event(name, start, time.time(), tags)
+
+
+def add_event(name, start, end, tags):
+    events.append({
+        'name': name,
+        'ph': 'X',
+        'ts': int(start * 1e6),
+        'dur': int((end - start) * 1e6),
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': tags,
+    })
+
+
+def take_records():
+    taken = (records[:], events[:])
+    del records[:]
+    del events[:]
+    return taken
+
+
+def extend(worker_records):
+    ''' Add records returned by a worker process '''
+    records.extend(worker_records[0])
+    events.extend(worker_records[1])
+
+
+def write_trace(file_name):
+    with open(file_name, 'w') as f:
+        json.dump({'traceEvents': events[:], 'displayTimeUnit': 'ms'}, f)
+    del events[:]
+
+
+def write(path):
+    if is_enabled():
+        with open(path + os.path.sep + TIMINGS_NAME, 'w') as f:
+            json.dump({'stages': records[:]}, f, indent=2)
+        del records[:]
+
+    if is_tracing():
+        write_trace(path + os.path.sep + TRACE_NAME)
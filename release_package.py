@@ -0,0 +1,126 @@
+# coding: utf8
+# release_package.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Gerber, drill and design files of a board in one run
+
+The board is loaded and indexed once and one PLOT_CONTROLLER session plots
+the gerber layers and then the DXF layers, each layer carries its full plot
+options. One drill pass writes the Excellon files and the drill map.
+Both zips are written in the same run. With --store the outputs are added
+to a release store (see release_store.py).
+'''
+
+import argparse
+import board_index
+import drill_writer
+import gerber_panel
+import gerber_raster
+import os
+import output_zip
+import pcbnew
+import plot_design
+import plot_gerber_and_drill
+import release_store
+import shutil
+import tempfile
+
+
+def process_board(board, use_cache=False, zip_options=None, empty_layers=False,
+                  unique_output=False, stats=False, previews=0, panel=None,
+                  map_format=drill_writer.DEFAULT_MAP_FORMAT):
+    ''' Returns the gerber and design output directories '''
+    plot_ctrl = pcbnew.PLOT_CONTROLLER(board)
+    index = board_index.BoardIndex(board)
+
+    # next to the outputs, so the files can be hard linked into them
+    generated_dir = os.path.dirname(plot_gerber_and_drill.get_output_abs_path(board))
+    os.makedirs(generated_dir, exist_ok=True)
+    drill_dir = tempfile.mkdtemp(prefix='.drill-', dir=generated_dir)
+    try:
+        drill_writer.create_files(board, drill_dir, output='release', map_format=map_format)
+        paths = (
+            plot_gerber_and_drill.process_board(board, use_cache=use_cache,
+                                                zip_options=zip_options, plot_ctrl=plot_ctrl,
+                                                empty_layers=empty_layers,
+                                                unique_output=unique_output, index=index,
+                                                drill_dir=drill_dir, stats=stats,
+                                                previews=previews, panel=panel),
+            plot_design.process_board(board, use_cache=use_cache, zip_options=zip_options,
+                                      plot_ctrl=plot_ctrl, empty_layers=empty_layers,
+                                      unique_output=unique_output, index=index,
+                                      drill_dir=drill_dir, map_format=map_format),
+        )
+    finally:
+        shutil.rmtree(drill_dir, ignore_errors=True)
+
+    plot_ctrl.ClosePlot()
+    return paths
+
+
+def get_output_paths(board_file):
+    path = os.path.dirname(os.path.abspath(board_file))
+    return (path + os.path.sep + plot_gerber_and_drill.OUTPUT_DIR,
+            path + os.path.sep + plot_design.OUTPUT_DIR)
+
+
+def is_up_to_date(board_file, empty_layers=False, stats=False, previews=0, panel=None,
+                  map_format=drill_writer.DEFAULT_MAP_FORMAT, zip_options=None):
+    return plot_gerber_and_drill.is_up_to_date(board_file, empty_layers, stats, previews,
+                                               panel, zip_options) and \
+           plot_design.is_up_to_date(board_file, empty_layers, map_format, zip_options)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot gerber, drill and design files')
+    parser.add_argument('board', help='.kicad_pcb file')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='plot even if the board and options did not change')
+    parser.add_argument('-e', '--empty-layers', action='store_true',
+                        help='plot layers without items too, for fabs which want every file')
+    parser.add_argument('-u', '--unique-output', action='store_true',
+                        help='write to a new directory named after the run time and process')
+    parser.add_argument('-s', '--stats', action='store_true',
+                        help='add per layer statistics of the gerber files for fab quoting')
+    gerber_raster.add_arguments(parser)
+    gerber_panel.add_arguments(parser)
+    drill_writer.add_arguments(parser)
+    output_zip.add_arguments(parser)
+    release_store.add_arguments(parser)
+    args = parser.parse_args()
+    panel = gerber_panel.load_spec(args.panel) if args.panel else None
+    zip_options = output_zip.get_options(args)
+
+    paths = get_output_paths(args.board)
+    if args.force or args.unique_output or \
+            not is_up_to_date(args.board, args.empty_layers, args.stats, args.previews, panel,
+                              args.drill_map_format, zip_options):
+        board = pcbnew.LoadBoard(args.board)
+        paths = process_board(board, use_cache=not args.force,
+                              zip_options=zip_options,
+                              empty_layers=args.empty_layers,
+                              unique_output=args.unique_output, stats=args.stats,
+                              previews=args.previews, panel=panel,
+                              map_format=args.drill_map_format)
+    for path in paths:
+        print(path)
+
+    if args.store:
+        board_name = os.path.splitext(os.path.basename(args.board))[0]
+        outputs = dict(zip((plot_gerber_and_drill.OUTPUT_NAME, plot_design.OUTPUT_NAME), paths))
+        release_store.add_release(args.store, board_name,
+                                  args.release or release_store.get_default_release(), outputs)
@@ -0,0 +1,228 @@
+# coding: utf8
+# release_store.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Content-addressed store of released files
+
+  <store>/objects/<sha256[:2]>/<sha256[2:]>   one blob per distinct file
+  <store>/releases/<board>/<release>.json      file name -> sha256
+
+Stored output files are hard links of their blobs, so a layer which did
+not change between revisions takes the disk space once. Blobs are made
+read-only: an edit in place of a released file would change every release
+which has it. Comparing two releases is comparing their hashes:
+
+  python release_store.py <store> diff <board> rev.3 rev.4
+'''
+
+import argparse
+import json
+import os
+import output_zip
+import plot_cache
+import plot_timing
+import shutil
+import sys
+import time
+
+from version import VERSION
+
+
+OBJECTS_DIR = 'objects'
+RELEASES_DIR = 'releases'
+RELEASE_EXT = '.json'
+
+# run data, not release content
+SKIP_FILES = (plot_cache.MANIFEST_NAME, plot_timing.TIMINGS_NAME, plot_timing.TRACE_NAME)
+
+BLOB_MODE = 0o444
+
+
+def get_blob_path(store, sha):
+    return store + os.path.sep + OBJECTS_DIR + os.path.sep + sha[:2] + os.path.sep + sha[2:]
+
+
+def get_release_path(store, board, release):
+    return store + os.path.sep + RELEASES_DIR + os.path.sep + board + os.path.sep + \
+           release + RELEASE_EXT
+
+
+def replace_with_link(source, file_name):
+    ''' Readers of file_name see the old or the new link, the content is the same '''
+    temp_name = file_name + '.link'
+    os.link(source, temp_name)
+    try:
+        os.replace(temp_name, file_name)
+    except OSError:
+        os.remove(temp_name)
+        raise
+
+
+def is_blob(store, file_name, sha):
+    ''' file_name is a link of the blob of sha, so its content is that of the blob '''
+    blob = get_blob_path(store, sha)
+    return os.path.exists(blob) and os.path.samefile(blob, file_name)
+
+
+def add_file(store, file_name, sha):
+    blob = get_blob_path(store, sha)
+    if os.path.exists(blob):
+        if not os.path.samefile(blob, file_name):
+            try:
+                replace_with_link(blob, file_name)
+            except OSError:
+                # store on another file system, the output keeps its copy
+                pass
+        return
+
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        os.link(file_name, blob)
+    except OSError:
+        # store on another file system, the output keeps its copy and its mode
+        shutil.copy2(file_name, blob + '.tmp')
+        os.chmod(blob + '.tmp', BLOB_MODE)
+        os.replace(blob + '.tmp', blob)
+    else:
+        # the output file is the blob from now on
+        os.chmod(blob, BLOB_MODE)
+
+
+def get_file_hashes(store, path):
+    ''' {file name: sha256} of an output directory, <dir>/<file> in subdirectories
+
+    The hash in the manifest is taken only for files which are already
+    links of that blob, e.g. layers kept from the previous run, the other
+    files are hashed.
+    '''
+    manifest = plot_cache.load_manifest(path) or {}
+    known = manifest.get('files', {})
+
+    hashes = {}
+    # subdirectories too, e.g. the panel
+    for name in output_zip.get_member_names(path):
+        file_name = path + os.path.sep + name
+        if name in SKIP_FILES:
+            continue
+        if name in known and is_blob(store, file_name, known[name]['sha256']):
+            hashes[name] = known[name]['sha256']
+        else:
+            hashes[name] = plot_cache.file_sha256(file_name)
+    return hashes
+
+
+def add_release(store, board, release, outputs):
+    ''' outputs: {output name: directory}, returns {output/file name: sha256} '''
+    files = {}
+    with plot_timing.span('add_release'):
+        for output, path in sorted(outputs.items()):
+            for name, sha in get_file_hashes(store, path).items():
+                add_file(store, path + os.path.sep + name, sha)
+                files[output + '/' + name] = sha
+
+    release_file = get_release_path(store, board, release)
+    os.makedirs(os.path.dirname(release_file), exist_ok=True)
+    with open(release_file + '.tmp', 'w') as f:
+        json.dump({
+            'board': board,
+            'release': release,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'version': VERSION,
+            'files': files,
+        }, f, indent=2, sort_keys=True)
+    os.replace(release_file + '.tmp', release_file)
+
+    return files
+
+
+def load_release(store, board, release):
+    with open(get_release_path(store, board, release), 'r') as f:
+        return json.load(f)
+
+
+def list_releases(store, board):
+    path = store + os.path.sep + RELEASES_DIR + os.path.sep + board
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(path)
+                  if name.endswith(RELEASE_EXT))
+
+
+def diff_releases(store, board, old, new):
+    old_files = load_release(store, board, old)['files']
+    new_files = load_release(store, board, new)['files']
+
+    return {
+        'added': sorted(set(new_files) - set(old_files)),
+        'removed': sorted(set(old_files) - set(new_files)),
+        'changed': sorted(name for name in set(old_files) & set(new_files)
+                          if old_files[name] != new_files[name]),
+        'unchanged': sorted(name for name in set(old_files) & set(new_files)
+                            if old_files[name] == new_files[name]),
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument('--store', help='add the outputs to this release store')
+    parser.add_argument('--release', help='release name in the store, the run time by default')
+
+
+def get_default_release():
+    return time.strftime('%Y%m%d-%H%M%S')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Content-addressed store of released files')
+    parser.add_argument('store', help='store directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = commands.add_parser('add', help='store output directories as a release')
+    add_parser.add_argument('board', help='board name')
+    add_parser.add_argument('release', help='release name')
+    add_parser.add_argument('outputs', nargs='+', help='output directories')
+
+    list_parser = commands.add_parser('list', help='list releases of a board')
+    list_parser.add_argument('board', help='board name')
+
+    show_parser = commands.add_parser('show', help='show files of a release')
+    show_parser.add_argument('board', help='board name')
+    show_parser.add_argument('release', help='release name')
+
+    diff_parser = commands.add_parser('diff', help='compare two releases')
+    diff_parser.add_argument('board', help='board name')
+    diff_parser.add_argument('old', help='older release')
+    diff_parser.add_argument('new', help='newer release')
+
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        outputs = dict((os.path.basename(os.path.normpath(path)), path) for path in args.outputs)
+        result = add_release(args.store, args.board, args.release, outputs)
+    elif args.command == 'list':
+        result = list_releases(args.store, args.board)
+    elif args.command == 'show':
+        result = load_release(args.store, args.board, args.release)
+    else:
+        result = diff_releases(args.store, args.board, args.old, args.new)
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
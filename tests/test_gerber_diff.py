@@ -0,0 +1,97 @@
+# coding: utf8
+# test_gerber_diff.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import zipfile
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import gerber_diff
+
+
+LAYER = '''G04 #@! TF.CreationDate,{date}*
+%FSLAX46Y46*%
+%MOMM*%
+%ADD10C,1.000000*%
+D10*
+X{x}Y0D03*
+X20000000Y20000000D03*
+M02*
+'''
+
+
+def write_output(path, layers, zipped=False):
+    os.makedirs(str(path))
+    for name, text in layers.items():
+        (path / name).write_text(text)
+    if not zipped:
+        return str(path)
+    zip_name = str(path) + '.zip'
+    with zipfile.ZipFile(zip_name, 'w') as f:
+        for name in layers:
+            f.write(str(path / name), name)
+    return zip_name
+
+
+def test_only_dates_changed(tmp_path):
+    old = write_output(tmp_path / 'old', {
+        'a-F_Cu.gbr': LAYER.format(date='2023-05-01', x=0)})
+    new = write_output(tmp_path / 'new', {
+        'b-F_Cu.gbr': LAYER.format(date='2024-01-01', x=0)}, zipped=True)
+    report = gerber_diff.diff_outputs(old, new, dpi=100)
+    assert report['unchanged'] == ['F_Cu.gbr']
+    assert report['changed'] == {}
+
+
+def test_moved_pad(tmp_path):
+    old = write_output(tmp_path / 'old', {
+        'a-F_Cu.gbr': LAYER.format(date='2023-05-01', x=0),
+        'a-B_Cu.gbr': LAYER.format(date='2023-05-01', x=0)})
+    new = write_output(tmp_path / 'new', {
+        'a-F_Cu.gbr': LAYER.format(date='2023-05-01', x=5000000),
+        'a-In1_Cu.gbr': LAYER.format(date='2023-05-01', x=0)})
+    images = str(tmp_path / 'images')
+    os.makedirs(images)
+    report = gerber_diff.diff_outputs(old, new, images, dpi=200)
+
+    assert report['added'] == ['In1_Cu.gbr']
+    assert report['removed'] == ['B_Cu.gbr']
+    changed = report['changed']['F_Cu.gbr']
+    area = 3.14159 * 0.25
+    assert changed['added_area'] == pytest.approx(area, rel=0.1)
+    assert changed['removed_area'] == pytest.approx(area, rel=0.1)
+    # the old and the new pad, 5 mm apart
+    assert len(changed['regions']) == 2
+    for x0, y0, x1, y1 in changed['regions']:
+        assert x1 - x0 == pytest.approx(1.0, abs=0.3)
+        assert y1 - y0 == pytest.approx(1.0, abs=0.3)
+    assert os.path.isfile(changed['image'])
+
+
+def test_panel_of_zip_is_left_out(tmp_path):
+    layers = {'a-F_Cu.gbr': LAYER.format(date='2023-05-01', x=0)}
+    old = write_output(tmp_path / 'old', layers)
+    new = write_output(tmp_path / 'new', layers, zipped=True)
+    with zipfile.ZipFile(new, 'a') as f:
+        # sorts after the board layer and has the same layer key
+        f.writestr('panel/a-F_Cu.gbr', LAYER.format(date='2023-05-01', x=5000000))
+    report = gerber_diff.diff_outputs(old, new, dpi=100)
+    assert report['unchanged'] == ['F_Cu.gbr']
+    assert report['changed'] == {}
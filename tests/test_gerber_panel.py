@@ -0,0 +1,211 @@
+# coding: utf8
+# test_gerber_panel.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import gerber_panel
+
+from gerber_parser import GerberParser
+
+
+EDGE_CUTS = '''G04 #@! TF.GenerationSoftware,KiCad,Pcbnew,7.0.0*
+%FSLAX46Y46*%
+%MOMM*%
+%TF.FileFunction,Profile,NP*%
+%ADD10C,0.100000*%
+D10*
+X0Y0D02*
+X10000000Y0D01*
+X10000000Y5000000D01*
+X0Y5000000D01*
+X0Y0D01*
+M02*
+'''
+
+F_CU = '''%FSLAX46Y46*%
+%MOMM*%
+G04 #@! TA.AperFunction,SMDPad*
+%ADD10R,1.000000X1.000000*%
+%ADD11C,0.250000*%
+G04 #@! TD*
+D10*
+%TO.C,R1*%
+X2000000Y3000000D03*
+%TD*%
+G04 next net*
+D11*
+X-500000Y1000000D02*
+X4000000Y1000000D01*
+M02*
+'''
+
+DRILL = '''M48
+; DRILL file {KiCad 7.0.5} date 2023-05-01T12:00:00+0300
+; FORMAT={3:3/ absolute / metric / keep zeros}
+METRIC,TZ
+T1C0.400
+%
+G90
+G05
+T1
+X002000Y-001500
+M30
+'''
+
+# Edge_Cuts extents with the 0.1 mm stroke, panel pitch is width + spacing
+WIDTH = 10.1
+HEIGHT = 5.1
+
+
+class Recorder(GerberParser):
+    def __init__(self):
+        super(Recorder, self).__init__()
+        self.flashes = []
+        self.draws = []
+
+    def on_flash(self, x, y, aperture):
+        self.flashes.append((round(x, 6), round(y, 6), aperture.code))
+
+    def on_draw(self, x0, y0, x1, y1, aperture):
+        self.draws.append((round(x0, 6), round(y0, 6), round(x1, 6), round(y1, 6),
+                           aperture.code))
+
+
+@pytest.fixture
+def output(tmp_path):
+    for name, text in (('board-Edge_Cuts.gbr', EDGE_CUTS), ('board-F_Cu.gbr', F_CU),
+                       ('board-PTH.drl', DRILL)):
+        (tmp_path / name).write_text(text)
+    return str(tmp_path)
+
+
+def read_layer(path, name):
+    return Recorder().parse_file(os.path.join(path, gerber_panel.PANEL_DIR, name))
+
+
+def read_drills(path):
+    with open(os.path.join(path, gerber_panel.PANEL_DIR, 'board-PTH.drl')) as f:
+        lines = f.read().splitlines()
+    holes = []
+    for line in lines:
+        if line.startswith('X'):
+            x, y = line[1:].split('Y')
+            holes.append((int(x) / 1000.0, int(y) / 1000.0))
+    return lines, holes
+
+
+def test_offsets(output):
+    summary = gerber_panel.panelize(output, {'columns': 3, 'rows': 2, 'spacing': 2.0})
+    pitch_x = WIDTH + 2.0
+    pitch_y = HEIGHT + 2.0
+    offsets = [(column * pitch_x, row * pitch_y) for row in range(2) for column in range(3)]
+
+    copper = read_layer(output, 'board-F_Cu.gbr')
+    assert sorted(copper.flashes) == sorted((round(2.0 + dx, 6), round(3.0 + dy, 6), 10)
+                                            for dx, dy in offsets)
+    assert sorted(copper.draws) == sorted(
+        (round(-0.5 + dx, 6), round(1.0 + dy, 6), round(4.0 + dx, 6), round(1.0 + dy, 6), 11)
+        for dx, dy in offsets)
+
+    lines, holes = read_drills(output)
+    assert sorted(holes) == sorted((round(2.0 + dx, 3), round(-1.5 + dy, 3))
+                                   for dx, dy in offsets)
+    assert lines.count('T1') == 1
+    assert lines[-1] == 'M30'
+
+    assert summary['width'] == pytest.approx(3 * WIDTH + 2 * 2.0)
+    assert summary['height'] == pytest.approx(2 * HEIGHT + 2.0)
+    assert summary['fiducials'] == []
+
+
+def test_attributes_dropped(output):
+    gerber_panel.panelize(output, {'columns': 2})
+    with open(os.path.join(output, gerber_panel.PANEL_DIR, 'board-F_Cu.gbr')) as f:
+        text = f.read()
+    # object attributes and comments of the body, kept in the header
+    assert 'TO.C' not in text
+    assert '%TD' not in text
+    assert 'next net' not in text
+    assert text.count('TA.AperFunction') == 1
+    assert text.count('M02*') == 1
+
+
+def test_rails_outline_and_fiducials(output):
+    spec = {'columns': 2, 'spacing': 2.0, 'rails': {'sides': ['top', 'bottom'], 'width': 5.0},
+            'fiducials': {}}
+    summary = gerber_panel.panelize(output, spec)
+
+    assert summary['height'] == pytest.approx(HEIGHT + 2 * (2.0 + 5.0))
+    assert len(summary['fiducials']) == 3
+    # default fiducials on the front copper and mask only
+    copper = read_layer(output, 'board-F_Cu.gbr')
+    assert len(copper.flashes) == 2 + 3
+    mask = os.path.join(output, gerber_panel.PANEL_DIR, 'board-F_Mask.gbr')
+    assert not os.path.exists(mask)
+
+    outline = read_layer(output, 'board-Edge_Cuts.gbr')
+    assert len(outline.draws) == 2 * 4 + 4
+
+
+def test_no_fiducials_without_key(output):
+    spec = {'columns': 2, 'rails': {'sides': ['left']}}
+    assert gerber_panel.panelize(output, spec)['fiducials'] == []
+
+
+def test_default_fiducials_need_rails(output):
+    with pytest.raises(gerber_panel.PanelError):
+        gerber_panel.panelize(output, {'columns': 2, 'rows': 2, 'fiducials': {}})
+
+    spec = {'columns': 2, 'fiducials': {'positions': [[-3.0, -3.0], [30.0, 8.0]]}}
+    assert gerber_panel.panelize(output, spec)['fiducials'] == [[-3.0, -3.0], [30.0, 8.0]]
+
+
+def test_integer_template_matches_string_rendering():
+    rng = random.Random(1)
+    values = [rng.randint(-10 ** 9, 10 ** 9) for i in range(500)] + [0, -1, 1]
+    text = ''.join('G01X{0}Y{1}D01*\n'.format(x, y) for x, y in zip(values, values[::-1]))
+    for template in (gerber_panel.IntegerTemplate(text),
+                     gerber_panel.IntegerTemplate('G04 ' + 'x' * 100 + '*\n' + text)):
+        for dx, dy in ((0, 0), (7, -10 ** 9), (3 * 10 ** 9, 0)):
+            assert template.render_bytes(dx, dy).decode('ascii') == \
+                template.render(dx, dy, gerber_panel.format_integers)
+
+
+@pytest.mark.parametrize('zeros, text, value', (
+    ('keep zeros', '012500', 12.5),
+    ('decimal', '12.5', 12.5),
+    ('suppress leading zeros', '12500', 12.5),
+    ('suppress trailing zeros', '0125', 12.5),
+    ('suppress leading zeros', '-500', -0.5),
+))
+def test_excellon_format(zeros, text, value):
+    number_format = gerber_panel.ExcellonFormat(True, 3, 3, zeros)
+    assert number_format.parse(text) == pytest.approx(value)
+    assert number_format.parse(number_format.format(value)) == pytest.approx(value)
+
+
+def test_step_and_repeat_is_refused(output):
+    with open(os.path.join(output, 'board-F_Cu.gbr'), 'a') as f:
+        f.write('%SRX2Y2I10J10*%\n')
+    with pytest.raises(gerber_panel.PanelError):
+        gerber_panel.panelize(output, {'columns': 2})
@@ -0,0 +1,164 @@
+# coding: utf8
+# test_gerber_parser.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import math
+
+import pytest
+
+import gerber_parser
+
+from gerber_parser import GerberError, GerberParser
+
+
+ROUND_RECT = '''%FSLAX46Y46*%
+%MOMM*%
+%AMRoundRect*
+0 Rectangle with rounded corners*
+4,1,4,$2,$3,$4,$5,$6,$7,$8,$9,$2,$3,0*
+1,1,$1+$1,$2,$3*
+1,1,$1+$1,$4,$5*
+1,1,$1+$1,$6,$7*
+1,1,$1+$1,$8,$9*
+20,1,$1+$1,$2,$3,$4,$5,0*
+20,1,$1+$1,$4,$5,$6,$7,0*
+20,1,$1+$1,$6,$7,$8,$9,0*
+20,1,$1+$1,$8,$9,$2,$3,0*%
+%ADD12RoundRect,0.25X-0.75X-0.5X0.75X-0.5X0.75X0.5X-0.75X0.5X0*%
+D12*
+X1000000Y2000000D03*
+M02*
+'''
+
+
+class Recorder(GerberParser):
+    def __init__(self):
+        super(Recorder, self).__init__()
+        self.flashes = []
+        self.draws = []
+        self.contours = []
+
+    def on_flash(self, x, y, aperture):
+        self.flashes.append((round(x, 6), round(y, 6), aperture.code, self.dark))
+
+    def on_draw(self, x0, y0, x1, y1, aperture):
+        self.draws.append(tuple(round(value, 6) for value in (x0, y0, x1, y1)))
+
+    def on_contour(self, points):
+        self.contours.append([(round(x, 6), round(y, 6)) for x, y in points])
+
+
+def record(text):
+    parser = Recorder()
+    parser.parse(io.StringIO(text))
+    return parser
+
+
+def test_macro_round_rect():
+    parser = record(ROUND_RECT)
+    aperture = parser.apertures[12]
+    assert parser.flashes == [(1.0, 2.0, 12, True)]
+    # 2 x 1.5 mm box with 0.25 mm corner radii
+    expected = 2.0 * 1.5 - (4 - math.pi) * 0.25 ** 2
+    assert aperture.area == pytest.approx(expected, rel=0.03)
+    assert aperture.extent == pytest.approx(math.hypot(0.75, 0.5) + 0.25)
+    assert aperture.contains(0.99, 0.0)
+    assert not aperture.contains(0.99, 0.74)
+
+
+def test_macro_variables_and_expressions():
+    variables = {1: 0.5, 2: 3.0}
+    assert gerber_parser.evaluate('$1+$2x2', variables) == pytest.approx(6.5)
+    assert gerber_parser.evaluate('($2-$1)/2', variables) == pytest.approx(1.25)
+    assert gerber_parser.evaluate('$7', variables) == 0.0
+    with pytest.raises(GerberError):
+        gerber_parser.evaluate('__import__("os")', variables)
+
+
+def test_macro_assignment_and_scale():
+    body = ['$3=$1x2', '21,1,$3,$2,0,0,0']
+    aperture = gerber_parser.make_macro_aperture(10, 'BOX', body, [1.0, 0.5],
+                                                 gerber_parser.MM_PER_INCH)
+    xs = [x for x, y in aperture.shapes[0][2]]
+    ys = [y for x, y in aperture.shapes[0][2]]
+    assert max(xs) - min(xs) == pytest.approx(2.0 * gerber_parser.MM_PER_INCH)
+    assert max(ys) - min(ys) == pytest.approx(0.5 * gerber_parser.MM_PER_INCH)
+
+
+def test_macro_thermal_is_a_ring():
+    aperture = gerber_parser.make_macro_aperture(10, 'THERMAL', ['7,0,0,2,1,0.2,0'], [], 1.0)
+    assert aperture.contains(0.75, 0.0)
+    assert not aperture.contains(0.25, 0.0)
+
+
+def test_unknown_primitive():
+    with pytest.raises(GerberError):
+        gerber_parser.make_macro_aperture(10, 'X', ['99,1,0'], [], 1.0)
+
+
+def test_standard_apertures():
+    circle = gerber_parser.make_standard_aperture(10, 'C', [0.5])
+    assert circle.area == pytest.approx(math.pi * 0.0625)
+    assert circle.width == 0.5
+    oblong = gerber_parser.make_standard_aperture(11, 'O', [1.0, 2.0])
+    assert oblong.area == pytest.approx(1.0 + math.pi / 4)
+    assert oblong.width == 1.0
+    assert oblong.extent == pytest.approx(1.0)
+
+
+def test_coordinates_modal_and_inch():
+    parser = record('%FSLAX24Y24*%\n%MOIN*%\n%ADD10C,0.01*%\nD10*\n'
+                    'X10000Y10000D02*\nX20000D01*\nY0D01*\nM02*\n')
+    assert parser.draws == [(25.4, 25.4, 50.8, 25.4), (50.8, 25.4, 50.8, 0.0)]
+
+
+def test_polarity_and_regions():
+    parser = record('%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,1*%\n%LPC*%\nD10*\nX0Y0D03*\n%LPD*%\n'
+                    'G36*\nX0Y0D02*\nX1000000Y0D01*\nX1000000Y1000000D01*\nX0Y0D01*\nG37*\n'
+                    'M02*\n')
+    assert parser.flashes == [(0.0, 0.0, 10, False)]
+    assert parser.contours == [[(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 0.0)]]
+
+
+def test_arc_is_split_into_draws():
+    parser = record('%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,0.1*%\nD10*\nG75*\n'
+                    'X1000000Y0D02*\nG03X-1000000Y0I-1000000J0D01*\nM02*\n')
+    assert parser.draws[0][:2] == (1.0, 0.0)
+    assert parser.draws[-1][2:] == (-1.0, 0.0)
+    for x0, y0, x1, y1 in parser.draws:
+        assert math.hypot(x1, y1) == pytest.approx(1.0, abs=1e-6)
+        assert y1 >= -1e-9
+
+
+def test_statements_split_across_chunks():
+    text = ROUND_RECT.replace('\n', '')
+    statements = list(gerber_parser.iter_statements(io.StringIO(text)))
+    assert (False, 'X1000000Y2000000D03') in statements
+    assert statements[0] == (True, 'FSLAX46Y46*')
+
+
+def test_helpers(tmp_path):
+    for name in ('board-F_Cu.gbr', 'board-Edge_Cuts.gbr', 'board-PTH.drl'):
+        (tmp_path / name).write_text('')
+    assert [name.rsplit('/', 1)[-1].rsplit('\\', 1)[-1]
+            for name in gerber_parser.get_gerber_files(str(tmp_path))] == \
+        ['board-Edge_Cuts.gbr', 'board-F_Cu.gbr']
+    assert gerber_parser.is_copper('out/board-In1_Cu.gbr')
+    assert not gerber_parser.is_copper('out/board-Edge_Cuts.gbr')
+    assert gerber_parser.merge_bbox([None, [0, 1, 2, 3], [-1, 2, 1, 5]]) == [-1, 1, 2, 5]
+    assert gerber_parser.merge_bbox([None]) is None
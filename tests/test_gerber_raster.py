@@ -0,0 +1,126 @@
+# coding: utf8
+# test_gerber_raster.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import math
+import os
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import gerber_raster
+
+
+# a 1 mm pad, a 0.5 mm trace 8 mm long and a 4 x 2 mm region
+COPPER = '''%FSLAX46Y46*%
+%MOMM*%
+%ADD10C,1.000000*%
+%ADD11C,0.500000*%
+D10*
+X0Y0D03*
+D11*
+X2000000Y0D02*
+X10000000Y0D01*
+G36*
+X0Y5000000D02*
+X4000000Y5000000D01*
+X4000000Y7000000D01*
+X0Y7000000D01*
+X0Y5000000D01*
+G37*
+M02*
+'''
+
+OUTLINE = '''%FSLAX46Y46*%
+%MOMM*%
+%ADD10C,0.100000*%
+D10*
+X-2000000Y-2000000D02*
+X12000000Y-2000000D01*
+X12000000Y9000000D01*
+X-2000000Y9000000D01*
+X-2000000Y-2000000D01*
+M02*
+'''
+
+
+def write(path, name, text):
+    file_name = os.path.join(str(path), name)
+    with open(file_name, 'w') as f:
+        f.write(text)
+    return file_name
+
+
+def get_dark_area(canvas):
+    return canvas.image.sum() * canvas.pixel ** 2
+
+
+def test_render_area(tmp_path):
+    layer = gerber_raster.load_layer(write(tmp_path, 'board-F_Cu.gbr', COPPER))
+    bbox = layer.get_bbox()
+    assert bbox == pytest.approx([-0.5, -0.5, 10.25, 7.0])
+
+    canvas = gerber_raster.render(layer, gerber_raster.get_canvas_bbox([bbox]), dpi=1000)
+    area = math.pi * 0.25 + 8 * 0.5 + math.pi * 0.0625 + 8.0
+    assert get_dark_area(canvas) == pytest.approx(area, rel=0.02)
+
+
+def test_clear_flash(tmp_path):
+    layer = gerber_raster.load_layer(write(tmp_path, 'board-F_Cu.gbr',
+                                           '%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,2.000000*%\n'
+                                           '%ADD11C,1.000000*%\nD10*\nX0Y0D03*\n%LPC*%\n'
+                                           'D11*\nX0Y0D03*\nM02*\n'))
+    canvas = gerber_raster.render(layer, gerber_raster.get_canvas_bbox([layer.get_bbox()]),
+                                  dpi=1000)
+    assert get_dark_area(canvas) == pytest.approx(math.pi * 0.75, rel=0.02)
+    # the clear hole in the middle
+    assert not canvas.image[canvas.to_rows(0.0), canvas.to_cols(0.0)]
+
+
+def test_density_grid():
+    image = numpy.zeros((4, 6), dtype=bool)
+    image[:2, :2] = True
+    grid = gerber_raster.get_density_grid(image, 1.0, cell=4.0)
+    # the cells on the right are cut to 4 x 2 pixels
+    assert grid.tolist() == [[0.25, 0.0]]
+
+
+def test_layer_colors():
+    assert gerber_raster.get_layer_color('board-In1_Cu') == (200, 140, 50)
+    assert gerber_raster.get_layer_color('board-Edge_Cuts') == (230, 220, 60)
+    assert gerber_raster.get_layer_color('board-User_1') == gerber_raster.DEFAULT_COLOR
+
+
+def test_write_previews(tmp_path):
+    write(tmp_path, 'board-F_Cu.gbr', COPPER)
+    write(tmp_path, 'board-Edge_Cuts.gbr', OUTLINE)
+    density = gerber_raster.write_previews(str(tmp_path), dpi=100, cell=5.0)
+
+    for name in ('board-F_Cu', 'board-Edge_Cuts'):
+        with open(str(tmp_path / (name + gerber_raster.PREVIEW_EXT)), 'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+    # Edge_Cuts is not copper and has no density grid
+    assert sorted(density['layers']) == ['board-F_Cu']
+    # one canvas for all layers, around the outline
+    assert density['bbox'] == pytest.approx([-3.05, -3.05, 13.05, 10.05])
+    grid = density['layers']['board-F_Cu']['grid']
+    # 16.1 x 13.1 mm in 5 mm cells
+    assert (len(grid), len(grid[0])) == (3, 4)
+    with open(str(tmp_path / gerber_raster.DENSITY_NAME)) as f:
+        assert json.load(f) == density
@@ -0,0 +1,102 @@
+# coding: utf8
+# test_gerber_stats.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import math
+import os
+
+import pytest
+
+import gerber_stats
+
+
+COPPER = '''%FSLAX46Y46*%
+%MOMM*%
+%ADD10R,1.000000X2.000000*%
+%ADD11C,0.500000*%
+D10*
+X0Y0D03*
+X5000000Y0D03*
+D11*
+X0Y5000000D02*
+X10000000Y5000000D01*
+G36*
+X0Y10000000D02*
+X2000000Y10000000D01*
+X2000000Y12000000D01*
+X0Y12000000D01*
+X0Y10000000D01*
+G37*
+M02*
+'''
+
+OUTLINE = '''%FSLAX46Y46*%
+%MOIN*%
+%ADD10C,0.004000*%
+D10*
+X-1000000Y-1000000D02*
+X1000000Y-1000000D01*
+X1000000Y1000000D01*
+X-1000000Y1000000D01*
+X-1000000Y-1000000D01*
+M02*
+'''
+
+
+@pytest.fixture
+def output(tmp_path):
+    (tmp_path / 'board-F_Cu.gbr').write_text(COPPER)
+    (tmp_path / 'board-B_Cu.gbr').write_text(COPPER)
+    (tmp_path / 'board-Edge_Cuts.gbr').write_text(OUTLINE)
+    return str(tmp_path)
+
+
+def test_layer_stats(output):
+    stats = gerber_stats.get_file_stats(os.path.join(output, 'board-F_Cu.gbr'))
+    assert stats['flashes'] == 2
+    assert stats['draws'] == 1
+    assert stats['regions'] == 1
+    assert stats['apertures']['D10']['flashes'] == 2
+    assert stats['apertures']['D11']['draws'] == 1
+    # two pads, a 10 mm trace and a 2 x 2 mm region
+    assert stats['dark_area'] == pytest.approx(2 * 2.0 + 10 * 0.5 + 4.0, abs=1e-3)
+    # flashes extend the box by their extent, the half diagonal of the pad
+    assert stats['bbox'] == [-1.118, -1.118, 10.25, 12.0]
+
+
+def test_board_stats(output):
+    stats = gerber_stats.write_stats(output, jobs=2)
+    with open(os.path.join(output, gerber_stats.STATS_NAME)) as f:
+        assert json.load(f) == stats
+
+    board = stats['board']
+    # the inch outline with its stroke, Edge_Cuts is not copper
+    assert board['width'] == pytest.approx(2 * 25.4 + 0.004 * 25.4, abs=1e-3)
+    assert board['copper_area'] == pytest.approx(2 * 13.0, abs=1e-2)
+    assert sorted(stats['layers']) == ['board-B_Cu.gbr', 'board-Edge_Cuts.gbr',
+                                       'board-F_Cu.gbr']
+
+
+def test_clear_objects_are_subtracted(tmp_path):
+    (tmp_path / 'board-F_Cu.gbr').write_text('%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,2.000000*%\n'
+                                             '%ADD11C,1.000000*%\nD10*\nX0Y0D03*\n%LPC*%\n'
+                                             'D11*\nX0Y0D03*\nM02*\n')
+    stats = gerber_stats.get_file_stats(str(tmp_path / 'board-F_Cu.gbr'))
+    assert stats['dark_area'] == pytest.approx(math.pi * (1.0 - 0.25), abs=1e-3)
+    # the clear flash does not extend the box
+    assert stats['bbox'] == [-1.0, -1.0, 1.0, 1.0]
@@ -0,0 +1,145 @@
+# coding: utf8
+# test_output_staging.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+import output_staging
+
+
+def write(file_name, text):
+    with open(str(file_name), 'w') as f:
+        f.write(text)
+
+
+def read(file_name):
+    with open(str(file_name)) as f:
+        return f.read()
+
+
+def wait_removed(path):
+    for old in output_staging.get_old_dirs(path):
+        output_staging.remove_tree(old)
+
+
+def test_swap_publishes_on_success(tmp_path):
+    path = str(tmp_path / 'gerber')
+    os.makedirs(path)
+    write(os.path.join(path, 'old.gbr'), 'old')
+
+    with output_staging.swap(path) as staging:
+        assert staging == path + output_staging.STAGING_SUFFIX
+        write(os.path.join(staging, 'new.gbr'), 'new')
+        # readers still see the previous outputs
+        assert os.listdir(path) == ['old.gbr']
+
+    wait_removed(path)
+    assert os.listdir(path) == ['new.gbr']
+    assert not os.path.exists(path + output_staging.STAGING_SUFFIX)
+
+
+def test_swap_keeps_outputs_on_failure(tmp_path):
+    path = str(tmp_path / 'gerber')
+    os.makedirs(path)
+    write(os.path.join(path, 'old.gbr'), 'old')
+
+    with pytest.raises(RuntimeError):
+        with output_staging.swap(path) as staging:
+            write(os.path.join(staging, 'new.gbr'), 'new')
+            raise RuntimeError()
+
+    wait_removed(path)
+    assert os.listdir(path) == ['old.gbr']
+    assert not os.path.exists(path + output_staging.STAGING_SUFFIX)
+
+
+def test_swap_removes_leftovers(tmp_path):
+    path = str(tmp_path / 'gerber')
+    os.makedirs(path + output_staging.STAGING_SUFFIX)
+    write(os.path.join(path + output_staging.STAGING_SUFFIX, 'crashed.gbr'), '')
+
+    with output_staging.swap(path) as staging:
+        assert os.listdir(staging) == []
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='removing read-only files differs')
+def test_remove_tree_with_read_only_files(tmp_path):
+    path = str(tmp_path / 'old')
+    os.makedirs(path)
+    write(os.path.join(path, 'layer.gbr'), '')
+    os.chmod(os.path.join(path, 'layer.gbr'), 0o444)
+    output_staging.remove_tree(path)
+    assert not os.path.exists(path)
+
+
+@pytest.fixture
+def locked_path(tmp_path):
+    ''' Output path locked by another process until the fixture ends '''
+    path = str(tmp_path / 'gerber')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    holder = subprocess.Popen([sys.executable, '-c', textwrap.dedent('''
+        import sys
+        sys.path.insert(0, {0!r})
+        import output_staging
+        with output_staging.lock({1!r}):
+            print('locked', flush=True)
+            sys.stdin.read()
+        ''').format(root, path)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    assert holder.stdout.readline().strip() == b'locked'
+    yield path
+    holder.communicate()
+
+
+def test_lock_timeout(locked_path):
+    with pytest.raises(output_staging.OutputLocked):
+        with output_staging.lock(locked_path, timeout=0.3):
+            pass
+
+
+def test_lock_wait_can_give_up(locked_path):
+    messages = []
+
+    def wait(message):
+        messages.append(message)
+        if len(messages) == 2:
+            raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        with output_staging.swap(locked_path, wait=wait):
+            pass
+    assert messages == [output_staging.LOCKED_MESSAGE] * 2
+    assert not os.path.exists(locked_path + output_staging.STAGING_SUFFIX)
+
+
+def test_lock_is_released(tmp_path):
+    path = str(tmp_path / 'gerber')
+    with output_staging.lock(path):
+        pass
+    with output_staging.lock(path, timeout=0):
+        pass
+
+
+def test_unique_paths(tmp_path):
+    path = str(tmp_path / 'gerber')
+    paths = set(output_staging.get_unique_path(path) for i in range(100))
+    assert len(paths) == 100
+    assert all(unique.startswith(path + '-') for unique in paths)
@@ -0,0 +1,107 @@
+# coding: utf8
+# test_output_zip.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import zipfile
+
+import pytest
+
+import output_zip
+
+
+FILES = {
+    'board-F_Cu.gbr': b'G04 #@! TF.CreationDate,2023-05-01T12:00:00+03:00*\n' +
+                      b''.join(b'X%dY%dD03*\n' % (i, 2 * i) for i in range(20000)),
+    'board-PTH.drl': b'M48\n; DRILL file {KiCad 7.0.5} date 2023-05-01T12:00:00+0300\n%\nM30\n',
+    'empty.txt': b'',
+    'panel/board-F_Cu.gbr': b'X0Y0D03*\nM02*\n',
+}
+
+
+def make_output(path, files=FILES):
+    for name, data in files.items():
+        file_name = os.path.join(str(path), *name.split('/'))
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, 'wb') as f:
+            f.write(data)
+
+
+def write_zip(path, precompressed=True, **options):
+    archive = output_zip.ZipOutput(str(path), 'board', **options)
+    archive.precompressed = archive.precompressed and precompressed
+    archive.add('board-F_Cu.gbr')
+    archive.close('stamp')
+    return str(path / 'board.zip')
+
+
+@pytest.mark.parametrize('precompressed', (True, False))
+@pytest.mark.parametrize('method', sorted(output_zip.METHODS))
+def test_round_trip(tmp_path, method, precompressed):
+    make_output(tmp_path)
+    with zipfile.ZipFile(write_zip(tmp_path, precompressed, method=method)) as f:
+        assert f.testzip() is None
+        assert sorted(f.namelist()) == sorted(FILES)
+        for name, data in FILES.items():
+            assert f.read(name) == data
+        assert f.comment == b'stamp'
+
+
+@pytest.mark.parametrize('method', sorted(output_zip.METHODS))
+def test_deterministic(tmp_path, method):
+    contents = []
+    for run, date in enumerate((b'2023-05-01', b'2024-01-02')):
+        path = tmp_path / str(run)
+        files = dict((name, data.replace(b'2023-05-01', date)) for name, data in FILES.items())
+        make_output(path, files)
+        mtime = 1600000000 + run * 1000
+        os.utime(str(path / 'board-PTH.drl'), (mtime, mtime))
+        with open(write_zip(path, method=method, deterministic=True), 'rb') as f:
+            contents.append(f.read())
+
+    assert contents[0] == contents[1]
+    with zipfile.ZipFile(str(tmp_path / '0' / 'board.zip')) as f:
+        assert f.namelist() == sorted(FILES)
+        assert b'CreationDate' not in f.read('board-F_Cu.gbr')
+    with open(str(tmp_path / '0' / ('board.zip' + output_zip.STAMP_SUFFIX))) as f:
+        assert f.read() == 'stamp'
+
+
+def test_precompressed_matches_writestr(tmp_path):
+    contents = []
+    for precompressed in (True, False):
+        path = tmp_path / str(precompressed)
+        make_output(path)
+        with open(write_zip(path, precompressed, deterministic=True), 'rb') as f:
+            contents.append(f.read())
+    assert contents[0] == contents[1]
+
+
+def test_abort_closes_the_file(tmp_path):
+    make_output(tmp_path)
+    with pytest.raises(RuntimeError):
+        with output_zip.ZipOutput(str(tmp_path), 'board') as archive:
+            archive.add('board-F_Cu.gbr')
+            raise RuntimeError()
+    assert archive.zip_file.fp is None
+
+
+@pytest.mark.parametrize('method, level', (('lzma', 5), ('stored', 1), ('deflate', 10),
+                                           ('bzip2', 0)))
+def test_bad_level(tmp_path, method, level):
+    with pytest.raises(ValueError):
+        output_zip.ZipOutput(str(tmp_path), 'board', method, level)
@@ -0,0 +1,114 @@
+# coding: utf8
+# test_plot_cache.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import pytest
+
+import plot_cache
+
+
+def write(path, name, text):
+    with open(os.path.join(str(path), name), 'w') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def board_file(tmp_path):
+    file_name = str(tmp_path / 'board.kicad_pcb')
+    write(tmp_path, 'board.kicad_pcb', '(kicad_pcb (version 20221018))')
+    return file_name
+
+
+@pytest.fixture
+def output(tmp_path):
+    path = tmp_path / 'gerber'
+    path.mkdir()
+    write(path, 'board-F_Cu.gbr', 'copper')
+    write(path, 'board-B_Cu.gbr', 'bottom')
+    write(path, 'board.zip', 'archive')
+    return str(path)
+
+
+def test_make_key(board_file):
+    key = plot_cache.make_key(board_file, ('options', 1))
+    assert key == plot_cache.make_key(board_file, ('options', 1))
+    assert key != plot_cache.make_key(board_file, ('options', 2))
+
+    with open(board_file, 'a') as f:
+        f.write('\n')
+    assert key['board_sha256'] != plot_cache.make_key(board_file, ('options', 1))['board_sha256']
+
+
+def test_manifest_round_trip(board_file, output):
+    key = plot_cache.make_key(board_file, ())
+    plot_cache.write_manifest(output, key, {'F.Cu': 'a', 'B.Cu': 'b'},
+                              {'F.Cu': 'board-F_Cu.gbr'}, {'F.Cu': 3})
+
+    manifest = plot_cache.load_manifest(output)
+    assert manifest['key'] == key
+    assert manifest['layers'] == {'F.Cu': {'fingerprint': 'a', 'file': 'board-F_Cu.gbr',
+                                           'items': 3}}
+    assert sorted(manifest['files']) == ['board-B_Cu.gbr', 'board-F_Cu.gbr', 'board.zip']
+    assert manifest['files']['board-F_Cu.gbr'] == {
+        'size': 6,
+        'sha256': plot_cache.file_sha256(os.path.join(output, 'board-F_Cu.gbr')),
+    }
+    assert plot_cache.is_up_to_date(output, key)
+
+
+def test_stale_output(board_file, output):
+    key = plot_cache.make_key(board_file, ())
+    plot_cache.write_manifest(output, key)
+
+    assert not plot_cache.is_up_to_date(output, plot_cache.make_key(board_file, ('other',)))
+    write(output, 'board.zip', 'truncated')
+    assert not plot_cache.is_up_to_date(output, key)
+
+    plot_cache.write_manifest(output, key)
+    os.remove(os.path.join(output, 'board-B_Cu.gbr'))
+    assert not plot_cache.is_up_to_date(output, key)
+
+
+def test_no_manifest(board_file, output, tmp_path):
+    key = plot_cache.make_key(board_file, ())
+    assert not plot_cache.is_up_to_date(output, key)
+    assert not plot_cache.is_up_to_date(str(tmp_path / 'missing'), key)
+    write(output, plot_cache.MANIFEST_NAME, '{')
+    assert plot_cache.load_manifest(output) is None
+
+
+def test_prepare_output_keeps_unchanged_layers(output, tmp_path):
+    plot_cache.write_manifest(output, {}, {'F.Cu': 'a', 'B.Cu': 'b'},
+                              {'F.Cu': 'board-F_Cu.gbr', 'B.Cu': 'board-B_Cu.gbr'})
+    staging = str(tmp_path / 'staging')
+    os.makedirs(staging)
+
+    kept = plot_cache.prepare_output(output, staging, {'F.Cu': 'a', 'B.Cu': 'changed'})
+    assert kept == {'F.Cu': 'board-F_Cu.gbr'}
+    assert os.listdir(staging) == ['board-F_Cu.gbr']
+    # the same file system, so linked rather than copied
+    assert os.path.samefile(os.path.join(staging, 'board-F_Cu.gbr'),
+                            os.path.join(output, 'board-F_Cu.gbr'))
+
+
+def test_prepare_output_without_manifest(output, tmp_path):
+    staging = str(tmp_path / 'staging')
+    os.makedirs(staging)
+    assert plot_cache.prepare_output(output, staging, {'F.Cu': 'a'}) == {}
+    assert os.listdir(staging) == []
@@ -0,0 +1,70 @@
+# coding: utf8
+# test_plot_daemon.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import socket
+
+import pytest
+
+import plot_daemon
+
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix sockets')
+
+
+def handle(data, hang_up=False):
+    ''' Reply of the daemon to one connection, None if the client hung up '''
+    daemon = plot_daemon.PlotDaemon('unused')
+    client, server = socket.socketpair()
+    with client, server:
+        client.sendall(data)
+        if hang_up:
+            client.close()
+        daemon.handle(server)
+        if hang_up:
+            return None
+        return json.loads(client.makefile('rb').readline().decode('utf-8'))
+
+
+@pytest.mark.parametrize('data', (
+    b'{"command": "plot"}\n',
+    b'[1, 2]\n',
+    b'"plot"\n',
+    b'not json\n',
+    b'\xff\n',
+    b'\n',
+))
+def test_bad_request_is_an_error_reply(data):
+    reply = handle(data)
+    assert reply['status'] == 'error'
+    assert reply['error']
+
+
+def test_unknown_command():
+    assert handle(b'{"command": "nothing"}\n') == {'status': 'error',
+                                                   'error': 'unknown command: nothing'}
+
+
+def test_stats():
+    reply = handle(b'{"command": "stats"}\n')
+    assert reply['status'] == 'ok'
+    assert reply['jobs'] == 0
+
+
+def test_client_hang_up():
+    handle(b'{"command": "stats"}\n', hang_up=True)
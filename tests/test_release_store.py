@@ -0,0 +1,118 @@
+# coding: utf8
+# test_release_store.py
+#
+# Copyright (C) 2019-2023 Eldar Khayrullin <eldar.khayrullin@mail.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+
+import pytest
+
+import plot_cache
+import release_store
+
+
+def write(path, name, text):
+    file_name = os.path.join(str(path), name)
+    if os.path.exists(file_name):
+        # released files are read-only links of their blobs, a new run writes new files
+        os.remove(file_name)
+    with open(file_name, 'w') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def output(tmp_path):
+    path = tmp_path / 'gerber'
+    path.mkdir()
+    write(path, 'board-F_Cu.gbr', 'copper')
+    write(path, 'board-B_Cu.gbr', 'bottom')
+    os.makedirs(str(path / 'panel'))
+    write(path / 'panel', 'board-F_Cu.gbr', 'panel copper')
+    plot_cache.write_manifest(str(path), {})
+    return str(path)
+
+
+def get_blobs(store):
+    objects = os.path.join(store, release_store.OBJECTS_DIR)
+    return [os.path.join(d, name) for d, dirs, names in os.walk(objects) for name in names]
+
+
+def test_dedup(output, tmp_path):
+    store = str(tmp_path / 'store')
+    first = release_store.add_release(store, 'board', 'rev.1', {'gerber': output})
+    second = release_store.add_release(store, 'board', 'rev.2', {'gerber': output})
+
+    assert first == second
+    assert sorted(first) == ['gerber/board-B_Cu.gbr', 'gerber/board-F_Cu.gbr',
+                             'gerber/panel/board-F_Cu.gbr']
+    assert len(get_blobs(store)) == 3
+    assert release_store.list_releases(store, 'board') == ['rev.1', 'rev.2']
+    for name, sha in first.items():
+        blob = release_store.get_blob_path(store, sha)
+        assert plot_cache.file_sha256(blob) == sha
+        assert stat.S_IMODE(os.stat(blob).st_mode) == release_store.BLOB_MODE
+
+
+def test_store_on_another_file_system(output, tmp_path, monkeypatch):
+    def link(source, destination):
+        raise OSError(18, 'Invalid cross-device link')
+
+    monkeypatch.setattr(release_store.os, 'link', link)
+    store = str(tmp_path / 'store')
+    files = release_store.add_release(store, 'board', 'rev.1', {'gerber': output})
+
+    file_name = os.path.join(output, 'board-F_Cu.gbr')
+    blob = release_store.get_blob_path(store, files['gerber/board-F_Cu.gbr'])
+    assert not os.path.samefile(blob, file_name)
+    assert stat.S_IMODE(os.stat(blob).st_mode) == release_store.BLOB_MODE
+    # only a copy of the blob, it stays writable
+    assert os.stat(file_name).st_mode & stat.S_IWUSR
+
+
+def test_same_file_in_two_outputs_is_one_blob(output, tmp_path):
+    other = tmp_path / 'design'
+    other.mkdir()
+    write(other, 'copy.gbr', 'copper')
+    store = str(tmp_path / 'store')
+    files = release_store.add_release(store, 'board', 'rev.1',
+                                      {'gerber': output, 'design': str(other)})
+    assert files['design/copy.gbr'] == files['gerber/board-F_Cu.gbr']
+    assert len(get_blobs(store)) == 3
+
+
+def test_diff(output, tmp_path):
+    store = str(tmp_path / 'store')
+    release_store.add_release(store, 'board', 'rev.1', {'gerber': output})
+
+    # same size, the manifest still has the old hash
+    write(output, 'board-B_Cu.gbr', 'BOTTOM')
+    os.remove(os.path.join(output, 'board-F_Cu.gbr'))
+    write(output, 'board-In1_Cu.gbr', 'inner')
+    release_store.add_release(store, 'board', 'rev.2', {'gerber': output})
+
+    assert release_store.diff_releases(store, 'board', 'rev.1', 'rev.2') == {
+        'added': ['gerber/board-In1_Cu.gbr'],
+        'removed': ['gerber/board-F_Cu.gbr'],
+        'changed': ['gerber/board-B_Cu.gbr'],
+        'unchanged': ['gerber/panel/board-F_Cu.gbr'],
+    }
+
+
+def test_run_files_are_not_stored(output, tmp_path):
+    store = str(tmp_path / 'store')
+    files = release_store.add_release(store, 'board', 'rev.1', {'gerber': output})
+    assert 'gerber/' + plot_cache.MANIFEST_NAME not in files